@@ -1,4 +1,60 @@
-"""Interface with dbSNP VCF data"""
+"""Interface with dbSNP VCF data
 
-from pydbsnp.env import VCF_GRCH37, VCF_GRCH38, RSID_GRCH37, RSID_GRCH38
-from pydbsnp.query import CHROM_TO_HGVS, Variant, GeneralizedVariant
\ No newline at end of file
+The names below are imported from their modules on first access, so that
+importing pydbsnp, or running one of its command line tools, only loads pysam
+and the lookup machinery when they are used.
+"""
+
+import importlib
+
+_EXPORTS = {
+    'get_backend': 'pydbsnp.backends',
+    'BlockCache': 'pydbsnp.bgzf',
+    'configure_block_cache': 'pydbsnp.bgzf',
+    'get_block_cache': 'pydbsnp.bgzf',
+    'LookupCache': 'pydbsnp.cache',
+    'configure_cache': 'pydbsnp.cache',
+    'get_cache': 'pydbsnp.cache',
+    'VCF_GRCH37': 'pydbsnp.env',
+    'VCF_GRCH38': 'pydbsnp.env',
+    'RSID_GRCH37': 'pydbsnp.env',
+    'RSID_GRCH38': 'pydbsnp.env',
+    'HandlePool': 'pydbsnp.handles',
+    'get_pool': 'pydbsnp.handles',
+    'close_all': 'pydbsnp.handles',
+    'contains': 'pydbsnp.membership',
+    'contains_many': 'pydbsnp.membership',
+    'Metrics': 'pydbsnp.metrics',
+    'nearest': 'pydbsnp.neighbors',
+    'nearest_many': 'pydbsnp.neighbors',
+    'add_metrics_hook': 'pydbsnp.metrics',
+    'enable_metrics': 'pydbsnp.metrics',
+    'get_metrics': 'pydbsnp.metrics',
+    'remove_metrics_hook': 'pydbsnp.metrics',
+    'CHROM_TO_HGVS': 'pydbsnp.query',
+    'NOT_FOUND': 'pydbsnp.query',
+    'Variant': 'pydbsnp.query',
+    'GeneralizedVariant': 'pydbsnp.query',
+    'iter_lookup_rows': 'pydbsnp.query',
+    'lookup_many': 'pydbsnp.query',
+    'lookup_records': 'pydbsnp.query',
+    'Record': 'pydbsnp.record',
+    'lookup_allele': 'pydbsnp.alleles',
+    'lookup_alleles': 'pydbsnp.alleles',
+    'annotate': 'pydbsnp.annotation',
+    'fetch_regions': 'pydbsnp.regions',
+    'fetch_genes': 'pydbsnp.genes'
+}
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module 'pydbsnp' has no attribute '{name}'")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
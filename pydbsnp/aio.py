@@ -0,0 +1,279 @@
+#===============================================================================
+# aio.py
+#===============================================================================
+
+"""asyncio interface to dbSNP lookups
+
+Lookups run on a bounded thread pool whose threads each have their own tabix
+handles, so awaiting them never blocks the event loop on file I/O or
+decompression. Concurrent requests for the same variant share one lookup.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import asyncio
+import weakref
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+
+from pydbsnp.env import AIO_WORKERS
+from pydbsnp.handles import (
+    CANONICAL_BUILD, release_thread_pools, use_thread_pools
+)
+from pydbsnp.query import (
+    NOT_FOUND, GeneralizedVariant, lookup_rows, parse_query
+)
+
+
+
+
+# Constants ====================================================================
+
+AIO_BATCH_SIZE = 1000
+_EXECUTOR = None
+_WORKER_POOLS = []
+
+# In-flight lookups of each event loop, keyed by (build, parsed query), each
+# with its future and number of waiters
+_IN_FLIGHT = weakref.WeakKeyDictionary()
+
+
+
+
+# Functions ====================================================================
+
+def _init_worker():
+    _WORKER_POOLS.append(use_thread_pools())
+
+
+def get_executor():
+    """Return the executor that runs lookups, creating it if necessary
+
+    Returns
+    -------
+    ThreadPoolExecutor
+        executor with PYDBSNP_AIO_WORKERS threads
+    """
+
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(
+            max_workers=AIO_WORKERS,
+            thread_name_prefix='pydbsnp',
+            initializer=_init_worker
+        )
+    return _EXECUTOR
+
+
+def configure_executor(max_workers=AIO_WORKERS):
+    """Replace the executor that runs lookups
+
+    Parameters
+    ----------
+    max_workers : int
+        number of threads, each with its own tabix handles
+
+    Returns
+    -------
+    ThreadPoolExecutor
+        the new executor
+    """
+
+    global _EXECUTOR
+    shutdown()
+    _EXECUTOR = ThreadPoolExecutor(
+        max_workers=max_workers,
+        thread_name_prefix='pydbsnp',
+        initializer=_init_worker
+    )
+    return _EXECUTOR
+
+
+def shutdown(wait=True):
+    """Shut down the executor. If wait is True, the handles of its threads
+    are closed once running lookups finish. A new executor is created on the
+    next lookup.
+
+    Parameters
+    ----------
+    wait : bool
+        wait for running lookups to finish
+    """
+
+    global _EXECUTOR
+    if _EXECUTOR is not None:
+        _EXECUTOR.shutdown(wait=wait)
+        _EXECUTOR = None
+    if wait:
+        for pools in _WORKER_POOLS:
+            release_thread_pools(pools)
+        _WORKER_POOLS.clear()
+
+
+def to_variant(result):
+    """Convert a lookup_rows result to a GeneralizedVariant or NOT_FOUND"""
+
+    coordinates, rows = result
+    if not rows:
+        return NOT_FOUND
+    chrom, pos = zip(*coordinates)
+    return GeneralizedVariant.from_rows(chrom, pos, rows)
+
+
+async def fetch_variant(
+    chrom=None,
+    pos=None,
+    id=None,
+    reference_build='GRCh38'
+):
+    """Look up a variant without blocking the event loop. Input parameters
+    should be either `chrom` and `pos` or `id`, as for GeneralizedVariant.
+
+    Concurrent calls for the same variant share one lookup. Cancelling a call
+    cancels the lookup only if no other call is waiting for it and it has not
+    started; a lookup already running finishes in its thread and its result
+    is cached.
+
+    Parameters
+    ----------
+    chrom
+        chromosome of the variant
+    pos
+        position of the variant
+    id
+        rsid of the variant
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    GeneralizedVariant
+        the variant
+
+    Raises
+    ------
+    ValueError
+        if dbSNP has no record for the variant
+
+    Examples
+    --------
+    variant = await fetch_variant(id='rs231361')
+    variant = await fetch_variant('chr8', 118184783)
+    """
+
+    if chrom and pos and not id:
+        query = f'{chrom}:{pos}'
+    elif id and not (chrom or pos):
+        query = id
+    else:
+        raise RuntimeError('Invalid input parameters')
+    key = (
+        CANONICAL_BUILD[reference_build],
+        parse_query(query, reference_build=reference_build)
+    )
+    loop = asyncio.get_running_loop()
+    in_flight = _IN_FLIGHT.setdefault(loop, {})
+    entry = in_flight.get(key)
+    if entry is None:
+        future = loop.run_in_executor(
+            get_executor(),
+            partial(lookup_rows, (query,), reference_build=reference_build)
+        )
+        entry = in_flight[key] = [future, 0]
+        future.add_done_callback(
+            lambda _: in_flight.pop(key)
+            if in_flight.get(key) is entry else None
+        )
+    entry[1] += 1
+    try:
+        result, = await asyncio.shield(entry[0])
+    except asyncio.CancelledError:
+        if entry[1] == 1:
+            entry[0].cancel()
+        raise
+    finally:
+        entry[1] -= 1
+    variant = to_variant(result)
+    if variant is NOT_FOUND:
+        raise ValueError(f'{query} was not found in dbSNP')
+    return variant
+
+
+async def _batches(ids_or_coords, batch_size):
+    if hasattr(ids_or_coords, '__aiter__'):
+        batch = []
+        async for variant in ids_or_coords:
+            batch.append(variant)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    else:
+        ids_or_coords = iter(ids_or_coords)
+        for batch in iter(lambda: list(islice(ids_or_coords, batch_size)), []):
+            yield batch
+
+
+async def fetch_many(
+    ids_or_coords,
+    reference_build='GRCh38',
+    batch_size=AIO_BATCH_SIZE
+):
+    """Look up many variants without blocking the event loop
+
+    Queries are looked up in batches, and the next batch is looked up while
+    the results of the current one are consumed. Closing or cancelling the
+    iteration cancels the pending batch.
+
+    Parameters
+    ----------
+    ids_or_coords
+        iterable or async iterable of rsids and chr:pos strings, which may be
+        mixed
+    reference_build : str
+        reference build for coordinates
+    batch_size : int
+        number of queries in each batch
+
+    Yields
+    ------
+    GeneralizedVariant
+        a variant for each query in input order, or NOT_FOUND if dbSNP has no
+        record for it
+
+    Examples
+    --------
+    async for variant in fetch_many(['rs231361', 'chr8:118184783']):
+        if variant is not NOT_FOUND:
+            print(variant.id)
+    """
+
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    pending = deque()
+    try:
+        async for batch in _batches(ids_or_coords, batch_size):
+            pending.append(
+                loop.run_in_executor(
+                    executor,
+                    partial(lookup_rows, batch, reference_build=reference_build)
+                )
+            )
+            if len(pending) > 1:
+                for result in await pending[0]:
+                    yield to_variant(result)
+                pending.popleft()
+        while pending:
+            for result in await pending[0]:
+                yield to_variant(result)
+            pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
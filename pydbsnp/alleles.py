@@ -0,0 +1,214 @@
+#===============================================================================
+# alleles.py
+#===============================================================================
+
+"""Allele-aware matching of variants against dbSNP REF/ALT"""
+
+
+
+
+# Imports ======================================================================
+
+from pydbsnp.query import chrom_to_hgvs, coordinates_to_rows
+from pydbsnp.record import Record
+
+
+
+
+# Functions ====================================================================
+
+def normalize_alleles(pos, ref, alt):
+    """Reduce a variant to its minimal representation by trimming bases
+    shared by REF and ALT, first from the right and then from the left
+
+    This removes differences in padding between representations of the same
+    simple indel, and left-aligns an indel within its REF allele. Indels
+    shifted through a repeat beyond the REF allele are compared by
+    haplotypes_match.
+
+    Parameters
+    ----------
+    pos : int
+        position of the variant
+    ref : str
+        reference allele
+    alt : str
+        alternate allele
+
+    Returns
+    -------
+    tuple
+        (pos, ref, alt) of the minimal representation
+    """
+
+    ref, alt = ref.upper(), alt.upper()
+    while ref and alt and ref[-1] == alt[-1]:
+        ref, alt = ref[:-1], alt[:-1]
+    while ref and alt and ref[0] == alt[0]:
+        ref, alt, pos = ref[1:], alt[1:], pos + 1
+    return pos, ref, alt
+
+
+def haplotypes_match(pos, ref, alt, other_pos, other_ref, other_alt):
+    """Check whether two variants give the same sequence over the bases
+    covered by their REF alleles
+
+    Indels in a repeat can be placed anywhere in it, for example dbSNP may
+    record a deletion with a REF allele spanning the whole repeat while a
+    caller right-aligns it. The REF alleles of the two variants are used as
+    the reference context, so the variants can only be compared if their REF
+    alleles agree where they overlap and together cover a contiguous span.
+
+    Parameters
+    ----------
+    pos, ref, alt
+        position, reference allele and alternate allele of a variant
+    other_pos, other_ref, other_alt
+        position, reference allele and alternate allele of the other variant
+
+    Returns
+    -------
+    bool
+        True if applying either variant to the context gives the same
+        sequence
+    """
+
+    start = min(pos, other_pos)
+    end = max(pos + len(ref), other_pos + len(other_ref))
+    context = [None] * (end - start)
+    for p, r in (pos, ref), (other_pos, other_ref):
+        for i, base in enumerate(r.upper(), p - start):
+            if context[i] not in (None, base):
+                return False
+            context[i] = base
+    if None in context:
+        return False
+    context = ''.join(context)
+    return (
+        context[:pos - start] + alt.upper()
+        + context[pos - start + len(ref):]
+    ) == (
+        context[:other_pos - start] + other_alt.upper()
+        + context[other_pos - start + len(other_ref):]
+    )
+
+
+def alleles_match(row, pos, ref, alt):
+    """Check whether a dbSNP row has an alternate allele matching a variant
+
+    Parameters
+    ----------
+    row
+        split dbSNP VCF row
+    pos : int
+        position of the variant
+    ref : str
+        reference allele
+    alt : str
+        alternate allele, or several separated by commas
+
+    Returns
+    -------
+    bool
+        True if any dbSNP ALT allele and any of the variant's ALT alleles have
+        the same minimal representation, or are the same indel placed
+        differently in a repeat
+    """
+
+    alts = alt.split(',')
+    queries = {normalize_alleles(pos, ref, a) for a in alts}
+    row_pos, row_ref, row_alts = int(row[1]), row[3], row[4].split(',')
+    if any(normalize_alleles(row_pos, row_ref, a) in queries for a in row_alts):
+        return True
+    return any(
+        haplotypes_match(pos, ref, a, row_pos, row_ref, row_alt)
+        for a in alts if len(a) != len(ref)
+        for row_alt in row_alts
+        if len(row_alt) - len(row_ref) == len(a) - len(ref)
+    )
+
+
+def lookup_alleles(variants, reference_build='GRCh38'):
+    """Find the dbSNP records matching many variants by position and alleles.
+    Rows are fetched in one sorted pass per chromosome.
+
+    Parameters
+    ----------
+    variants
+        iterable of (chrom, pos, ref, alt) tuples
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    list
+        a list of matching Record objects for each variant, in input order
+
+    Examples
+    --------
+    lookup_alleles([('chr8', 118184783, 'C', 'T'), ('chr1', 11237, 'G', 'T')])
+    """
+
+    queries = []
+    for chrom, pos, ref, alt in variants:
+        hgvs = chrom_to_hgvs(chrom, reference_build=reference_build)
+        pos = int(pos)
+        coordinates = {(hgvs, pos)}
+        for a in alt.split(','):
+            norm_pos = normalize_alleles(pos, ref, a)[0]
+            # the padding base before an insertion belongs to the dbSNP record
+            coordinates.update(
+                (hgvs, p) for p in (norm_pos, max(norm_pos - 1, 1))
+            )
+        queries.append((hgvs, pos, ref, alt, coordinates))
+    rows = coordinates_to_rows(
+        (c for *_, coordinates in queries for c in coordinates),
+        reference_build=reference_build
+    )
+    results = []
+    for hgvs, pos, ref, alt, coordinates in queries:
+        candidates = {
+            id(row): row for c in coordinates for row in rows.get(c, ())
+        }
+        results.append(
+            [
+                Record.from_row(row)
+                for row in sorted(
+                    candidates.values(), key=lambda row: int(row[1])
+                )
+                if alleles_match(row, pos, ref, alt)
+            ]
+        )
+    return results
+
+
+def lookup_allele(chrom, pos, ref, alt, reference_build='GRCh38'):
+    """Find the dbSNP records matching a variant by position and alleles
+
+    Parameters
+    ----------
+    chrom
+        chromosome of the variant
+    pos
+        position of the variant
+    ref : str
+        reference allele
+    alt : str
+        alternate allele
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    list
+        matching Record objects
+
+    Examples
+    --------
+    lookup_allele('chr8', 118184783, 'C', 'T')
+    """
+
+    return lookup_alleles(
+        ((chrom, pos, ref, alt),),
+        reference_build=reference_build
+    )[0]
@@ -0,0 +1,247 @@
+#===============================================================================
+# annotation.py
+#===============================================================================
+
+"""Annotate coordinate-sorted VCF or TSV files with dbSNP records"""
+
+
+
+
+# Imports ======================================================================
+
+import gzip
+import sys
+
+from itertools import chain
+
+from pydbsnp.alleles import alleles_match
+from pydbsnp.handles import get_pool
+from pydbsnp.query import chrom_to_hgvs
+
+
+
+
+# Constants ====================================================================
+
+GZIP_MAGIC = b'\x1f\x8b'
+TSV_COLUMNS = ('ID', 'REF', 'ALT', 'INFO')
+
+
+
+
+# Functions ====================================================================
+
+def join_sorted(items, reference_build='GRCh38'):
+    """Merge-join coordinate-sorted items against the dbSNP VCF
+
+    Each chromosome of the dbSNP VCF is read sequentially alongside the input,
+    so no per-item tabix fetch is made and only the dbSNP records at the
+    current position are held in memory.
+
+    Parameters
+    ----------
+    items
+        iterable of (chrom, pos, payload) tuples, sorted by position within
+        each chromosome
+    reference_build : str
+        reference build for coordinates
+
+    Yields
+    ------
+    tuple
+        each payload with a list of the split dbSNP rows at its position
+    """
+
+    pool = get_pool(reference_build)
+    contigs = set(pool.vcf.contigs)
+    current_chrom = None
+    previous_pos = 0
+    for chrom, pos, payload in items:
+        pos = int(pos)
+        if chrom != current_chrom:
+            current_chrom, previous_pos = chrom, 0
+            try:
+                hgvs = chrom_to_hgvs(chrom, reference_build=reference_build)
+            except RuntimeError:
+                hgvs = None
+            # other lookups on the shared handle may run while the contig is
+            # streamed, so the stream keeps its own file position
+            dbsnp_rows = (
+                iter(pool.vcf.fetch(hgvs, multiple_iterators=True))
+                if hgvs in contigs else iter(())
+            )
+            pending = next(dbsnp_rows, None)
+            pending_pos = int(pending.split('\t', 2)[1]) if pending else None
+            matched_pos, matched = None, []
+        elif pos < previous_pos:
+            raise RuntimeError(
+                f'input is not sorted by position at {chrom}:{pos}'
+            )
+        previous_pos = pos
+        if pos != matched_pos:
+            matched_pos, matched = pos, []
+            while pending is not None and pending_pos <= pos:
+                if pending_pos == pos:
+                    matched.append(pending.split())
+                pending = next(dbsnp_rows, None)
+                pending_pos = (
+                    int(pending.split('\t', 2)[1]) if pending else None
+                )
+        yield payload, matched
+
+
+def open_input(input_path):
+    """Open a plain or gzip/bgzip-compressed text file, or stdin for '-'"""
+
+    if input_path == '-':
+        return sys.stdin
+    with open(input_path, 'rb') as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    if compressed:
+        return gzip.open(input_path, 'rt')
+    return open(input_path, 'r')
+
+
+def split_header(lines):
+    """Separate leading header lines from the data lines that follow
+
+    Parameters
+    ----------
+    lines
+        iterable of text lines
+
+    Returns
+    -------
+    tuple
+        a list of header lines starting with '#' and an iterator over the
+        remaining lines, both without trailing newlines
+    """
+
+    lines = (line.rstrip('\n') for line in lines)
+    header = []
+    for line in lines:
+        if line.startswith('#'):
+            header.append(line)
+        else:
+            return header, chain((line,), lines)
+    return header, iter(())
+
+
+def annotate_vcf(lines, reference_build='GRCh38'):
+    """Fill in the ID column of VCF lines from dbSNP
+
+    A dbSNP record matches a VCF record if it has the same position and at
+    least one alternate allele with the same minimal representation. Existing
+    IDs are kept.
+
+    Parameters
+    ----------
+    lines
+        iterable of lines from a coordinate-sorted VCF
+    reference_build : str
+        reference build for coordinates
+
+    Yields
+    ------
+    str
+        annotated VCF lines
+    """
+
+    header, data = split_header(lines)
+    yield from header
+    for fields, rows in join_sorted(
+        (
+            (fields[0], fields[1], fields)
+            for fields in (line.split('\t') for line in data if line)
+        ),
+        reference_build=reference_build
+    ):
+        if fields[2] == '.':
+            ids = [
+                row[2] for row in rows
+                if alleles_match(row, int(fields[1]), fields[3], fields[4])
+            ]
+            if ids:
+                fields[2] = ';'.join(ids)
+        yield '\t'.join(fields)
+
+
+def annotate_tsv(lines, reference_build='GRCh38'):
+    """Add ID, REF, ALT and INFO columns from dbSNP to TSV lines
+
+    The first two columns of the input must be chromosome and position. One
+    line is written for each matching dbSNP record, or a single line with
+    missing values if there is none. If the input has header lines starting
+    with '#', the column names are appended to the last one.
+
+    Parameters
+    ----------
+    lines
+        iterable of lines from a coordinate-sorted TSV file
+    reference_build : str
+        reference build for coordinates
+
+    Yields
+    ------
+    str
+        annotated TSV lines
+    """
+
+    header, data = split_header(lines)
+    if header:
+        header[-1] = '\t'.join((header[-1],) + TSV_COLUMNS)
+    yield from header
+    for line, rows in join_sorted(
+        (
+            (line.split('\t', 2)[0], line.split('\t', 2)[1], line)
+            for line in data if line
+        ),
+        reference_build=reference_build
+    ):
+        if not rows:
+            yield '\t'.join((line,) + ('.',) * len(TSV_COLUMNS))
+        for row in rows:
+            yield '\t'.join((line, row[2], row[3], row[4], row[7]))
+
+
+def annotate(input_path, reference_build='GRCh38', input_format=None):
+    """Stream annotated lines for a coordinate-sorted VCF or TSV file
+
+    Parameters
+    ----------
+    input_path : str
+        path to a plain or gzip/bgzip-compressed VCF or TSV file, or '-' for
+        standard input
+    reference_build : str
+        reference build for coordinates
+    input_format : str
+        'vcf' or 'tsv'. If None, the format is detected from the first line
+
+    Yields
+    ------
+    str
+        annotated lines
+
+    Examples
+    --------
+    for line in annotate('calls.vcf.gz'):
+        print(line)
+    """
+
+    f = open_input(input_path)
+    try:
+        first = next(f, '')
+        if input_format is None:
+            input_format = (
+                'vcf' if first.startswith('##fileformat=VCF') else 'tsv'
+            )
+        lines = chain((first,), f) if first else f
+        if input_format == 'vcf':
+            yield from annotate_vcf(lines, reference_build=reference_build)
+        elif input_format == 'tsv':
+            yield from annotate_tsv(lines, reference_build=reference_build)
+        else:
+            raise RuntimeError(f'invalid input format: {input_format}')
+    finally:
+        if f is not sys.stdin:
+            f.close()
@@ -0,0 +1,397 @@
+#===============================================================================
+# backends.py
+#===============================================================================
+
+"""Storage backends behind dbSNP lookups
+
+A backend maps rs numbers to coordinates and fetches the VCF rows at
+positions and in regions, one at a time or in batches. The tabix backend
+reads the bgzipped VCF and rsid index, coalescing sorted batches into few
+fetches. The sqlite backend reads the SQLite store built by pydbsnp-index
+--sqlite, where each lookup is a descent of a clustered B-tree, which suits
+scattered random-access workloads. The backend is chosen with the
+PYDBSNP_BACKEND environment variable.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import os.path
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+
+from pydbsnp.env import BACKEND
+from pydbsnp.handles import get_pool
+from pydbsnp.metrics import get_metrics
+
+
+
+
+# Constants ====================================================================
+
+# Sorted queries closer together than these gaps share one tabix fetch, which
+# is roughly one BGZF block of the rsid index or the dbSNP VCF respectively
+RSID_MAX_GAP = 2000
+POS_MAX_GAP = 1000
+
+
+
+
+# Classes ======================================================================
+
+class Backend(ABC):
+    """Base class of lookup backends. Subclasses implement open, contigs,
+    by_rsid and by_region, and may override the batch methods with faster
+    ones.
+
+    Parameters
+    ----------
+    reference_build : str
+        reference build for coordinates
+
+    Attributes
+    ----------
+    pool : HandlePool
+        handles on the dbSNP data of the reference build
+    direct_rsid_lookups : bool
+        True if rs numbers are looked up directly rather than by scanning,
+        so batches are not worth shipping to worker processes
+    """
+
+    direct_rsid_lookups = False
+
+    def __init__(self, reference_build='GRCh38'):
+        self.pool = get_pool(reference_build)
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}(reference_build='"
+            f"{self.pool.reference_build}')"
+        )
+
+    @property
+    @abstractmethod
+    def contigs(self):
+        """Names of the contigs with records"""
+
+    @abstractmethod
+    def open(self):
+        """Open the handles used for lookups ahead of the first one"""
+
+    @abstractmethod
+    def by_rsid(self, rs_number):
+        """Coordinates of an rs number
+
+        Parameters
+        ----------
+        rs_number : int
+            rs number to look up
+
+        Returns
+        -------
+        list
+            (chrom, pos) tuples, empty if the rs number is not in dbSNP
+        """
+
+    def by_rsids(self, rs_numbers):
+        """Coordinates of many rs numbers
+
+        Parameters
+        ----------
+        rs_numbers
+            iterable of rs numbers
+
+        Returns
+        -------
+        dict
+            maps each rs number found to a list of (chrom, pos)
+        """
+
+        coordinates = {}
+        for rs_number in sorted(set(rs_numbers)):
+            found = self.by_rsid(rs_number)
+            if found:
+                coordinates[rs_number] = found
+        return coordinates
+
+    @abstractmethod
+    def by_region(self, chrom, start=None, end=None):
+        """Rows of the records overlapping a region
+
+        Parameters
+        ----------
+        chrom : str
+            HGVS name of the contig
+        start : int
+            0-based start, by default the start of the contig
+        end : int
+            0-based exclusive end, by default the end of the contig
+
+        Returns
+        -------
+        iterable
+            VCF rows as strings, in file order, none if the contig has no
+            records
+        """
+
+    def by_regions(self, regions):
+        """Rows of the records overlapping many regions
+
+        Parameters
+        ----------
+        regions
+            iterable of (chrom, start, end) regions as for by_region
+
+        Yields
+        ------
+        str
+            VCF rows of each region in turn
+        """
+
+        for chrom, start, end in regions:
+            yield from self.by_region(chrom, start, end)
+
+    def by_position(self, chrom, pos):
+        """Rows of the records overlapping a position
+
+        Parameters
+        ----------
+        chrom : str
+            HGVS name of the contig
+        pos : int
+            1-based position
+
+        Returns
+        -------
+        list
+            split VCF rows, in file order
+        """
+
+        return [row.split() for row in self.by_region(chrom, pos - 1, pos)]
+
+    def by_positions(self, coordinates):
+        """Rows of the records overlapping many positions
+
+        Parameters
+        ----------
+        coordinates
+            iterable of (HGVS chrom, pos) tuples
+
+        Returns
+        -------
+        dict
+            maps each (chrom, pos) with at least one overlapping record to a
+            list of split VCF rows, in file order
+        """
+
+        rows = {}
+        for chrom, pos in sorted(set(coordinates)):
+            found = self.by_position(chrom, pos)
+            if found:
+                rows[(chrom, pos)] = found
+        return rows
+
+
+class TabixBackend(Backend):
+    """Lookups in the tabix-indexed dbSNP VCF, with rs numbers resolved by the
+    memory-mapped rsid array if it has been built and by the tabix rsid index
+    otherwise. Batches are sorted and coalesced into few fetches.
+    """
+
+    def __init__(self, reference_build='GRCh38'):
+        super().__init__(reference_build=reference_build)
+        self._contig_set = None
+
+    @property
+    def direct_rsid_lookups(self):
+        return bool(self.pool.rsid_array)
+
+    @property
+    def contigs(self):
+        return self.pool.vcf.contigs
+
+    def open(self):
+        path = self.pool.paths['rsid']
+        if not self.pool.rsid_array and os.path.isfile(path):
+            self.pool.open('vcf', 'rsid')
+        else:
+            self.pool.open('vcf')
+
+    def by_rsid(self, rs_number):
+        metrics = get_metrics()
+        if self.pool.rsid_array:
+            metrics.count('rsid_array.lookups')
+            return self.pool.rsid_array.lookup(rs_number)
+        return [
+            (chrom, int(pos))
+            for _, _, chrom, pos in (
+                row.split()
+                for row in metrics.scan(
+                    self.pool.rsid, 'rsid', 'rs', rs_number - 1, rs_number
+                )
+            )
+        ]
+
+    def by_rsids(self, rs_numbers):
+        metrics = get_metrics()
+        wanted = set(rs_numbers)
+        if self.pool.rsid_array:
+            metrics.count('rsid_array.lookups', len(wanted))
+            return {
+                rs_number: coordinates
+                for rs_number, coordinates in (
+                    (rs_number, self.pool.rsid_array.lookup(rs_number))
+                    for rs_number in wanted
+                )
+                if coordinates
+            }
+        coordinates = {}
+        with metrics.timer('query.rsids_to_coordinates'):
+            for start, end in coalesce(sorted(wanted), RSID_MAX_GAP):
+                for row in metrics.scan(
+                    self.pool.rsid, 'rsid', 'rs', start - 1, end
+                ):
+                    _, rs_number, chrom, pos = row.split()
+                    rs_number = int(rs_number)
+                    if rs_number in wanted:
+                        coordinates.setdefault(rs_number, []).append(
+                            (chrom, int(pos))
+                        )
+        return coordinates
+
+    def by_region(self, chrom, start=None, end=None):
+        # fetching an unknown contig raises ValueError
+        if self._contig_set is None:
+            self._contig_set = set(self.contigs)
+        if chrom not in self._contig_set:
+            return ()
+        # the rows are returned lazily, so lookups made before they are
+        # exhausted must not move their file position
+        return get_metrics().scan(
+            self.pool.vcf, 'vcf', chrom, start, end, multiple_iterators=True
+        )
+
+    def by_positions(self, coordinates):
+        metrics = get_metrics()
+        by_chrom = {}
+        for chrom, pos in set(coordinates):
+            by_chrom.setdefault(chrom, []).append(pos)
+        if self._contig_set is None:
+            self._contig_set = set(self.contigs)
+        rows = {}
+        with metrics.timer('query.coordinates_to_rows'):
+            for chrom in sorted(by_chrom):
+                if chrom not in self._contig_set:
+                    continue
+                positions = sorted(by_chrom[chrom])
+                for start, end in coalesce(positions, POS_MAX_GAP):
+                    for row in metrics.scan(
+                        self.pool.vcf, 'vcf', chrom, start - 1, end
+                    ):
+                        fields = row.split()
+                        row_start = int(fields[1])
+                        row_end = row_start + len(fields[3]) - 1
+                        for pos in positions[
+                            bisect_left(positions, row_start):
+                            bisect_right(positions, row_end)
+                        ]:
+                            rows.setdefault((chrom, pos), []).append(fields)
+        return rows
+
+
+class SqliteBackend(Backend):
+    """Lookups in the SQLite store built by pydbsnp-index --sqlite"""
+
+    direct_rsid_lookups = True
+
+    def __init__(self, reference_build='GRCh38'):
+        super().__init__(reference_build=reference_build)
+        if self.pool.sqlite is None:
+            raise RuntimeError(
+                f'no SQLite store for {self.pool.reference_build}; build it '
+                'with pydbsnp-index --sqlite'
+            )
+
+    @property
+    def contigs(self):
+        return self.pool.sqlite.contigs
+
+    def open(self):
+        self.pool.open('sqlite')
+
+    def by_rsid(self, rs_number):
+        get_metrics().count('sqlite.rsid_lookups')
+        return self.pool.sqlite.by_rsid(rs_number)
+
+    def by_rsids(self, rs_numbers):
+        with get_metrics().timer('sqlite.by_rsids'):
+            return super().by_rsids(rs_numbers)
+
+    def by_region(self, chrom, start=None, end=None):
+        get_metrics().count('sqlite.region_lookups')
+        return self.pool.sqlite.by_region(chrom, start, end)
+
+    def by_positions(self, coordinates):
+        with get_metrics().timer('sqlite.by_positions'):
+            return super().by_positions(coordinates)
+
+
+
+
+# Functions ====================================================================
+
+def get_backend(reference_build='GRCh38', name=None):
+    """Return a lookup backend on the shared handle pool of a reference build
+
+    Parameters
+    ----------
+    reference_build : str
+        reference build for coordinates
+    name : str
+        'tabix' or 'sqlite', by default the value of PYDBSNP_BACKEND
+
+    Returns
+    -------
+    Backend
+        the backend, using the calling thread's handles
+    """
+
+    backends = {'tabix': TabixBackend, 'sqlite': SqliteBackend}
+    name = name or BACKEND
+    if name not in backends:
+        raise RuntimeError(
+            f'unknown backend: {name}, expected one of {", ".join(backends)}'
+        )
+    return backends[name](reference_build=reference_build)
+
+
+def coalesce(sorted_values, max_gap):
+    """Group sorted integers into closed ranges
+
+    Parameters
+    ----------
+    sorted_values
+        iterable of integers in ascending order
+    max_gap : int
+        values at most this far apart are placed in the same range
+
+    Yields
+    ------
+    tuple
+        start and end of each range
+    """
+
+    start = end = None
+    for value in sorted_values:
+        if start is None:
+            start = end = value
+        elif value - end > max_gap:
+            yield start, end
+            start = end = value
+        else:
+            end = value
+    if start is not None:
+        yield start, end
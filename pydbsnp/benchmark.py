@@ -0,0 +1,748 @@
+#===============================================================================
+# benchmark.py
+#===============================================================================
+
+"""Benchmark indexing and lookups on a synthetic dbSNP VCF
+
+A dbSNP-shaped VCF of configurable size is generated with GRCh38 NC_ contigs
+and realistic INFO, indexed with pydbsnp-index, and queried in fresh
+processes so that cold and warm timings and peak memory use are measured
+independently of the calling process. Everything runs offline, and the
+results are written as JSON so they can be compared across versions.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import json
+import multiprocessing
+import os
+import os.path
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from pysam import BGZFile, tabix_index
+from statistics import median
+
+
+
+
+# Constants ====================================================================
+
+GRCH38_LENGTHS = {
+    'NC_000001.11': 248956422, 'NC_000002.12': 242193529,
+    'NC_000003.12': 198295559, 'NC_000004.12': 190214555,
+    'NC_000005.10': 181538259, 'NC_000006.12': 170805979,
+    'NC_000007.14': 159345973, 'NC_000008.11': 145138636,
+    'NC_000009.12': 138394717, 'NC_000010.11': 133797422,
+    'NC_000011.10': 135086622, 'NC_000012.12': 133275309,
+    'NC_000013.11': 114364328, 'NC_000014.9': 107043718,
+    'NC_000015.10': 101991189, 'NC_000016.10': 90338345,
+    'NC_000017.11': 83257441, 'NC_000018.10': 80373285,
+    'NC_000019.10': 58617616, 'NC_000020.11': 64444167,
+    'NC_000021.9': 46709983, 'NC_000022.11': 50818468,
+    'NC_000023.11': 156040895, 'NC_000024.10': 57227415,
+    'NC_012920.1': 16569
+}
+HGVS_TO_CHR = dict(
+    zip(
+        GRCH38_LENGTHS,
+        [f'chr{n}' for n in range(1, 23)] + ['chrX', 'chrY', 'chrMT']
+    )
+)
+VCF_HEADER = (
+    '##fileformat=VCFv4.0\n'
+    '##source=pydbsnp-benchmark\n'
+    '##reference=GRCh38.p13\n'
+    '##INFO=<ID=RS,Number=1,Type=Integer,Description="dbSNP ID">\n'
+    '##INFO=<ID=dbSNPBuildID,Number=1,Type=Integer,Description="Build">\n'
+    '##INFO=<ID=SSR,Number=1,Type=Integer,Description="Suspect reason">\n'
+    '##INFO=<ID=GENEINFO,Number=1,Type=String,Description="Genes">\n'
+    '##INFO=<ID=VC,Number=1,Type=String,Description="Variation class">\n'
+    '##INFO=<ID=FREQ,Number=.,Type=String,Description="Frequencies">\n'
+)
+BASES = 'ACGT'
+VCF_NAME = 'GCF_000001405.39.gz'
+RSID_NAME = 'GCF_000001405.39.rsid.gz'
+RSIDX_NAME = 'GCF_000001405.39.rsidx'
+
+# rs numbers are assigned as a scattered permutation of positions, as in
+# dbSNP, where rsid order is unrelated to coordinate order
+RS_STRIDE = 1_000_003
+PROC_STATUS = '/proc/self/status'
+
+# Modules imported by the command line tools, and dependencies whose import
+# dominates startup
+STARTUP_MODULES = (
+    'pydbsnp', 'pydbsnp.download', 'pydbsnp.index', 'pydbsnp.query',
+    'pydbsnp.serve', 'pydbsnp.convert', 'pydbsnp.export'
+)
+HEAVY_MODULES = (
+    'pysam', 'numpy', 'pyarrow', 'multiprocessing', 'asyncio', 'sqlite3'
+)
+
+
+
+
+# Functions ====================================================================
+
+def log(message, quiet=False):
+    if not quiet:
+        print(message, file=sys.stderr)
+
+
+def random_record(rng, hgvs, pos, rs):
+    """One synthetic dbSNP VCF row
+
+    Parameters
+    ----------
+    rng : random.Random
+        random number generator
+    hgvs : str
+        contig of the record
+    pos : int
+        position of the record
+    rs : int
+        rs number of the record
+
+    Returns
+    -------
+    str
+        a VCF row including the trailing newline
+    """
+
+    ref = rng.choice(BASES)
+    draw = rng.random()
+    if draw < 0.85:
+        alts = [b for b in BASES if b != ref]
+        alt = ','.join(rng.sample(alts, 1 if draw < 0.7 else 2))
+        vc = 'SNV'
+    elif draw < 0.93:
+        alt = ref + ''.join(rng.choices(BASES, k=rng.randint(1, 6)))
+        vc = 'INS'
+    else:
+        ref += ''.join(rng.choices(BASES, k=rng.randint(1, 6)))
+        alt = ref[0]
+        vc = 'DEL'
+    gene = rng.randrange(1, 20000)
+    af = rng.random()
+    freq = '|'.join(
+        f'{study}:{1 - f:.4g},{f:.4g}'
+        for study, f in (('1000Genomes', af), ('GnomAD', af * 0.9))
+    )
+    info = (
+        f'RS={rs};dbSNPBuildID={rng.randrange(79, 155)};SSR=0;'
+        f'GENEINFO=GENE{gene}:{gene + 100000};VC={vc};FREQ={freq}'
+    )
+    return f'{hgvs}\t{pos}\trs{rs}\t{ref}\t{alt}\t.\t.\t{info}\n'
+
+
+def generate_vcf(output_path, n_records=1_000_000, n_queries=1000, seed=0):
+    """Write a synthetic bgzipped and tabix-indexed dbSNP VCF
+
+    Records are spread over the GRCh38 chromosomes in proportion to their
+    lengths. About 15% are multi-allelic SNVs and 15% are indels.
+
+    Parameters
+    ----------
+    output_path : str
+        path for the bgzipped VCF, which must end in .gz
+    n_records : int
+        number of records
+    n_queries : int
+        approximate number of records sampled as queries
+    seed : int
+        random seed
+
+    Returns
+    -------
+    list
+        sampled (chrom, pos, rs) tuples of records, with chr-style chrom
+    """
+
+    rng = random.Random(seed)
+    total_length = sum(GRCH38_LENGTHS.values())
+    span = 2 * n_records + 1
+    if span % RS_STRIDE == 0:
+        span += 1
+    sample_rate = min(n_queries / max(n_records, 1), 1)
+    sample = []
+    i = 0
+    with BGZFile(output_path, 'wb') as f:
+        f.write(VCF_HEADER.encode())
+        f.write(
+            ''.join(
+                f'##contig=<ID={hgvs},length={length}>\n'
+                for hgvs, length in GRCH38_LENGTHS.items()
+            ).encode()
+        )
+        f.write(b'#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        for n, (hgvs, length) in enumerate(GRCH38_LENGTHS.items()):
+            if n == len(GRCH38_LENGTHS) - 1:
+                count = n_records - i
+            else:
+                count = round(n_records * length / total_length)
+            count = min(count, n_records - i, length - 1)
+            rows = []
+            for pos in sorted(rng.sample(range(1, length), count)):
+                rs = 1 + (i * RS_STRIDE) % span
+                rows.append(random_record(rng, hgvs, pos, rs))
+                if rng.random() < sample_rate:
+                    sample.append((HGVS_TO_CHR[hgvs], pos, rs))
+                i += 1
+            f.write(''.join(rows).encode())
+    tabix_index(output_path, preset='vcf', force=True)
+    rng.shuffle(sample)
+    return sample[:n_queries]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its waited-for children,
+    in MB
+    """
+
+    # on Linux ru_maxrss survives exec, so a spawned process would report the
+    # peak of its parent; VmHWM is reset on exec
+    usage = None
+    if os.path.isfile(PROC_STATUS):
+        with open(PROC_STATUS) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    usage = int(line.split()[1])
+    if usage is None:
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        if sys.platform == 'darwin':
+            usage //= 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == 'darwin':
+        children //= 1024
+    return max(usage, children) / 1024
+
+
+def summarize(latencies):
+    """Summary statistics of latencies in seconds
+
+    Parameters
+    ----------
+    latencies
+        list of latencies in seconds
+
+    Returns
+    -------
+    dict
+        count, mean, p50, p99 and max in milliseconds
+    """
+
+    ordered = sorted(latencies)
+    n = len(ordered)
+    if not n:
+        return {'n': 0}
+    return {
+        'n': n,
+        'mean_ms': 1000 * sum(ordered) / n,
+        'p50_ms': 1000 * ordered[min(n - 1, n // 2)],
+        'p99_ms': 1000 * ordered[min(n - 1, int(n * 0.99))],
+        'max_ms': 1000 * ordered[-1]
+    }
+
+
+def run_isolated(func, *args, env=None):
+    """Run a function in a freshly spawned interpreter
+
+    Parameters
+    ----------
+    func
+        module-level function to run
+    *args
+        arguments for the function
+    env : dict
+        environment variables for the new interpreter, a value of None
+        unsets the variable
+
+    Returns
+    -------
+    object
+        the return value of the function
+    """
+
+    saved = {key: os.environ.get(key) for key in (env or {})}
+    for key, value in (env or {}).items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    try:
+        process = context.Process(
+            target=_call_and_send,
+            args=(sender, func, args)
+        )
+        process.start()
+        sender.close()
+        try:
+            ok, result = receiver.recv()
+        except EOFError:
+            ok, result = False, 'benchmark process exited unexpectedly'
+        process.join()
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    if not ok:
+        raise RuntimeError(result)
+    return result
+
+
+def _call_and_send(sender, func, args):
+    # spawned processes are not daemonic, so func may start its own pool
+    try:
+        sender.send((True, func(*args)))
+    except Exception:
+        sender.send((False, traceback.format_exc()))
+    finally:
+        sender.close()
+
+
+def import_profile(module):
+    """Import a module in a fresh interpreter with -X importtime
+
+    Parameters
+    ----------
+    module : str
+        name of the module to import
+
+    Returns
+    -------
+    tuple
+        the wall time of the interpreter in seconds, the cumulative import
+        time of pydbsnp modules in seconds, and the heavy modules that were
+        loaded
+    """
+
+    code = (
+        f'import sys, {module}; '
+        f'print(*(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    )
+    start_time = time.perf_counter()
+    process = subprocess.run(
+        (sys.executable, '-X', 'importtime', '-c', code),
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    wall = time.perf_counter() - start_time
+    import_us = 0
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        # top-level entries include the modules they import
+        if name.strip().startswith('pydbsnp') and not name.startswith('  '):
+            import_us += int(cumulative)
+    return wall, import_us / 1e6, process.stdout.split()
+
+
+def benchmark_startup(modules=STARTUP_MODULES, repeat=5, budget_ms=None):
+    """Measure the startup cost of the modules behind the command line tools
+
+    Parameters
+    ----------
+    modules
+        names of the modules to import
+    repeat : int
+        number of fresh interpreters per module, of which the median is
+        reported
+    budget_ms : float
+        if given, the import time each module is allowed
+
+    Returns
+    -------
+    dict
+        the wall time of an empty interpreter, and for each module the median
+        wall time and import time, the heavy modules it loads, and whether it
+        is within budget
+    """
+
+    results = {
+        'interpreter_ms': 1000 * median(
+            import_profile('sys')[0] for _ in range(repeat)
+        )
+    }
+    for module in modules:
+        profiles = [import_profile(module) for _ in range(repeat)]
+        results[module] = {
+            'wall_ms': 1000 * median(p[0] for p in profiles),
+            'import_ms': 1000 * median(p[1] for p in profiles),
+            'loads': profiles[0][2]
+        }
+        if budget_ms is not None:
+            results[module]['within_budget'] = (
+                results[module]['import_ms'] <= budget_ms
+            )
+    return results
+
+
+def benchmark_index(vcf_path, rsid_path, rsidx_path=None, processes=1):
+    """Time pydbsnp-index on a VCF and record peak memory use
+
+    Parameters
+    ----------
+    vcf_path : str
+        path to the tabix-indexed VCF
+    rsid_path : str
+        path for the bgzipped rsid file
+    rsidx_path : str
+        path for the rsid array, or None to skip it
+    processes : int
+        number of processes used by the index build
+
+    Returns
+    -------
+    dict
+        wall time in seconds, peak RSS in MB and output sizes in bytes
+    """
+
+    from pydbsnp.index import reformat_sort_index
+
+    start_time = time.perf_counter()
+    reformat_sort_index(
+        vcf_path,
+        rsid_path,
+        rsidx_path,
+        processes=processes,
+        quiet=True
+    )
+    return {
+        'wall_s': time.perf_counter() - start_time,
+        'peak_rss_mb': peak_rss_mb(),
+        'rsid_bytes': os.path.getsize(rsid_path),
+        'rsidx_bytes': os.path.getsize(rsidx_path) if rsidx_path else None
+    }
+
+
+def time_single(queries, reference_build='GRCh38'):
+    from pydbsnp.query import GeneralizedVariant
+
+    latencies = []
+    for query in queries:
+        start_time = time.perf_counter()
+        if isinstance(query, str):
+            GeneralizedVariant(id=query, reference_build=reference_build)
+        else:
+            GeneralizedVariant(*query, reference_build=reference_build)
+        latencies.append(time.perf_counter() - start_time)
+    return latencies
+
+
+def benchmark_lookup(sample, batch_size=10_000, reference_build='GRCh38'):
+    """Time lookups of sampled records in a fresh process
+
+    Single lookups are timed in three passes over the same queries: cold
+    (handles just opened and the lookup cache empty), warm with the lookup
+    cache disabled, and warm with every query a lookup cache hit. The OS page
+    cache cannot be dropped without privileges, so cold timings reflect a
+    fresh process rather than a fresh machine.
+
+    Parameters
+    ----------
+    sample
+        (chrom, pos, rs) tuples of records known to be in the VCF
+    batch_size : int
+        number of queries in each lookup_many batch
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    dict
+        latency summaries, batch throughput and peak RSS
+    """
+
+    from pydbsnp.cache import configure_cache
+    from pydbsnp.handles import get_pool
+    from pydbsnp.query import lookup_many
+
+    rsids = [f'rs{rs}' for _, _, rs in sample]
+    coords = [(chrom, pos) for chrom, pos, _ in sample]
+    results = {
+        'rsid_array': get_pool(reference_build).rsid_array is not None
+    }
+    configure_cache(maxsize=len(sample) * 2 + 1)
+    for name, queries in (('rsid', rsids), ('position', coords)):
+        first, *rest = time_single(queries, reference_build=reference_build)
+        results[f'{name}_first_ms'] = 1000 * first
+        results[f'{name}_cold'] = summarize(rest)
+    configure_cache(maxsize=0)
+    for name, queries in (('rsid', rsids), ('position', coords)):
+        results[f'{name}_warm'] = summarize(
+            time_single(queries, reference_build=reference_build)
+        )
+    configure_cache(maxsize=len(sample) * 2 + 1)
+    for name, queries in (('rsid', rsids), ('position', coords)):
+        time_single(queries, reference_build=reference_build)
+        results[f'{name}_cached'] = summarize(
+            time_single(queries, reference_build=reference_build)
+        )
+    configure_cache(maxsize=0)
+    for name, queries in (
+        ('rsid', rsids),
+        ('position', [f'{chrom}:{pos}' for chrom, pos in coords])
+    ):
+        batch = (queries * (batch_size // max(len(queries), 1) + 1))
+        batch = batch[:batch_size]
+        start_time = time.perf_counter()
+        lookup_many(batch, reference_build=reference_build)
+        elapsed = time.perf_counter() - start_time
+        results[f'{name}_batch'] = {
+            'n': len(batch),
+            'wall_s': elapsed,
+            'queries_per_s': len(batch) / elapsed if elapsed else None
+        }
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def package_version():
+    try:
+        from importlib.metadata import version
+        return version('pydbsnp')
+    except Exception:
+        return None
+
+
+def benchmark(
+    n_records=1_000_000,
+    n_queries=1000,
+    batch_size=10_000,
+    processes=1,
+    rsid_array=True,
+    seed=0,
+    work_dir=None,
+    quiet=False,
+    startup_budget_ms=None
+):
+    """Generate a synthetic dbSNP VCF, index it and benchmark lookups, after
+    measuring the startup cost of the command line tools
+
+    Parameters
+    ----------
+    n_records : int
+        number of records in the synthetic VCF
+    n_queries : int
+        number of sampled records looked up individually
+    batch_size : int
+        number of queries in each lookup_many batch
+    processes : int
+        number of processes used by the index build
+    rsid_array : bool
+        build and use the memory-mapped rsid array
+    seed : int
+        random seed for the synthetic data
+    work_dir : str
+        directory for the synthetic data, which is kept. By default a
+        temporary directory is used and removed afterwards
+    quiet : bool
+        suppress status updates on standard error
+    startup_budget_ms : float
+        if given, the import time each command line module is allowed
+
+    Returns
+    -------
+    dict
+        benchmark parameters, environment and results
+
+    Examples
+    --------
+    results = benchmark(n_records=100_000, n_queries=500)
+    print(results['lookup']['rsid_cold']['p99_ms'])
+    """
+
+    import pysam
+
+    keep = work_dir is not None
+    work_dir = work_dir or tempfile.mkdtemp(prefix='pydbsnp-benchmark-')
+    os.makedirs(work_dir, exist_ok=True)
+    vcf_path = os.path.join(work_dir, VCF_NAME)
+    rsid_path = os.path.join(work_dir, RSID_NAME)
+    rsidx_path = os.path.join(work_dir, RSIDX_NAME)
+    results = {
+        'pydbsnp': package_version(),
+        'python': platform.python_version(),
+        'pysam': pysam.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'parameters': {
+            'records': n_records,
+            'queries': n_queries,
+            'batch_size': batch_size,
+            'processes': processes,
+            'rsid_array': rsid_array,
+            'seed': seed
+        }
+    }
+    try:
+        log('Measuring startup.', quiet=quiet)
+        results['startup'] = benchmark_startup(budget_ms=startup_budget_ms)
+        log(f'Generating {n_records} records in {vcf_path}.', quiet=quiet)
+        start_time = time.perf_counter()
+        sample = run_isolated(
+            generate_vcf,
+            vcf_path,
+            n_records,
+            n_queries,
+            seed
+        )
+        results['generate'] = {
+            'wall_s': time.perf_counter() - start_time,
+            'vcf_bytes': os.path.getsize(vcf_path)
+        }
+        log('Building the rsid index.', quiet=quiet)
+        if os.path.exists(rsidx_path):
+            os.remove(rsidx_path)
+        results['index'] = run_isolated(
+            benchmark_index,
+            vcf_path,
+            rsid_path,
+            rsidx_path if rsid_array else None,
+            processes
+        )
+        log(f'Looking up {len(sample)} records.', quiet=quiet)
+        results['lookup'] = run_isolated(
+            benchmark_lookup,
+            sample,
+            batch_size,
+            env={
+                'PYDBSNP_VCF_GRCH38': vcf_path,
+                'PYDBSNP_RSID_GRCH38': rsid_path,
+                'PYDBSNP_RSIDX_GRCH38': rsidx_path,
+                'PYDBSNP_CACHE_DB': None
+            }
+        )
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir)
+    return results
+
+
+def parse_arguments():
+    parser = ArgumentParser(
+        description='benchmark pydbsnp on a synthetic dbSNP VCF'
+    )
+    parser.add_argument(
+        '--records',
+        type=int,
+        default=1_000_000,
+        help='number of records in the synthetic VCF (default: 1000000)'
+    )
+    parser.add_argument(
+        '--queries',
+        type=int,
+        default=1000,
+        help='number of records looked up individually (default: 1000)'
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=10_000,
+        help='number of queries in each batch lookup (default: 10000)'
+    )
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=1,
+        help='number of processes used to build the index'
+    )
+    parser.add_argument(
+        '--no-array',
+        action='store_true',
+        help='do not build or use the memory-mapped rsid array'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='random seed for the synthetic data'
+    )
+    parser.add_argument(
+        '--work-dir',
+        metavar='<path/to/dir/>',
+        help='keep the synthetic data in this directory'
+    )
+    parser.add_argument(
+        '--output',
+        metavar='<path/to/results.json>',
+        help='write results to this file instead of standard output'
+    )
+    parser.add_argument(
+        '--startup-only',
+        action='store_true',
+        help='only measure the startup cost of the command line tools'
+    )
+    parser.add_argument(
+        '--startup-budget-ms',
+        type=float,
+        help=(
+            'exit with status 1 if importing any command line module takes '
+            'longer than this'
+        )
+    )
+    parser.add_argument(
+        '--quiet',
+        action='store_true',
+        help='suppress printed status updates'
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.startup_only:
+        results = {
+            'pydbsnp': package_version(),
+            'python': platform.python_version(),
+            'startup': benchmark_startup(budget_ms=args.startup_budget_ms)
+        }
+    else:
+        results = benchmark(
+            n_records=args.records,
+            n_queries=args.queries,
+            batch_size=args.batch_size,
+            processes=args.processes,
+            rsid_array=not args.no_array,
+            seed=args.seed,
+            work_dir=args.work_dir,
+            quiet=args.quiet,
+            startup_budget_ms=args.startup_budget_ms
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+    else:
+        print(json.dumps(results, indent=2))
+    if not all(
+        result.get('within_budget', True)
+        for result in results['startup'].values()
+        if isinstance(result, dict)
+    ):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
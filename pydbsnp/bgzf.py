@@ -0,0 +1,692 @@
+#===============================================================================
+# bgzf.py
+#===============================================================================
+
+"""Tabix reader with a shared cache of decompressed BGZF blocks
+
+Queries that land close together in the dbSNP VCF or the rsid index read the
+same BGZF blocks. CachedTabixFile answers fetch() like pysam's TabixFile, but
+keeps decompressed blocks, split into lines, in a process-wide LRU cache keyed
+by file and block offset, so neighbouring queries bisect into memory instead
+of inflating and scanning the same blocks again.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import gzip
+import os
+import os.path
+import struct
+import threading
+import zlib
+
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from operator import add, itemgetter, methodcaller
+
+from pydbsnp.env import BLOCK_CACHE_MB
+
+
+
+
+# Constants ====================================================================
+
+TBI_MAGIC = b'TBI\x01'
+CSI_MAGIC = b'CSI\x01'
+TBI_MIN_SHIFT = 14
+TBI_DEPTH = 5
+TABIX_CONF = struct.Struct('<7i')
+BGZF_HEADER_SIZE = 18
+FORMAT_VCF = 2
+FORMAT_ZERO_BASED = 0x10000
+MAX_POSITION = 1 << 62
+LINE_OVERHEAD = 112
+_STOP = object()
+
+
+
+
+# Classes ======================================================================
+
+class BlockCache():
+    """LRU cache of decompressed BGZF blocks keyed by (file, block offset),
+    bounded by the memory the blocks hold, counted as their decompressed size
+    plus LINE_OVERHEAD bytes per line. Access is serialized with a lock, so
+    one cache can be shared by threads.
+
+    Parameters
+    ----------
+    max_bytes : int
+        maximum memory held by the cached blocks, 0 disables the cache
+
+    Attributes
+    ----------
+    max_bytes : int
+        maximum memory held by the cached blocks
+    size : int
+        memory held by the cached blocks
+    hits : int
+        blocks read from the cache
+    misses : int
+        blocks not in the cache, which were read and inflated
+    evictions : int
+        blocks evicted to stay within max_bytes
+
+    Examples
+    --------
+    cache = configure_block_cache(max_bytes=256 << 20)
+    lookup_many(rsids)
+    print(cache.stats())
+    """
+
+    def __init__(self, max_bytes=BLOCK_CACHE_MB << 20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __repr__(self):
+        return f'BlockCache(max_bytes={self.max_bytes})'
+
+    def get(self, key):
+        """Return a cached block, or None"""
+
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+            else:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+            return block
+
+    def put(self, key, block):
+        """Add a block, evicting the least recently used blocks beyond
+        max_bytes
+        """
+
+        if block.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._blocks:
+                return
+            self._blocks[key] = block
+            self.size += block.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self.size -= evicted.nbytes
+                self.evictions += 1
+
+    def stats(self):
+        """Counters for sizing the cache
+
+        Returns
+        -------
+        dict
+            max_bytes, bytes and blocks held, hits, misses, evictions and the
+            hit rate
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'max_bytes': self.max_bytes,
+                'bytes': self.size,
+                'blocks': len(self._blocks),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def clear(self):
+        """Drop every block and reset the counters"""
+
+        with self._lock:
+            self._blocks.clear()
+            self.size = self.hits = self.misses = self.evictions = 0
+
+
+class TabixIndex():
+    """Bins, chunks and linear index of a .tbi or .csi file. The index is
+    decompressed when opened, and the bins of each reference are parsed the
+    first time it is queried.
+
+    Parameters
+    ----------
+    path : str
+        path to the .tbi or .csi file
+
+    Attributes
+    ----------
+    contigs : list
+        names of the indexed references
+    csi : bool
+        whether the index is in CSI format
+    min_shift : int
+        log2 of the smallest bin width
+    depth : int
+        number of bin levels below the root
+    format : int
+        tabix format flags
+    col_seq, col_beg, col_end : int
+        1-based columns of the reference name, start and end, 0 for none
+    meta : bytes
+        leading character of header lines
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = gzip.decompress(f.read())
+        magic = data[:4]
+        if magic == TBI_MAGIC:
+            self.csi = False
+            self.min_shift, self.depth = TBI_MIN_SHIFT, TBI_DEPTH
+            n_ref, = struct.unpack_from('<i', data, 4)
+            conf_offset, l_aux = 8, None
+        elif magic == CSI_MAGIC:
+            self.csi = True
+            self.min_shift, self.depth, l_aux = struct.unpack_from(
+                '<3i', data, 4
+            )
+            if l_aux < TABIX_CONF.size:
+                raise RuntimeError(f'{path} has no tabix configuration')
+            n_ref, = struct.unpack_from('<i', data, 16 + l_aux)
+            conf_offset = 16
+        else:
+            raise RuntimeError(f'{path} is not a tabix or CSI index')
+        (
+            self.format, self.col_seq, self.col_beg, self.col_end, meta, _,
+            l_nm
+        ) = TABIX_CONF.unpack_from(data, conf_offset)
+        self.meta = bytes((meta,))
+        names_offset = conf_offset + TABIX_CONF.size
+        self.contigs = (
+            data[names_offset:names_offset + l_nm].decode().split('\0')[:n_ref]
+        )
+        offset = names_offset + l_nm if l_aux is None else 20 + l_aux
+        self._data = data
+        self._offsets = []
+        for _ in range(n_ref):
+            self._offsets.append(offset)
+            offset = self._skip_reference(offset)
+        self._references = {}
+
+    def __repr__(self):
+        return f'TabixIndex(contigs={len(self.contigs)}, csi={self.csi})'
+
+    def _skip_reference(self, offset):
+        data, unpack_from = self._data, struct.unpack_from
+        n_bin, = unpack_from('<i', data, offset)
+        offset += 4
+        header_size = 16 if self.csi else 8
+        for _ in range(n_bin):
+            n_chunk, = unpack_from('<i', data, offset + header_size - 4)
+            offset += header_size + 16 * n_chunk
+        if not self.csi:
+            n_intv, = unpack_from('<i', data, offset)
+            offset += 4 + 8 * n_intv
+        return offset
+
+    def _reference(self, tid):
+        if tid in self._references:
+            return self._references[tid]
+        data, unpack_from = self._data, struct.unpack_from
+        offset = self._offsets[tid]
+        n_bin, = unpack_from('<i', data, offset)
+        offset += 4
+        bins, loffsets = {}, {}
+        for _ in range(n_bin):
+            if self.csi:
+                bin, loffset, n_chunk = unpack_from('<IQi', data, offset)
+                loffsets[bin] = loffset
+                offset += 16
+            else:
+                bin, n_chunk = unpack_from('<Ii', data, offset)
+                offset += 8
+            chunks = unpack_from(f'<{2 * n_chunk}Q', data, offset)
+            bins[bin] = tuple(zip(chunks[::2], chunks[1::2]))
+            offset += 16 * n_chunk
+        linear = ()
+        if not self.csi:
+            n_intv, = unpack_from('<i', data, offset)
+            linear = unpack_from(f'<{n_intv}Q', data, offset + 4)
+        self._references[tid] = bins, loffsets, linear
+        return self._references[tid]
+
+    def reg2bins(self, beg, end):
+        """Ranges of the bins, one per level, that may hold records
+        overlapping [beg, end)"""
+
+        end = min(end, 1 << (self.min_shift + 3 * self.depth)) - 1
+        shift, first = self.min_shift + 3 * self.depth, 0
+        for level in range(self.depth + 1):
+            yield range(first + (beg >> shift), first + (end >> shift) + 1)
+            shift -= 3
+            first += 1 << (3 * level)
+
+    def chunks(self, tid, beg, end):
+        """Merged, sorted (begin, end) virtual offsets of the chunks that may
+        hold records of a reference overlapping [beg, end)
+        """
+
+        bins, loffsets, linear = self._reference(tid)
+        if self.csi:
+            # as in htslib, the offset of the nearest bin with records at or
+            # left of beg, looking at left siblings before the parent, is the
+            # first worth reading, since small bins are merged into parents
+            bin = ((1 << 3 * self.depth) - 1) // 7 + (beg >> self.min_shift)
+            while bin and bin not in loffsets:
+                first = (((bin - 1) >> 3) << 3) + 1
+                bin = bin - 1 if bin > first else (bin - 1) >> 3
+            min_offset = loffsets.get(bin, 0)
+        else:
+            window = beg >> self.min_shift
+            min_offset = (
+                linear[window] if window < len(linear)
+                else linear[-1] if linear else 0
+            )
+        # a wide region spans far more bins than a reference holds, e.g.
+        # millions for a whole reference in a deep CSI index
+        levels = list(self.reg2bins(beg, end))
+        if sum(map(len, levels)) > len(bins):
+            candidates = (
+                bin for bin in bins if any(bin in level for level in levels)
+            )
+        else:
+            candidates = (bin for level in levels for bin in level)
+        merged = []
+        for chunk_beg, chunk_end in sorted(
+            chunk
+            for bin in candidates
+            for chunk in bins.get(bin, ())
+            if chunk[1] > min_offset
+        ):
+            if merged and chunk_beg <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], chunk_end)
+            else:
+                merged.append([chunk_beg, chunk_end])
+        return merged
+
+
+class _Block():
+    """Decompressed BGZF block split at newlines. The complete lines are kept
+    with their offsets in the block and the running maximum of their record
+    ends, restarted at each change of reference, so that the first line that
+    may overlap a position is found by bisection.
+
+    Attributes
+    ----------
+    size : int
+        compressed size of the block, 0 past the end of the file
+    nbytes : int
+        memory held by the block, as counted by BlockCache
+    head : bytes
+        data before the first newline, the end of a line begun in an earlier
+        block or a line starting at the block's first byte
+    tail : bytes
+        data after the last newline, or None if the block has no newline
+    tail_start : int
+        offset of the tail in the block
+    lines : list
+        complete lines, without newlines
+    starts : list
+        offsets of the complete lines in the block
+    ends : list
+        running maximum of the complete lines' record ends
+    """
+
+    __slots__ = (
+        'size', 'nbytes', 'head', 'tail', 'tail_start', 'lines', 'starts',
+        'ends'
+    )
+
+    def __init__(self, size, head, tail=None, tail_start=0, lines=(),
+                 starts=(), ends=()):
+        self.size = size
+        self.nbytes = (
+            len(head) + len(tail or b'') + sum(map(len, lines))
+            + LINE_OVERHEAD * len(lines)
+        )
+        self.head = head
+        self.tail = tail
+        self.tail_start = tail_start
+        self.lines = lines
+        self.starts = starts
+        self.ends = ends
+
+
+class CachedTabixFile():
+    """Read-only tabix file whose decompressed BGZF blocks are shared through
+    a BlockCache. fetch() and contigs behave like those of pysam's TabixFile.
+    Blocks are read with pread, so a file can be used from several threads.
+
+    Region fetches go through the cache. Whole-reference fetches, as used
+    for streaming annotation, bypass it so that they do not evict the blocks
+    of point lookups. Intervals of VCF records span their REF allele.
+
+    Parameters
+    ----------
+    filename : str
+        path to the bgzipped file
+    index : str
+        path to its .tbi or .csi index, by default the filename with .tbi or
+        .csi appended
+    cache : BlockCache
+        cache for decompressed blocks, by default the process-wide cache
+
+    Attributes
+    ----------
+    filename : str
+        path to the bgzipped file
+    contigs : list
+        names of the indexed references
+
+    Examples
+    --------
+    with CachedTabixFile('GCF_000001405.39.gz') as vcf:
+        rows = list(vcf.fetch('NC_000008.11', 118184782, 118184783))
+    """
+
+    def __init__(self, filename, index=None, cache=None):
+        if index is None:
+            index = next(
+                (
+                    f'{filename}{suffix}' for suffix in ('.tbi', '.csi')
+                    if os.path.isfile(f'{filename}{suffix}')
+                ),
+                None
+            )
+            if index is None:
+                raise RuntimeError(f'no tabix or CSI index for {filename}')
+        self.filename = filename
+        self.index = TabixIndex(index)
+        self.contigs = list(self.index.contigs)
+        self._tids = {contig: tid for tid, contig in enumerate(self.contigs)}
+        self._cache = cache
+        self._configure_columns()
+        self._fd = os.open(filename, os.O_RDONLY)
+        # the open file is identified by inode, so blocks of a file that has
+        # been replaced in place are never mixed with those of the new one
+        stat = os.fstat(self._fd)
+        self._file_key = (stat.st_dev, stat.st_ino)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return f"CachedTabixFile('{self.filename}')"
+
+    def _configure_columns(self):
+        index = self.index
+        self._vcf = index.format & 0xFFFF == FORMAT_VCF
+        self._shift = 0 if index.format & FORMAT_ZERO_BASED else 1
+        self._seq_col, self._beg_col, self._end_col = (
+            index.col_seq - 1, index.col_beg - 1, index.col_end - 1
+        )
+        if self._vcf:
+            self._end_col = 3
+        self._n_split = max(self._seq_col, self._beg_col, self._end_col) + 1
+        # record ends are kept as the integer in the end column (the REF
+        # length for VCF), which differs from the 0-based end by _end_delta
+        if self._vcf:
+            self._end_delta = -self._shift
+        elif self._end_col < 0:
+            self._end_col = self._beg_col
+            self._end_delta = 1 - self._shift
+        else:
+            self._end_delta = 0
+        self._split = methodcaller('split', b'\t', self._n_split)
+
+    def _parse_line(self, line):
+        if line.startswith(self.index.meta):
+            return None
+        fields = line.split(b'\t', self._n_split)
+        beg = int(fields[self._beg_col]) - self._shift
+        if self._vcf:
+            stop = beg + len(fields[3])
+        else:
+            stop = int(fields[self._end_col]) + self._end_delta
+        return fields[self._seq_col], beg, stop
+
+    def _parse_ends(self, body, lines):
+        meta = self.index.meta
+        if not body.startswith(meta) and b'\n' + meta not in body:
+            fields = list(map(self._split, lines))
+            seqs = list(map(itemgetter(self._seq_col), fields))
+            if self._vcf:
+                ends = list(map(
+                    add,
+                    map(int, map(itemgetter(self._beg_col), fields)),
+                    map(len, map(itemgetter(3), fields))
+                ))
+            else:
+                ends = list(map(int, map(itemgetter(self._end_col), fields)))
+        else:
+            # header lines are parsed line by line
+            seqs, ends = [], []
+            for line in lines:
+                parsed = self._parse_line(line)
+                seqs.append(None if parsed is None else parsed[0])
+                ends.append(
+                    -1 if parsed is None else parsed[2] - self._end_delta
+                )
+        if not seqs or seqs.count(seqs[0]) == len(seqs):
+            return list(accumulate(ends, max))
+        running, previous = [], _STOP
+        for seq, end in zip(seqs, ends):
+            if seq is not previous and seq != previous:
+                previous, maximum = seq, end
+            elif end > maximum:
+                maximum = end
+            running.append(maximum)
+        return running
+
+    def _read_block(self, offset):
+        header = os.pread(self._fd, BGZF_HEADER_SIZE, offset)
+        if len(header) < BGZF_HEADER_SIZE:
+            return _Block(0, b'')
+        xlen, = struct.unpack_from('<H', header, 10)
+        extra = (
+            header[12:] if xlen == 6
+            else os.pread(self._fd, xlen, offset + 12)
+        )
+        position = 0
+        while position + 4 <= len(extra):
+            subfield_length, = struct.unpack_from('<H', extra, position + 2)
+            if extra[position:position + 2] == b'BC':
+                size = struct.unpack_from('<H', extra, position + 4)[0] + 1
+                break
+            position += 4 + subfield_length
+        else:
+            raise RuntimeError(
+                f'{self.filename} is not BGZF-compressed at offset {offset}'
+            )
+        block = os.pread(self._fd, size, offset)
+        data = zlib.decompress(block[12 + xlen:size - 8], -15)
+        first = data.find(b'\n')
+        if first < 0:
+            return _Block(size, data)
+        last = data.rfind(b'\n')
+        body = data[first + 1:last]
+        lines = body.split(b'\n') if last > first else []
+        starts = list(
+            accumulate((len(line) + 1 for line in lines), initial=first + 1)
+        )
+        starts.pop()
+        return _Block(
+            size, data[:first], data[last + 1:], last + 1, lines, starts,
+            self._parse_ends(body, lines)
+        )
+
+    def _block(self, offset, cache):
+        if cache is None:
+            return self._read_block(offset)
+        key = (self._file_key, offset)
+        block = cache.get(key)
+        if block is None:
+            block = self._read_block(offset)
+            cache.put(key, block)
+        return block
+
+    def _match(self, line, reference, start, end):
+        # the row if it overlaps [start, end), _STOP once rows of the
+        # reference begin at or after end, None otherwise
+        parsed = self._parse_line(line)
+        if parsed is None or parsed[0] != reference:
+            return None
+        if parsed[1] >= end:
+            return _STOP
+        return line.decode() if parsed[2] > start else None
+
+    def fetch(
+        self, reference=None, start=None, end=None, multiple_iterators=False
+    ):
+        """Fetch the rows of a reference overlapping [start, end)
+
+        Parameters
+        ----------
+        reference : str
+            reference name
+        start : int
+            0-based start, by default the start of the reference
+        end : int
+            0-based exclusive end, by default the end of the reference
+        multiple_iterators : bool
+            accepted for compatibility with pysam; iterators never share a
+            file position here
+
+        Returns
+        -------
+        iterator
+            rows as strings without trailing newlines
+        """
+
+        if reference not in self._tids:
+            raise ValueError(
+                f'could not create iterator for region {reference}'
+            )
+        whole = start is None and end is None
+        start = max(start or 0, 0)
+        end = MAX_POSITION if end is None else end
+        if start > end:
+            raise ValueError(f'start ({start}) > end ({end})')
+        if whole:
+            cache = None
+        else:
+            cache = self._cache if self._cache is not None else _BLOCK_CACHE
+        return self._rows(
+            reference,
+            start,
+            end,
+            cache if cache is not None and cache.max_bytes else None
+        )
+
+    def _rows(self, reference, start, end, cache):
+        tid = self._tids[reference]
+        reference = reference.encode()
+        # complete lines whose running end is at most this cannot overlap
+        skip_below = start - self._end_delta
+        for chunk_beg, chunk_end in self.index.chunks(tid, start, end):
+            offset, position = chunk_beg >> 16, chunk_beg & 0xFFFF
+            chunk_end = (chunk_end >> 16, chunk_end & 0xFFFF)
+            carry = None
+            while True:
+                block = self._block(offset, cache)
+                if not block.size:
+                    row = carry and self._match(carry, reference, start, end)
+                    if row and row is not _STOP:
+                        yield row
+                    break
+                if carry is None and (offset, position) >= chunk_end:
+                    break
+                if block.tail is None:
+                    # no newline, the line continues into the next block
+                    carry = (carry or b'') + block.head[position:]
+                    offset, position = offset + block.size, 0
+                    continue
+                if carry is not None or position == 0:
+                    row = self._match(
+                        (carry or b'') + block.head, reference, start, end
+                    )
+                    if row is _STOP:
+                        return
+                    if row:
+                        yield row
+                    carry, position = None, len(block.head) + 1
+                if (offset, position) >= chunk_end:
+                    break
+                lo = bisect_left(block.starts, position)
+                hi = (
+                    len(block.starts) if offset < chunk_end[0]
+                    else bisect_left(block.starts, chunk_end[1], lo)
+                )
+                for i in range(
+                    bisect_right(block.ends, skip_below, lo, hi), hi
+                ):
+                    row = self._match(block.lines[i], reference, start, end)
+                    if row is _STOP:
+                        return
+                    if row:
+                        yield row
+                if block.tail and (offset, block.tail_start) < chunk_end:
+                    carry = block.tail
+                elif offset >= chunk_end[0]:
+                    break
+                offset, position = offset + block.size, 0
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+
+
+# Functions ====================================================================
+
+_BLOCK_CACHE = BlockCache(max_bytes=BLOCK_CACHE_MB << 20)
+
+
+def get_block_cache():
+    """Return the process-wide block cache"""
+
+    return _BLOCK_CACHE
+
+
+def configure_block_cache(max_bytes=BLOCK_CACHE_MB << 20):
+    """Replace the process-wide block cache. Open handles are closed, so that
+    lookups switch between pysam and CachedTabixFile handles as the cache is
+    enabled or disabled.
+
+    Parameters
+    ----------
+    max_bytes : int
+        maximum total size of the decompressed blocks held, 0 disables the
+        cache
+
+    Returns
+    -------
+    BlockCache
+        the new cache
+    """
+
+    global _BLOCK_CACHE
+    from pydbsnp.handles import close_all
+    _BLOCK_CACHE = BlockCache(max_bytes=max_bytes)
+    close_all()
+    return _BLOCK_CACHE
@@ -0,0 +1,294 @@
+#===============================================================================
+# cache.py
+#===============================================================================
+
+"""Size-bounded LRU cache of lookup results, with an optional on-disk layer"""
+
+
+
+
+# Imports ======================================================================
+
+import atexit
+import json
+import os
+import threading
+
+from collections import OrderedDict
+
+from pydbsnp.env import CACHE_SIZE, CACHE_DB
+from pydbsnp.handles import get_pool
+
+
+
+
+# Constants ====================================================================
+
+COMMIT_INTERVAL = 1000
+
+
+
+
+# Classes ======================================================================
+
+class LookupCache():
+    """LRU cache of lookup results keyed by (build, rs number) or
+    (build, chrom, pos). Misses are cached explicitly as empty results.
+    Entries are stored under the release of the data they were looked up in,
+    the release of the calling thread's handle pool, so results of an old
+    release are not served after an update. Access is serialized with a lock,
+    so one cache can be shared by threads.
+
+    Parameters
+    ----------
+    maxsize : int
+        maximum number of entries held in memory, 0 disables the cache
+    path : str
+        if given, path of an sqlite database that persists entries across
+        processes
+
+    Attributes
+    ----------
+    maxsize : int
+        maximum number of entries held in memory
+    path : str
+        path of the sqlite database, or None
+    hits : int
+        lookups answered from memory or disk
+    misses : int
+        lookups not in the cache
+    evictions : int
+        entries evicted from memory
+
+    Examples
+    --------
+    cache = LookupCache(maxsize=100000, path='pydbsnp-cache.sqlite')
+    cache.put(('GRCh38', 231361), ([('NC_000008.11', 118184783)], []))
+    cache.get(('GRCh38', 231361))
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+        self._entries = OrderedDict()
+        self._db = None
+        self._db_pid = None
+        self._pending = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f'LookupCache(maxsize={self.maxsize}, path={self.path!r})'
+
+    @property
+    def db(self):
+        # sqlite connections must not be shared across fork
+        if self.path and self._db_pid != os.getpid():
+            import sqlite3
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS lookup '
+                '(key TEXT PRIMARY KEY, value TEXT)'
+            )
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _remember(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        """Cached result for a key
+
+        Parameters
+        ----------
+        key : tuple
+            (build, rs number) or (build, chrom, pos)
+
+        Returns
+        -------
+        tuple
+            the cached (coordinates, rows), or None if the key is not cached
+        """
+
+        key = release_key(key)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            if self.db:
+                row = self.db.execute(
+                    'SELECT value FROM lookup WHERE key = ?', (encode_key(key),)
+                ).fetchone()
+                if row:
+                    coordinates, rows = json.loads(row[0])
+                    value = (
+                        tuple(tuple(c) for c in coordinates),
+                        tuple(tuple(r) for r in rows)
+                    )
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Cache a result
+
+        Parameters
+        ----------
+        key : tuple
+            (build, rs number) or (build, chrom, pos)
+        value : tuple
+            (coordinates, rows), both empty for a miss
+        """
+
+        key = release_key(key)
+        with self._lock:
+            coordinates, rows = value
+            value = (
+                tuple(tuple(c) for c in coordinates),
+                tuple(tuple(r) for r in rows)
+            )
+            self._remember(key, value)
+            if self.db:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO lookup VALUES (?, ?)',
+                    (encode_key(key), json.dumps(value))
+                )
+                self._pending += 1
+                if self._pending >= COMMIT_INTERVAL:
+                    self.commit()
+
+    def commit(self):
+        if self._db and self._db_pid == os.getpid():
+            self._db.commit()
+        self._pending = 0
+
+    def stats(self):
+        """Cache counters
+
+        Returns
+        -------
+        dict
+            hits, misses, evictions, disk hits, current size and maxsize
+        """
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'disk_hits': self.disk_hits,
+            'size': len(self._entries),
+            'maxsize': self.maxsize
+        }
+
+    def clear(self):
+        """Empty the in-memory cache and reset the counters"""
+
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = self.disk_hits = 0
+
+    def purge(self, reference_build, release=None):
+        """Remove the entries of a build looked up in other releases than
+        the current one, in memory and on disk. They are never served, so
+        if another process holds the database locked they are left there.
+
+        Parameters
+        ----------
+        reference_build : str
+            canonical reference build
+        release : str
+            name of the current release, None for the configured paths
+        """
+
+        with self._lock:
+            for key in [
+                key for key in self._entries
+                if key[1] == reference_build and key[0] != release
+            ]:
+                del self._entries[key]
+            if self.db:
+                import sqlite3
+                try:
+                    self.db.execute(
+                        'DELETE FROM lookup '
+                        'WHERE key LIKE ? AND key NOT LIKE ?',
+                        (
+                            f'%\t{reference_build}\t%',
+                            f'{release}\t{reference_build}\t%'
+                        )
+                    )
+                    self.commit()
+                except sqlite3.OperationalError:
+                    self.db.rollback()
+
+    def close(self):
+        self.commit()
+        if self._db and self._db_pid == os.getpid():
+            self._db.close()
+        self._db = None
+        self._db_pid = None
+
+
+
+
+# Functions ====================================================================
+
+def release_key(key):
+    return (get_pool(key[0]).release, *key)
+
+
+def encode_key(key):
+    return '\t'.join(str(k) for k in key)
+
+
+_CACHE = LookupCache(maxsize=CACHE_SIZE, path=CACHE_DB)
+
+
+def get_cache():
+    """Return the process-wide lookup cache"""
+
+    return _CACHE
+
+
+def configure_cache(maxsize=CACHE_SIZE, path=None):
+    """Replace the process-wide lookup cache
+
+    Parameters
+    ----------
+    maxsize : int
+        maximum number of entries held in memory, 0 disables the cache
+    path : str
+        if given, path of an sqlite database that persists entries across
+        processes
+
+    Returns
+    -------
+    LookupCache
+        the new cache
+    """
+
+    global _CACHE
+    _CACHE.close()
+    _CACHE = LookupCache(maxsize=maxsize, path=path)
+    return _CACHE
+
+
+@atexit.register
+def _commit_cache():
+    _CACHE.commit()
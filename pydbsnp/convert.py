@@ -0,0 +1,299 @@
+#===============================================================================
+# convert.py
+#===============================================================================
+
+"""Convert coordinates between reference builds by joining on rsid"""
+
+
+
+
+# Imports ======================================================================
+
+import sys
+
+from argparse import ArgumentParser
+from itertools import chain, islice
+
+from pydbsnp.alleles import alleles_match
+from pydbsnp.annotation import open_input, split_header
+from pydbsnp.query import (
+    chrom_to_hgvs, chrom_style, coordinates_to_rows, hgvs_to_chrom,
+    rsids_to_coordinates
+)
+
+
+
+
+# Constants ====================================================================
+
+BATCH_SIZE = 100_000
+MAPPED = 'mapped'
+UNMAPPED = 'unmapped'
+MULTI_MAPPED = 'multi-mapped'
+BUILDS = ('GRCh37', 'hg19', 'GRCh38', 'hg38')
+
+
+
+
+# Functions ====================================================================
+
+def convert_lines(
+    lines,
+    from_build='GRCh37',
+    to_build='GRCh38',
+    input_format='tsv',
+    batch_size=BATCH_SIZE,
+    header=False
+):
+    """Convert the coordinates of VCF or TSV lines between reference builds
+
+    Each position is mapped to the rsids recorded there in the source build,
+    and those rsids are mapped to coordinates in the target build. Lines are
+    processed in batches, each resolved with one sorted pass over the indices
+    of each build, so memory use is bounded by the batch size.
+
+    Parameters
+    ----------
+    lines
+        iterable of VCF lines, or TSV lines with chromosome and position in
+        the first two columns
+    from_build : str
+        reference build of the input coordinates
+    to_build : str
+        reference build of the output coordinates
+    input_format : str
+        'vcf' or 'tsv'. For VCF input, dbSNP records must also match the
+        alleles, and missing IDs are filled in
+    batch_size : int
+        number of lines resolved together
+    header : bool
+        the first line after any lines starting with '#' is a column header
+
+    Yields
+    ------
+    tuple
+        a status (MAPPED, UNMAPPED or MULTI_MAPPED) and a line. Mapped lines
+        have converted coordinates, other lines are unchanged. Header lines
+        are yielded as MAPPED, and lines whose chromosome or position cannot
+        be parsed as UNMAPPED.
+    """
+
+    header_lines, data = split_header(lines)
+    if header:
+        header_lines.extend(islice(data, 1))
+    for line in header_lines:
+        yield MAPPED, line
+    data = (line for line in data if line)
+    while True:
+        batch = [line.split('\t') for line in islice(data, batch_size)]
+        if not batch:
+            break
+        coordinates = [
+            parse_coordinates(fields, from_build, input_format)
+            for fields in batch
+        ]
+        rows = coordinates_to_rows(
+            (c for c in coordinates if c[0]),
+            reference_build=from_build
+        )
+        rs_numbers = [
+            {
+                int(row[2].replace('rs', ''))
+                for row in rows.get((hgvs, pos), ())
+                if int(row[1]) == pos
+                and row[2].startswith('rs')
+                and (
+                    input_format == 'tsv'
+                    or alleles_match(row, pos, fields[3], fields[4])
+                )
+            }
+            for fields, (hgvs, pos) in zip(batch, coordinates)
+        ]
+        targets = rsids_to_coordinates(
+            set().union(*rs_numbers),
+            reference_build=to_build
+        )
+        for fields, rs_set in zip(batch, rs_numbers):
+            target = {c for rs in rs_set for c in targets.get(rs, ())}
+            if not target:
+                yield UNMAPPED, '\t'.join(fields)
+            elif len(target) > 1:
+                yield MULTI_MAPPED, '\t'.join(fields)
+            else:
+                (hgvs, pos), = target
+                fields[0] = hgvs_to_chrom(
+                    hgvs,
+                    reference_build=to_build,
+                    style=chrom_style(fields[0])
+                )
+                fields[1] = str(pos)
+                if input_format == 'vcf' and fields[2] == '.':
+                    fields[2] = ';'.join(f'rs{rs}' for rs in sorted(rs_set))
+                yield MAPPED, '\t'.join(fields)
+
+
+def parse_coordinates(fields, reference_build='GRCh37', input_format='tsv'):
+    """Parse the chromosome and position of a split line
+
+    Returns
+    -------
+    tuple
+        (HGVS chrom, pos), or (None, None) if the line has too few columns or
+        its chromosome or position cannot be parsed
+    """
+
+    min_fields = 5 if input_format == 'vcf' else 2
+    if len(fields) < min_fields:
+        return None, None
+    try:
+        return (
+            chrom_to_hgvs(fields[0], reference_build=reference_build),
+            int(fields[1])
+        )
+    except (RuntimeError, ValueError):
+        return None, None
+
+
+def convert(
+    input_path,
+    from_build='GRCh37',
+    to_build='GRCh38',
+    input_format=None,
+    batch_size=BATCH_SIZE,
+    header=False
+):
+    """Convert the coordinates of a VCF or TSV file between reference builds
+
+    Parameters
+    ----------
+    input_path : str
+        path to a plain or gzipped VCF or TSV file, or '-' for standard input
+    from_build : str
+        reference build of the input coordinates
+    to_build : str
+        reference build of the output coordinates
+    input_format : str
+        'vcf' or 'tsv'. If None, the format is detected from the first line
+    batch_size : int
+        number of lines resolved together
+    header : bool
+        the first line after any lines starting with '#' is a column header,
+        passed through unchanged
+
+    Yields
+    ------
+    tuple
+        a status (MAPPED, UNMAPPED or MULTI_MAPPED) and a line
+
+    Examples
+    --------
+    for status, line in convert('sumstats.tsv.gz', 'GRCh37', 'GRCh38'):
+        if status == MAPPED:
+            print(line)
+    """
+
+    f = open_input(input_path)
+    try:
+        first = next(f, '')
+        if input_format is None:
+            input_format = (
+                'vcf' if first.startswith('##fileformat=VCF') else 'tsv'
+            )
+        if input_format not in ('vcf', 'tsv'):
+            raise RuntimeError(f'invalid input format: {input_format}')
+        yield from convert_lines(
+            chain((first,), f) if first else f,
+            from_build=from_build,
+            to_build=to_build,
+            input_format=input_format,
+            batch_size=batch_size,
+            header=header
+        )
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def parse_arguments():
+    parser = ArgumentParser(
+        description='convert coordinates between reference builds via rsid'
+    )
+    parser.add_argument(
+        'input',
+        metavar='<input.vcf.gz|tsv>',
+        help='VCF or TSV file (chromosome and position in the first two '
+        'columns), or - for standard input'
+    )
+    parser.add_argument(
+        '--from',
+        dest='from_build',
+        choices=BUILDS,
+        default='GRCh37',
+        help='reference build of the input'
+    )
+    parser.add_argument(
+        '--to',
+        dest='to_build',
+        choices=BUILDS,
+        default='GRCh38',
+        help='reference build of the output'
+    )
+    parser.add_argument(
+        '--header',
+        action='store_true',
+        help='the first line of the input (after any lines starting with #) '
+        'is a column header'
+    )
+    parser.add_argument(
+        '--unmapped',
+        metavar='<path>',
+        help='write lines that could not be mapped to this file'
+    )
+    parser.add_argument(
+        '--multi-mapped',
+        metavar='<path>',
+        help='write lines that mapped to several locations to this file'
+    )
+    parser.add_argument(
+        '--quiet',
+        action='store_true',
+        help='do not print a summary'
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    outputs = {
+        MAPPED: sys.stdout,
+        UNMAPPED: open(args.unmapped, 'w') if args.unmapped else None,
+        MULTI_MAPPED: (
+            open(args.multi_mapped, 'w') if args.multi_mapped else None
+        )
+    }
+    counts = dict.fromkeys(outputs, 0)
+    column_header = args.header
+    try:
+        for status, line in convert(
+            args.input,
+            from_build=args.from_build,
+            to_build=args.to_build,
+            header=args.header
+        ):
+            if line.startswith('#'):
+                pass
+            elif column_header:
+                column_header = False
+            else:
+                counts[status] += 1
+            if outputs[status]:
+                outputs[status].write(f'{line}\n')
+    finally:
+        for status in UNMAPPED, MULTI_MAPPED:
+            if outputs[status]:
+                outputs[status].close()
+    if not args.quiet:
+        print(
+            ', '.join(f'{count} {status}' for status, count in counts.items()),
+            file=sys.stderr
+        )
@@ -8,12 +8,23 @@
 
 # Imports ======================================================================
 
+import hashlib
+import io
+import json
+import os
 import os.path
+import queue
+import threading
+import time
 
 from argparse import ArgumentParser
-from ftplib import FTP
+from concurrent.futures import ThreadPoolExecutor
+from ftplib import FTP, all_errors
 
-from pydbsnp.env import FTP_BASENAME_GRCH37, FTP_BASENAME_GRCH38, BUILD_TO_VCF
+from pydbsnp.env import (
+    FTP_BASENAME_GRCH37, FTP_BASENAME_GRCH38, BUILD_TO_VCF, UPDATE_SUFFIX
+)
+from pydbsnp.release import current_release, release_path
 
 
 
@@ -21,22 +32,404 @@ from pydbsnp.env import FTP_BASENAME_GRCH37, FTP_BASENAME_GRCH38, BUILD_TO_VCF
 # Constants ====================================================================
 
 FTP_HOST = 'ftp.ncbi.nlm.nih.gov'
+FTP_PORT = 21
 FTP_DIR = 'snp/latest_release/VCF'
 BUILD_TO_FTP_BASENAME = {
     'hg19': FTP_BASENAME_GRCH37, 'GRCh37': FTP_BASENAME_GRCH37,
     'hg38': FTP_BASENAME_GRCH38, 'GRCh38': FTP_BASENAME_GRCH38
 }
 BUILD_TO_INT = {'hg19': 37, 'GRCh37':37, 'hg38': 38,'GRCh38': 38}
+BLOCK_SIZE = 1 << 20
+STATUS_INTERVAL = 1.0
+
+# New downloads are split into chunks handed out to the connections in file
+# order, so that all of them write close to the hashed prefix, and the data
+# written ahead of it is held in memory for hashing up to LOOKAHEAD_BYTES
+CHUNK_BYTES = 64 << 20
+LOOKAHEAD_BYTES = 512 << 20
+
+
+
+
+# Classes ======================================================================
+
+class PrefixMD5():
+    """MD5 of the contiguous prefix of a file being downloaded in ranges
+
+    Data arriving at the end of the hashed prefix is hashed straight from the
+    connection. Data arriving ahead of it is held in memory until the prefix
+    reaches it, up to max_buffered bytes. Only data that arrives when the
+    buffer is full is read back from disk, by catch_up.
+
+    Parameters
+    ----------
+    path : str
+        local path of the file
+    max_buffered : int
+        maximum number of bytes held ahead of the hashed prefix
+
+    Attributes
+    ----------
+    hashed : int
+        length of the hashed prefix
+    """
+
+    def __init__(self, path, max_buffered=LOOKAHEAD_BYTES):
+        self.path = path
+        self.max_buffered = max_buffered
+        self.hashed = 0
+        self._md5 = hashlib.md5()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._buffered = 0
+
+    def feed(self, offset, data):
+        """Hash data written at offset if it extends the hashed prefix, or
+        hold it if it lies ahead and the buffer has room"""
+
+        with self._lock:
+            if offset <= self.hashed < offset + len(data):
+                self._md5.update(data[self.hashed - offset:])
+                self.hashed = offset + len(data)
+                self._drain()
+            elif (
+                offset > self.hashed
+                and self._buffered + len(data) <= self.max_buffered
+            ):
+                self._pending[offset] = data
+                self._buffered += len(data)
+
+    def _drain(self):
+        while self.hashed in self._pending:
+            data = self._pending.pop(self.hashed)
+            self._buffered -= len(data)
+            self._md5.update(data)
+            self.hashed += len(data)
+
+    def catch_up(self, frontier):
+        """Hash the bytes between the hashed prefix and frontier, reading
+        from disk those that are not held in memory"""
+
+        with open(self.path, 'rb') as f:
+            while True:
+                with self._lock:
+                    self._drain()
+                    if self.hashed >= frontier:
+                        return
+                    end = min(
+                        [self.hashed + BLOCK_SIZE, frontier]
+                        + [o for o in self._pending if o > self.hashed]
+                    )
+                    f.seek(self.hashed)
+                    data = f.read(end - self.hashed)
+                    if not data:
+                        return
+                    self._md5.update(data)
+                    self.hashed += len(data)
+
+    def hexdigest(self):
+        return self._md5.hexdigest()
 
 
 
 
 # Functions ====================================================================
 
-def download(reference_build='GRCh38', quiet=False):
-    if os.path.isfile(BUILD_TO_VCF[reference_build]):
+def connect(host=FTP_HOST, port=FTP_PORT, directory=FTP_DIR):
+    ftp = FTP()
+    ftp.connect(host, port)
+    ftp.login()
+    ftp.cwd(directory)
+    ftp.voidcmd('TYPE I')
+    return ftp
+
+
+def fetch_md5(ftp, basename):
+    """Fetch the MD5 checksum that NCBI publishes next to a file
+
+    Parameters
+    ----------
+    ftp : FTP
+        a logged-in FTP connection in the data directory
+    basename : str
+        name of the file whose checksum is fetched
+
+    Returns
+    -------
+    str
+        the hex digest
+    """
+
+    buffer = io.BytesIO()
+    ftp.retrbinary(f'RETR {basename}.md5', buffer.write)
+    return buffer.getvalue().decode().split()[0].lower()
+
+
+def download_range(
+    ftp,
+    basename,
+    path,
+    start,
+    end,
+    progress,
+    index,
+    md5=None
+):
+    """Download one byte range of a file into place, resuming from the
+    progress already recorded for the range
+
+    Parameters
+    ----------
+    ftp : FTP
+        a logged-in FTP connection in the data directory, in binary mode
+    basename : str
+        name of the file on the FTP server
+    path : str
+        local path of the (preallocated) file
+    start, end : int
+        byte range [start, end) to download
+    progress : list
+        bytes downloaded per range, updated in place
+    index : int
+        index of this range in `progress`
+    md5 : PrefixMD5
+        if given, fed the data as it is written
+
+    Returns
+    -------
+    bool
+        True if the connection can be used for another range
+    """
+
+    offset = start + progress[index]
+    if offset >= end:
+        return True
+    with open(path, 'r+b', buffering=0) as f, ftp.transfercmd(
+        f'RETR {basename}', rest=offset
+    ) as conn:
+        f.seek(offset)
+        while offset < end:
+            data = conn.recv(min(BLOCK_SIZE, end - offset))
+            if not data:
+                break
+            f.write(data)
+            if md5:
+                md5.feed(offset, data)
+            offset += len(data)
+            progress[index] = offset - start
+    if offset < end:
+        raise RuntimeError(
+            f'connection closed at byte {offset} of range {start}-{end}'
+        )
+    # a range that ends before the end of the file is aborted by closing the
+    # data connection, which servers acknowledge with a 426 reply, and some
+    # then with a 226 that would be read as the reply to the next command
+    try:
+        ftp.voidresp()
+    except all_errors as e:
+        if not str(e).startswith('426'):
+            return False
+        try:
+            return ftp.sendcmd('NOOP').startswith('200')
+        except all_errors:
+            return False
+    return True
+
+
+def download_ranges(
+    basename,
+    path,
+    ranges,
+    progress,
+    indexes,
+    host=FTP_HOST,
+    port=FTP_PORT,
+    directory=FTP_DIR,
+    md5=None
+):
+    """Download ranges of a file taken from a shared queue over one
+    connection, reconnecting if the server does not accept another transfer
+
+    Parameters
+    ----------
+    basename : str
+        name of the file on the FTP server
+    path : str
+        local path of the (preallocated) file
+    ranges : list
+        [start, end) byte ranges
+    progress : list
+        bytes downloaded per range, updated in place
+    indexes : queue.SimpleQueue
+        indexes of the ranges left to download, in file order
+    host, port, directory
+        FTP server and data directory
+    md5 : PrefixMD5
+        if given, fed the data as it is written
+    """
+
+    ftp = None
+    try:
+        while True:
+            try:
+                index = indexes.get_nowait()
+            except queue.Empty:
+                return
+            if ftp is None:
+                ftp = connect(host=host, port=port, directory=directory)
+            start, end = ranges[index]
+            if not download_range(
+                ftp, basename, path, start, end, progress, index, md5=md5
+            ):
+                ftp.close()
+                ftp = None
+    finally:
+        if ftp is not None:
+            ftp.close()
+
+
+def download_file(
+    basename,
+    path,
+    connections=1,
+    host=FTP_HOST,
+    port=FTP_PORT,
+    directory=FTP_DIR,
+    quiet=False
+):
+    """Download a file over parallel connections, resuming a previous partial
+    download if there is one, and verify its MD5 checksum
+
+    Progress is recorded in a `.part.json` file next to the download. The file
+    is split into chunks of at most CHUNK_BYTES, which the connections take
+    in file order, and the checksum is computed from the data as it arrives
+    (see PrefixMD5). Data is read back from disk only when a connection falls
+    so far behind that more than LOOKAHEAD_BYTES arrive ahead of it. hashlib
+    cannot save the state of an MD5, so a resumed download reads the data
+    written before the interruption back from disk.
+
+    Parameters
+    ----------
+    basename : str
+        name of the file on the FTP server
+    path : str
+        local destination path
+    connections : int
+        number of parallel connections
+    host, port, directory
+        FTP server and data directory
+    quiet : bool
+        suppress printed status updates
+    """
+
+    state_path = f'{path}.part.json'
+    ftp = connect(host=host, port=port, directory=directory)
+    expected_md5 = fetch_md5(ftp, basename)
+    size = ftp.size(basename)
+    ftp.quit()
+    if os.path.isfile(state_path) and os.path.isfile(path):
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+        if state['size'] != size or state['md5'] != expected_md5:
+            raise RuntimeError(
+                f'{basename} has changed on the server since the partial '
+                f'download at {path} was started; remove {state_path} to '
+                'start over'
+            )
+        if not quiet:
+            print(f'Resuming partial download at {path}.')
+    else:
+        step = max(min(-(-size // connections), CHUNK_BYTES), 1)
+        ranges = [
+            [start, min(start + step, size)] for start in range(0, size, step)
+        ] or [[0, 0]]
+        state = {
+            'size': size,
+            'md5': expected_md5,
+            'ranges': ranges,
+            'progress': [0] * len(ranges)
+        }
+        # a new file, so that a release hard-linked to an earlier download
+        # is left intact
+        if os.path.isfile(path):
+            os.remove(path)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+    progress = state['progress']
+
+    def save_state():
+        with open(f'{state_path}.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(f'{state_path}.tmp', state_path)
+
+    md5 = PrefixMD5(path)
+    def update_md5():
+        frontier = 0
+        for (start, end), done in zip(state['ranges'], progress):
+            frontier = start + done
+            if frontier < end:
+                break
+        md5.catch_up(frontier)
+
+    indexes = queue.SimpleQueue()
+    for index, (start, end) in enumerate(state['ranges']):
+        if progress[index] < end - start:
+            indexes.put(index)
+    save_state()
+    n_workers = max(min(connections, indexes.qsize()), 1)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+            executor.submit(
+                download_ranges, basename, path, state['ranges'], progress,
+                indexes, host=host, port=port, directory=directory, md5=md5
+            )
+            for _ in range(n_workers)
+        ]
+        try:
+            while not all(future.done() for future in futures):
+                time.sleep(STATUS_INTERVAL)
+                update_md5()
+                save_state()
+                if not quiet:
+                    print(
+                        f'{basename}: {sum(progress)}/{size} bytes '
+                        f'({100 * sum(progress) / max(size, 1):.1f}%)',
+                        end='\r'
+                    )
+            for future in futures:
+                future.result()
+        finally:
+            save_state()
+    update_md5()
+    if not quiet:
+        print()
+    if md5.hexdigest() != expected_md5:
+        os.remove(state_path)
+        raise RuntimeError(
+            f'MD5 mismatch for {path}: expected {expected_md5}, got '
+            f'{md5.hexdigest()}'
+        )
+    os.remove(state_path)
+
+
+def download(
+    reference_build='GRCh38',
+    connections=1,
+    host=FTP_HOST,
+    port=FTP_PORT,
+    directory=FTP_DIR,
+    quiet=False,
+    update=False
+):
+    vcf_path = BUILD_TO_VCF[reference_build]
+    if update:
+        vcf_path = f'{vcf_path}{UPDATE_SUFFIX}'
+    else:
+        vcf_path = release_path(vcf_path, current_release(vcf_path))
+    resuming = os.path.isfile(f'{vcf_path}.part.json')
+    if os.path.isfile(vcf_path) and not resuming and not update:
         decision = input(
-            f'A file already exists at {BUILD_TO_VCF[reference_build]}, do '
+            f'A file already exists at {vcf_path}, do '
             'you want to overwrite it? (y/N):'
         )
         if decision not in 'yY':
@@ -46,27 +439,33 @@ def download(reference_build='GRCh38', quiet=False):
         print(
             'Downloading dbSNP data in VCF format '
             f'({reference_build} coordinates) to '
-            f'{BUILD_TO_VCF[reference_build]}. '
+            f'{vcf_path}. '
             'This will probably take a few minutes.'
         )
-    ftp = FTP(FTP_HOST)
-    ftp.login()
-    ftp.cwd(FTP_DIR)
-    with open(BUILD_TO_VCF[reference_build], 'wb') as f:
-        ftp.retrbinary(
-            f'RETR {BUILD_TO_FTP_BASENAME[reference_build]}', f.write
-        )
+    download_file(
+        BUILD_TO_FTP_BASENAME[reference_build],
+        vcf_path,
+        connections=connections,
+        host=host,
+        port=port,
+        directory=directory,
+        quiet=quiet
+    )
     if not quiet:
         print(
-            f'Downloading tabix index to {BUILD_TO_VCF[reference_build]}.tbi.'
+            f'Downloading tabix index to {vcf_path}.tbi.'
         )
-    with open(f'{BUILD_TO_VCF[reference_build]}.tbi', 'wb') as f:
+    ftp = connect(host=host, port=port, directory=directory)
+    with open(f'{vcf_path}.tbi.tmp', 'wb') as f:
         ftp.retrbinary(
             f'RETR {BUILD_TO_FTP_BASENAME[reference_build]}.tbi', f.write
         )
     ftp.quit()
+    os.replace(f'{vcf_path}.tbi.tmp', f'{vcf_path}.tbi')
     if not quiet:
         print(f'Download complete.')
+        if update:
+            print('Run pydbsnp-index --update to move it into place.')
 
 
 def parse_arguments():
@@ -82,9 +481,47 @@ def parse_arguments():
         action='store_true',
         help='suppress printed status updates'
     )
+    parser.add_argument(
+        '--connections',
+        type=int,
+        default=4,
+        help='number of parallel FTP connections'
+    )
+    parser.add_argument(
+        '--host',
+        default=FTP_HOST,
+        help='FTP server to download from'
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=FTP_PORT,
+        help='FTP server port'
+    )
+    parser.add_argument(
+        '--ftp-dir',
+        default=FTP_DIR,
+        help='directory of the dbSNP VCF files on the FTP server'
+    )
+    parser.add_argument(
+        '--update',
+        action='store_true',
+        help=(
+            'download the latest release next to the existing file, to be '
+            'moved into place by pydbsnp-index --update'
+        )
+    )
     return parser.parse_args()
 
 
 def main():
     args = parse_arguments()
-    download(reference_build=args.reference_build, quiet=args.quiet)
+    download(
+        reference_build=args.reference_build,
+        connections=args.connections,
+        host=args.host,
+        port=args.port,
+        directory=args.ftp_dir,
+        quiet=args.quiet,
+        update=args.update
+    )
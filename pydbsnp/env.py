@@ -19,6 +19,11 @@ import os.path
 
 FTP_BASENAME_GRCH37 = 'GCF_000001405.25.gz'
 FTP_BASENAME_GRCH38 = 'GCF_000001405.39.gz'
+
+# A new release is staged next to the files it replaces until pydbsnp-index
+# --update moves it into place
+UPDATE_SUFFIX = '.new'
+
 VCF_GRCH37 = os.environ.get(
     'PYDBSNP_VCF_GRCH37', 
     os.path.join(os.path.dirname(__file__), FTP_BASENAME_GRCH37)
@@ -43,3 +48,85 @@ BUILD_TO_RSID = {
     'hg19': RSID_GRCH37, 'GRCh37': RSID_GRCH37,
     'hg38': RSID_GRCH38, 'GRCh38': RSID_GRCH38
 }
+RSIDX_GRCH37 = os.environ.get(
+    'PYDBSNP_RSIDX_GRCH37',
+    os.path.join(os.path.dirname(__file__), 'GCF_000001405.25.rsidx')
+)
+RSIDX_GRCH38 = os.environ.get(
+    'PYDBSNP_RSIDX_GRCH38',
+    os.path.join(os.path.dirname(__file__), 'GCF_000001405.39.rsidx')
+)
+BUILD_TO_RSIDX = {
+    'hg19': RSIDX_GRCH37, 'GRCh37': RSIDX_GRCH37,
+    'hg38': RSIDX_GRCH38, 'GRCh38': RSIDX_GRCH38
+}
+PRESENCE_GRCH37 = os.environ.get(
+    'PYDBSNP_PRESENCE_GRCH37',
+    os.path.join(os.path.dirname(__file__), 'GCF_000001405.25.presence')
+)
+PRESENCE_GRCH38 = os.environ.get(
+    'PYDBSNP_PRESENCE_GRCH38',
+    os.path.join(os.path.dirname(__file__), 'GCF_000001405.39.presence')
+)
+BUILD_TO_PRESENCE = {
+    'hg19': PRESENCE_GRCH37, 'GRCh37': PRESENCE_GRCH37,
+    'hg38': PRESENCE_GRCH38, 'GRCh38': PRESENCE_GRCH38
+}
+POSITIONS_GRCH37 = os.environ.get(
+    'PYDBSNP_POSITIONS_GRCH37',
+    os.path.join(os.path.dirname(__file__), 'GCF_000001405.25.positions')
+)
+POSITIONS_GRCH38 = os.environ.get(
+    'PYDBSNP_POSITIONS_GRCH38',
+    os.path.join(os.path.dirname(__file__), 'GCF_000001405.39.positions')
+)
+BUILD_TO_POSITIONS = {
+    'hg19': POSITIONS_GRCH37, 'GRCh37': POSITIONS_GRCH37,
+    'hg38': POSITIONS_GRCH38, 'GRCh38': POSITIONS_GRCH38
+}
+GENES_GRCH37 = os.environ.get(
+    'PYDBSNP_GENES_GRCH37',
+    os.path.join(os.path.dirname(__file__), 'GCF_000001405.25.genes.sqlite')
+)
+GENES_GRCH38 = os.environ.get(
+    'PYDBSNP_GENES_GRCH38',
+    os.path.join(os.path.dirname(__file__), 'GCF_000001405.39.genes.sqlite')
+)
+BUILD_TO_GENES = {
+    'hg19': GENES_GRCH37, 'GRCh37': GENES_GRCH37,
+    'hg38': GENES_GRCH38, 'GRCh38': GENES_GRCH38
+}
+SQLITE_GRCH37 = os.environ.get(
+    'PYDBSNP_SQLITE_GRCH37',
+    os.path.join(os.path.dirname(__file__), 'GCF_000001405.25.records.sqlite')
+)
+SQLITE_GRCH38 = os.environ.get(
+    'PYDBSNP_SQLITE_GRCH38',
+    os.path.join(os.path.dirname(__file__), 'GCF_000001405.39.records.sqlite')
+)
+BUILD_TO_SQLITE = {
+    'hg19': SQLITE_GRCH37, 'GRCh37': SQLITE_GRCH37,
+    'hg38': SQLITE_GRCH38, 'GRCh38': SQLITE_GRCH38
+}
+TABLE_GRCH37 = os.environ.get(
+    'PYDBSNP_TABLE_GRCH37',
+    os.path.join(os.path.dirname(__file__), 'GCF_000001405.25.parquet')
+)
+TABLE_GRCH38 = os.environ.get(
+    'PYDBSNP_TABLE_GRCH38',
+    os.path.join(os.path.dirname(__file__), 'GCF_000001405.39.parquet')
+)
+BUILD_TO_TABLE = {
+    'hg19': TABLE_GRCH37, 'GRCh37': TABLE_GRCH37,
+    'hg38': TABLE_GRCH38, 'GRCh38': TABLE_GRCH38
+}
+SOCKET = os.environ.get(
+    'PYDBSNP_SOCKET',
+    os.path.join(os.path.expanduser('~'), '.pydbsnp.sock')
+)
+CACHE_SIZE = int(os.environ.get('PYDBSNP_CACHE_SIZE', 65536))
+CACHE_DB = os.environ.get('PYDBSNP_CACHE_DB')
+PROFILE = os.environ.get('PYDBSNP_PROFILE', '') not in ('', '0')
+AIO_WORKERS = int(os.environ.get('PYDBSNP_AIO_WORKERS', 4))
+BLOCK_CACHE_MB = int(os.environ.get('PYDBSNP_BLOCK_CACHE_MB', 0))
+BACKEND = os.environ.get('PYDBSNP_BACKEND', 'tabix')
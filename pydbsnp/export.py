@@ -0,0 +1,236 @@
+#===============================================================================
+# export.py
+#===============================================================================
+
+"""Export the dbSNP VCF to a columnar table for vectorized joins"""
+
+
+
+
+# Imports ======================================================================
+
+import os
+import os.path
+
+from argparse import ArgumentParser
+from functools import partial
+from multiprocessing import Pool
+from pysam import TabixFile
+
+from pydbsnp.env import VCF_GRCH37, VCF_GRCH38, TABLE_GRCH37, TABLE_GRCH38
+from pydbsnp.record import info_value
+from pydbsnp.release import current_release, release_path
+from pydbsnp.table import (
+    SUFFIX, chrom_code, import_pyarrow, write_export_release
+)
+
+
+
+
+# Constants ====================================================================
+
+ROW_GROUP_SIZE = 1_000_000
+DEFAULT_INFO = ('VC',)
+FORMATS = ('parquet',)
+
+
+
+
+# Functions ====================================================================
+
+def export_contig(
+    input_vcf_path,
+    contig,
+    output_dir,
+    reference_build='GRCh38',
+    info_keys=DEFAULT_INFO,
+    row_group_size=ROW_GROUP_SIZE
+):
+    """Write the records of one contig to a Parquet file
+
+    Parameters
+    ----------
+    input_vcf_path : str
+        path to the tabix-indexed dbSNP VCF
+    contig : str
+        contig to export
+    output_dir : str
+        directory for the Parquet file
+    reference_build : str
+        reference build for coordinates
+    info_keys
+        INFO keys to export as string columns
+    row_group_size : int
+        number of rows per row group
+
+    Returns
+    -------
+    tuple
+        the contig and the number of rows written
+    """
+
+    pyarrow = import_pyarrow()
+    schema = pyarrow.schema(
+        [
+            ('rs', pyarrow.int64()),
+            ('chrom', pyarrow.int8()),
+            ('pos', pyarrow.int32()),
+            ('ref', pyarrow.string()),
+            ('alt', pyarrow.string())
+        ]
+        + [(key, pyarrow.string()) for key in info_keys]
+    )
+    code = chrom_code(contig, reference_build=reference_build)
+    output_path = os.path.join(output_dir, f'{contig}{SUFFIX}')
+    temp_path = f'{output_path}.tmp'
+    writer = None
+    columns = {name: [] for name in schema.names}
+    n_rows = 0
+    def write_row_group():
+        nonlocal writer
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(temp_path, schema)
+        columns['chrom'] = [code] * len(columns['rs'])
+        writer.write_table(pyarrow.table(columns, schema=schema))
+        for values in columns.values():
+            values.clear()
+    with TabixFile(input_vcf_path) as vcf:
+        for row in vcf.fetch(contig):
+            _, pos, rsid, ref, alt, _, _, info = row.split('\t', 8)[:8]
+            columns['rs'].append(
+                int(rsid[2:]) if rsid.startswith('rs') else None
+            )
+            columns['pos'].append(int(pos))
+            columns['ref'].append(ref)
+            columns['alt'].append(alt)
+            for key in info_keys:
+                value = info_value(info, key)
+                columns[key].append(None if value is None else str(value))
+            n_rows += 1
+            if n_rows % row_group_size == 0:
+                write_row_group()
+    if columns['rs']:
+        write_row_group()
+    if writer is not None:
+        writer.close()
+        os.replace(temp_path, output_path)
+    return contig, n_rows
+
+
+def export(
+    input_vcf_path,
+    output_dir,
+    reference_build='GRCh38',
+    info_keys=DEFAULT_INFO,
+    processes=1,
+    quiet=False,
+    release=None
+):
+    """Export a dbSNP VCF to a directory of Parquet files, one per contig,
+    with columns rs, chrom (numeric code), pos, ref, alt and the selected
+    INFO keys
+
+    Files of contigs that are not in the VCF are removed, and the release
+    the VCF belongs to is recorded once every contig has been written, so
+    that loading a stale export can be detected.
+
+    Parameters
+    ----------
+    input_vcf_path : str
+        path to the tabix-indexed dbSNP VCF
+    output_dir : str
+        directory for the Parquet files
+    reference_build : str
+        reference build for coordinates
+    info_keys
+        INFO keys to export as string columns
+    processes : int
+        number of contigs exported in parallel
+    quiet : bool
+        suppress printed status updates
+    release : str
+        name of the release of the VCF, None for the configured paths
+    """
+
+    if not quiet:
+        print(f'Exporting {input_vcf_path} to {output_dir}.')
+    os.makedirs(output_dir, exist_ok=True)
+    with TabixFile(input_vcf_path) as vcf:
+        contigs = vcf.contigs
+    for name in os.listdir(output_dir):
+        if name.endswith(SUFFIX) and name[:-len(SUFFIX)] not in contigs:
+            os.remove(os.path.join(output_dir, name))
+    with Pool(processes=processes) as pool:
+        for done, (contig, n_rows) in enumerate(
+            pool.imap_unordered(
+                partial(
+                    export_contig,
+                    input_vcf_path,
+                    output_dir=output_dir,
+                    reference_build=reference_build,
+                    info_keys=tuple(info_keys)
+                ),
+                contigs
+            ),
+            start=1
+        ):
+            if not quiet:
+                print(
+                    f'Exported {n_rows} rows from {contig} '
+                    f'({done}/{len(contigs)} contigs).'
+                )
+    write_export_release(output_dir, input_vcf_path, release=release)
+
+
+def parse_arguments():
+    parser = ArgumentParser(
+        description='export dbSNP VCF data to a columnar table'
+    )
+    parser.add_argument(
+        '--format',
+        choices=FORMATS,
+        default='parquet',
+        help='output format'
+    )
+    parser.add_argument(
+        '--info',
+        metavar='<KEY>',
+        action='append',
+        help=(
+            'INFO key to export as a column (may be repeated, default: '
+            f"{', '.join(DEFAULT_INFO)})"
+        )
+    )
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=1,
+        help='number of contigs exported in parallel'
+    )
+    parser.add_argument(
+        '--quiet',
+        action='store_true',
+        help='suppress printed status updates'
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    import_pyarrow()
+    for build, vcf, table in (
+        ('GRCh37', VCF_GRCH37, TABLE_GRCH37),
+        ('GRCh38', VCF_GRCH38, TABLE_GRCH38)
+    ):
+        release = current_release(vcf)
+        vcf = release_path(vcf, release)
+        if os.path.isfile(vcf):
+            export(
+                vcf,
+                table,
+                reference_build=build,
+                info_keys=args.info or DEFAULT_INFO,
+                processes=args.processes,
+                quiet=args.quiet,
+                release=release
+            )
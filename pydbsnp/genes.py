@@ -0,0 +1,343 @@
+#===============================================================================
+# genes.py
+#===============================================================================
+
+"""Gene-to-variant index built from dbSNP GENEINFO
+
+For each gene in the GENEINFO annotations of the dbSNP VCF, the index holds
+the positions of the gene's records coalesced into intervals, in an sqlite
+file. Records of a gene are then read with one backend region lookup per
+interval and checked against GENEINFO, instead of scanning the whole VCF.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import os
+import threading
+
+from functools import partial
+
+from pydbsnp.backends import get_backend
+from pydbsnp.handles import get_pool
+from pydbsnp.record import Record, info_value, parse_geneinfo
+
+
+
+
+# Constants ====================================================================
+
+# Records of a gene closer than this are read with one fetch, trading a few
+# unrelated rows for fewer seeks
+GENE_INTERVAL_GAP = 1000
+SCHEMA = """
+CREATE TABLE genes (gene_id INTEGER PRIMARY KEY, symbol TEXT COLLATE NOCASE);
+CREATE TABLE intervals (
+    gene_id INTEGER, contig TEXT, start INTEGER, end INTEGER, records INTEGER
+);
+"""
+INDEXES = """
+CREATE INDEX genes_symbol ON genes (symbol);
+CREATE INDEX intervals_gene_id ON intervals (gene_id);
+"""
+
+
+
+
+# Classes ======================================================================
+
+class GeneIndex():
+    """Read-only view of a gene index file. Queries are serialized with a
+    lock, so one index can be shared by threads.
+
+    Parameters
+    ----------
+    path : str
+        path to the gene index file
+
+    Attributes
+    ----------
+    path : str
+        path to the gene index file
+
+    Examples
+    --------
+    with GeneIndex('GCF_000001405.39.genes.sqlite') as genes:
+        genes.intervals(genes.gene_ids('CDKAL1'))
+    """
+
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return f"GeneIndex('{self.path}')"
+
+    def gene_ids(self, gene):
+        """Gene IDs for a gene symbol or ID
+
+        Parameters
+        ----------
+        gene : str or int
+            gene symbol, matched case-insensitively, or NCBI gene ID
+
+        Returns
+        -------
+        list
+            the matching gene IDs, empty if the gene has no dbSNP records
+        """
+
+        column = (
+            'gene_id' if isinstance(gene, int) or gene.isdigit() else 'symbol'
+        )
+        with self._lock:
+            return [
+                gene_id for gene_id, in self._db.execute(
+                    f'SELECT gene_id FROM genes WHERE {column} = ?',
+                    (int(gene) if column == 'gene_id' else gene,)
+                )
+            ]
+
+    def intervals(self, gene_ids):
+        """Intervals holding the records of genes
+
+        Parameters
+        ----------
+        gene_ids
+            iterable of gene IDs
+
+        Returns
+        -------
+        list
+            (contig, start, end) intervals of 1-based record positions,
+            sorted by contig and start
+        """
+
+        gene_ids = tuple(gene_ids)
+        with self._lock:
+            return sorted(
+                self._db.execute(
+                    'SELECT contig, start, end FROM intervals WHERE gene_id IN '
+                    f'({", ".join("?" * len(gene_ids))})',
+                    gene_ids
+                )
+            )
+
+    def close(self):
+        self._db.close()
+
+
+
+
+# Functions ====================================================================
+
+def gene_intervals(vcf_path, contig, gap=GENE_INTERVAL_GAP):
+    """Coalesce the positions of each gene's records on one contig into
+    intervals
+
+    Parameters
+    ----------
+    vcf_path : str
+        path to the tabix-indexed dbSNP VCF
+    contig : str
+        contig to read
+    gap : int
+        records of a gene at most this far apart share an interval
+
+    Returns
+    -------
+    tuple
+        the contig, a dict mapping gene IDs to symbols, and a list of
+        (gene ID, contig, start, end, number of records) intervals
+    """
+
+    from pysam import TabixFile
+    symbols, current, intervals = {}, {}, []
+    with TabixFile(vcf_path) as vcf:
+        for row in vcf.fetch(contig):
+            _, pos, _, _, _, _, _, info = row.split('\t', 8)[:8]
+            geneinfo = info_value(info, 'GENEINFO')
+            if not geneinfo:
+                continue
+            pos = int(pos)
+            for symbol, gene_id in parse_geneinfo(geneinfo):
+                symbols[gene_id] = symbol
+                interval = current.get(gene_id)
+                if interval and pos - interval[1] <= gap:
+                    interval[1] = pos
+                    interval[2] += 1
+                else:
+                    if interval:
+                        intervals.append((gene_id, contig, *interval))
+                    current[gene_id] = [pos, pos, 1]
+    intervals.extend(
+        (gene_id, contig, *interval) for gene_id, interval in current.items()
+    )
+    return contig, symbols, intervals
+
+
+def build_gene_index(vcf_path, output_path, processes=1, quiet=False):
+    """Build a gene index file from the GENEINFO annotations of a dbSNP VCF
+
+    Contigs are read in parallel. The file is written to a temporary path and
+    moved into place when complete.
+
+    Parameters
+    ----------
+    vcf_path : str
+        path to the tabix-indexed dbSNP VCF
+    output_path : str
+        path for the gene index file
+    processes : int
+        number of worker processes
+    quiet : bool
+        suppress printed status updates
+    """
+
+    import sqlite3
+    from multiprocessing import Pool
+    from pysam import TabixFile
+    if not quiet:
+        print(f'Building gene index {output_path}.')
+    temp_path = f'{output_path}.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    with TabixFile(vcf_path) as vcf:
+        contigs = vcf.contigs
+    db = sqlite3.connect(temp_path)
+    try:
+        db.executescript(SCHEMA)
+        symbols = {}
+        with Pool(processes=processes) as pool:
+            for contig, contig_symbols, intervals in pool.imap(
+                partial(gene_intervals, vcf_path), contigs
+            ):
+                symbols.update(contig_symbols)
+                db.executemany(
+                    'INSERT INTO intervals VALUES (?, ?, ?, ?, ?)', intervals
+                )
+        db.executemany('INSERT INTO genes VALUES (?, ?)', symbols.items())
+        db.executescript(INDEXES)
+        db.commit()
+    finally:
+        db.close()
+    os.replace(temp_path, output_path)
+    if not quiet:
+        print(f'Indexed {len(symbols)} genes.')
+
+
+def coalesce_intervals(intervals, gap=GENE_INTERVAL_GAP):
+    """Merge sorted intervals that overlap or lie at most gap apart
+
+    Parameters
+    ----------
+    intervals
+        (contig, start, end) intervals sorted by contig and start
+    gap : int
+        intervals at most this far apart are merged
+
+    Returns
+    -------
+    list
+        merged (contig, start, end) intervals
+    """
+
+    merged = []
+    for contig, start, end in intervals:
+        if merged and merged[-1][0] == contig and start - merged[-1][2] <= gap:
+            merged[-1][2] = max(merged[-1][2], end)
+        else:
+            merged.append([contig, start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def fetch_gene_rows(genes, reference_build='GRCh38'):
+    """Stream the raw dbSNP VCF rows annotated to genes
+
+    Parameters
+    ----------
+    genes
+        a gene symbol or NCBI gene ID, or an iterable of them
+    reference_build : str
+        reference build for coordinates
+
+    Yields
+    ------
+    str
+        VCF rows whose GENEINFO names any of the genes, each at most once,
+        in coordinate order
+    """
+
+    if isinstance(genes, (str, int)):
+        genes = (genes,)
+    pool = get_pool(reference_build)
+    index = pool.genes
+    if index is None:
+        raise RuntimeError(
+            f'no gene index for {pool.reference_build}; build it with '
+            'pydbsnp-index --genes'
+        )
+    gene_ids = {gene_id for gene in genes for gene_id in index.gene_ids(gene)}
+    if not gene_ids:
+        return
+    backend = get_backend(reference_build)
+    order = {contig: i for i, contig in enumerate(backend.contigs)}
+    for contig, start, end in coalesce_intervals(
+        sorted(
+            index.intervals(gene_ids),
+            key=lambda interval: (order.get(interval[0], len(order)),
+                                  interval[1])
+        )
+    ):
+        if contig not in order:
+            continue
+        for row in backend.by_region(contig, start - 1, end):
+            fields = row.split('\t', 8)
+            # a long record starting before the interval belongs to an
+            # earlier one, if any
+            if int(fields[1]) < start:
+                continue
+            geneinfo = info_value(fields[7], 'GENEINFO')
+            if geneinfo and any(
+                gene_id in gene_ids for _, gene_id in parse_geneinfo(geneinfo)
+            ):
+                yield row
+
+
+def fetch_genes(genes, reference_build='GRCh38'):
+    """Stream the dbSNP records annotated to genes, using the gene index built
+    by pydbsnp-index --genes
+
+    Parameters
+    ----------
+    genes
+        a gene symbol or NCBI gene ID, or an iterable of them, e.g. a gene
+        panel
+    reference_build : str
+        reference build for coordinates
+
+    Yields
+    ------
+    Record
+        dbSNP records whose GENEINFO names any of the genes, in coordinate
+        order
+
+    Examples
+    --------
+    for record in fetch_genes(['CDKAL1', 'SOX4']):
+        print(record.id, record.geneinfo)
+    """
+
+    for row in fetch_gene_rows(genes, reference_build=reference_build):
+        yield Record.from_row(row.split())
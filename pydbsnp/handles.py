@@ -0,0 +1,339 @@
+#===============================================================================
+# handles.py
+#===============================================================================
+
+"""Shared, lazily opened tabix handles for the dbSNP data"""
+
+
+
+
+# Imports ======================================================================
+
+import os
+import os.path
+import threading
+
+from pydbsnp.bgzf import CachedTabixFile, get_block_cache
+from pydbsnp.metrics import get_metrics
+from pydbsnp.positions import PositionIndex
+from pydbsnp.presence import PresenceIndex
+from pydbsnp.release import resolve_paths
+from pydbsnp.rsid_array import RsidArray
+
+
+
+
+# Constants ====================================================================
+
+CANONICAL_BUILD = {
+    'hg19': 'GRCh37', 'GRCh37': 'GRCh37',
+    'hg38': 'GRCh38', 'GRCh38': 'GRCh38'
+}
+_POOLS = {}
+_LOCAL = threading.local()
+_THREAD_POOLS = []
+
+
+
+
+# Classes ======================================================================
+
+class HandlePool():
+    """Tabix handles on the dbSNP VCF and rsid index of one reference build.
+    Handles are opened on first use and reopened automatically in a forked
+    child process, so a pool may be created before forking. The paths of the
+    current release are resolved once, so that every handle of the pool is
+    opened on the same release even if an update switches releases.
+
+    Parameters
+    ----------
+    reference_build : str
+        reference build for coordinates
+
+    Attributes
+    ----------
+    reference_build : str
+        reference build for coordinates
+    release : str
+        name of the release the handles are opened on, None for the
+        configured paths
+    paths : dict
+        paths of the data files of that release
+    vcf : TabixFile or CachedTabixFile
+        handle on the dbSNP VCF
+    rsid : TabixFile or CachedTabixFile
+        handle on the rsid index
+    rsid_array : RsidArray
+        memory-mapped rsid array, or None if it has not been built
+    presence : PresenceIndex
+        memory-mapped presence bitmaps, or None if they have not been built
+    positions : PositionIndex
+        memory-mapped position arrays, or None if they have not been built
+    genes : GeneIndex
+        gene-to-variant index, or None if it has not been built
+    sqlite : SqliteStore
+        SQLite store of records, or None if it has not been built
+
+    Examples
+    --------
+    with HandlePool('GRCh37') as pool:
+        rows = list(pool.vcf.fetch('NC_000008.10', 118184782, 118184783))
+    """
+
+    def __init__(self, reference_build='GRCh38'):
+        self.reference_build = CANONICAL_BUILD[reference_build]
+        self._pid = os.getpid()
+        self._release = None
+        self._paths = None
+        self._vcf = None
+        self._rsid = None
+        self._rsid_array = None
+        self._presence = None
+        self._positions = None
+        self._genes = None
+        self._sqlite = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return f"HandlePool(reference_build='{self.reference_build}')"
+
+    def _check_pid(self):
+        # Handles inherited across fork share a file offset with the parent,
+        # and sqlite connections must not be shared, so the child drops them
+        # and opens its own.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._vcf = None
+            self._rsid = None
+            self._genes = None
+            self._sqlite = None
+
+    def _resolve(self):
+        if self._paths is None:
+            self._release, self._paths = resolve_paths(self.reference_build)
+
+    @property
+    def release(self):
+        self._resolve()
+        return self._release
+
+    @property
+    def paths(self):
+        self._resolve()
+        return self._paths
+
+    @property
+    def vcf(self):
+        self._check_pid()
+        if self._vcf is None:
+            with get_metrics().timer('handles.open_vcf'):
+                self._vcf = open_tabix(self.paths['vcf'])
+        return self._vcf
+
+    @property
+    def rsid(self):
+        self._check_pid()
+        if self._rsid is None:
+            with get_metrics().timer('handles.open_rsid'):
+                self._rsid = open_tabix(
+                    self.paths['rsid'], index=f"{self.paths['rsid']}.csi"
+                )
+        return self._rsid
+
+    @property
+    def rsid_array(self):
+        # The mapping is read-only, so it stays valid across fork
+        if self._rsid_array is None:
+            path = self.paths['rsidx']
+            with get_metrics().timer('handles.open_rsid_array'):
+                self._rsid_array = os.path.isfile(path) and RsidArray(path)
+        return self._rsid_array or None
+
+    @property
+    def presence(self):
+        # The mapping is read-only, so it stays valid across fork
+        if self._presence is None:
+            path = self.paths['presence']
+            with get_metrics().timer('handles.open_presence'):
+                self._presence = os.path.isfile(path) and PresenceIndex(path)
+        return self._presence or None
+
+    @property
+    def positions(self):
+        # The mapping is read-only, so it stays valid across fork
+        if self._positions is None:
+            path = self.paths['positions']
+            with get_metrics().timer('handles.open_positions'):
+                self._positions = os.path.isfile(path) and PositionIndex(path)
+        return self._positions or None
+
+    @property
+    def genes(self):
+        self._check_pid()
+        if self._genes is None:
+            path = self.paths['genes']
+            if os.path.isfile(path):
+                from pydbsnp.genes import GeneIndex
+                self._genes = GeneIndex(path)
+            else:
+                self._genes = False
+        return self._genes or None
+
+    @property
+    def sqlite(self):
+        self._check_pid()
+        if self._sqlite is None:
+            path = self.paths['sqlite']
+            if os.path.isfile(path):
+                from pydbsnp.sqlite_store import SqliteStore
+                with get_metrics().timer('handles.open_sqlite'):
+                    self._sqlite = SqliteStore(path)
+            else:
+                self._sqlite = False
+        return self._sqlite or None
+
+    def open(self, *names):
+        """Open handles ahead of their first use
+
+        Parameters
+        ----------
+        *names
+            names of the handles to open, e.g. 'vcf' and 'rsid'
+
+        Returns
+        -------
+        list
+            the handles, None for data that has not been built
+        """
+
+        return [getattr(self, name) for name in names]
+
+    def close(self):
+        """Close any open handles. The pool remains usable and will reopen
+        handles on next access, on the release that is current by then.
+        """
+
+        if self._pid == os.getpid():
+            for handle in self._vcf, self._rsid:
+                if handle is not None:
+                    handle.close()
+            for store in self._genes, self._sqlite:
+                if store:
+                    store.close()
+        for mapping in self._rsid_array, self._presence, self._positions:
+            if mapping:
+                mapping.close()
+        self._vcf = None
+        self._rsid = None
+        self._rsid_array = None
+        self._presence = None
+        self._positions = None
+        self._genes = None
+        self._sqlite = None
+        self._release = None
+        self._paths = None
+
+
+
+
+# Functions ====================================================================
+
+def open_tabix(filename, index=None):
+    """Open a tabix handle, sharing decompressed blocks through the block
+    cache if it is enabled
+
+    Parameters
+    ----------
+    filename : str
+        path to the bgzipped file
+    index : str
+        path to its index, by default found next to the file
+
+    Returns
+    -------
+    CachedTabixFile or TabixFile
+        a CachedTabixFile if the block cache has a nonzero budget, a pysam
+        TabixFile otherwise
+    """
+
+    if get_block_cache().max_bytes:
+        return CachedTabixFile(filename, index=index)
+    from pysam import TabixFile
+    return TabixFile(filename, index=index)
+
+
+def get_pool(reference_build='GRCh38'):
+    """Return the shared handle pool for a reference build, creating it if
+    necessary
+
+    Parameters
+    ----------
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    HandlePool
+        the process-wide pool for the build, or the calling thread's own
+        pool if it has called use_thread_pools
+    """
+
+    build = CANONICAL_BUILD[reference_build]
+    pools = getattr(_LOCAL, 'pools', _POOLS)
+    if build not in pools:
+        pools[build] = HandlePool(build)
+    return pools[build]
+
+
+def use_thread_pools():
+    """Give the calling thread its own handle pools, so that it can query
+    concurrently with other threads. Intended as a thread pool initializer.
+
+    Returns
+    -------
+    dict
+        the thread's pools, keyed by reference build
+    """
+
+    _LOCAL.pools = {}
+    _THREAD_POOLS.append(_LOCAL.pools)
+    return _LOCAL.pools
+
+
+def release_thread_pools(pools):
+    """Close the handles of pools returned by use_thread_pools and stop
+    tracking them, e.g. once the threads that used them have finished
+
+    Parameters
+    ----------
+    pools : dict
+        the pools returned by use_thread_pools
+    """
+
+    for pool in pools.values():
+        pool.close()
+    _THREAD_POOLS[:] = [other for other in _THREAD_POOLS if other is not pools]
+
+
+def close_all():
+    """Close the handles of every shared and per-thread pool"""
+
+    for pools in (_POOLS, *_THREAD_POOLS):
+        for pool in pools.values():
+            pool.close()
+
+
+def _reset_after_fork():
+    for pools in (_POOLS, *_THREAD_POOLS):
+        for pool in pools.values():
+            pool._check_pid()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
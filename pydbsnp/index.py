@@ -8,93 +8,752 @@
 
 # Imports ======================================================================
 
+import hashlib
+import heapq
+import json
+import os
 import os.path
-import subprocess
+import shutil
+import tempfile
+import time
 
 from argparse import ArgumentParser
 from functools import partial
+from itertools import islice
 from multiprocessing import Pool
+from pysam import BGZFile, TabixFile, tabix_index
 
-from pydbsnp.env import VCF_GRCH37, VCF_GRCH38, RSID_GRCH37, RSID_GRCH38
+from pydbsnp.env import (
+    VCF_GRCH37, VCF_GRCH38, RSID_GRCH37, RSID_GRCH38, RSIDX_GRCH37,
+    RSIDX_GRCH38, PRESENCE_GRCH37, PRESENCE_GRCH38, POSITIONS_GRCH37,
+    POSITIONS_GRCH38, GENES_GRCH37, GENES_GRCH38, SQLITE_GRCH37, SQLITE_GRCH38,
+    BACKEND, UPDATE_SUFFIX
+)
+from pydbsnp.cache import get_cache
+from pydbsnp.genes import build_gene_index
+from pydbsnp.metrics import enable_metrics, get_metrics
+from pydbsnp.positions import build_positions
+from pydbsnp.presence import build_presence
+from pydbsnp.release import (
+    MANIFEST_SUFFIX, current_release, read_release, write_release,
+    resolve_paths, release_name, release_path, link_file, remove_releases
+)
+from pydbsnp.rsid_array import build_rsid_array
+from pydbsnp.sqlite_store import build_sqlite_store
+
+
+
+
+# Constants ====================================================================
+
+# Rows are bucketed by rs number so buckets can be merged in parallel, and
+# each contig is sorted in runs of at most CHUNK_ROWS rows to bound memory
+RS_BUCKET_WIDTH = 10_000_000
+CHUNK_ROWS = 5_000_000
+WRITE_BATCH_ROWS = 10_000
 
 
 
 
 # Functions ====================================================================
 
-def reformat_sort(
+def rs_key(line):
+    # rows with the same rs number are ordered by contig and position, so the
+    # output does not depend on the order in which contigs were extracted
+    _, rs, chrom, pos = line.split('\t')
+    return int(rs), chrom, int(pos)
+
+
+def rsid_rows(vcf, contig):
+    """(rs number, pos) tuples of the rows of one contig with an rsid, the
+    rows the rsid index is built from
+
+    Parameters
+    ----------
+    vcf : TabixFile
+        handle on the dbSNP VCF
+    contig : str
+        contig to read
+
+    Yields
+    ------
+    tuple
+        rs number and position
+    """
+
+    for row in vcf.fetch(contig):
+        _, pos, rsid, _ = row.split('\t', 3)
+        if rsid.startswith('rs'):
+            yield int(rsid[2:]), int(pos)
+
+
+def extract_contig(input_vcf_path, contig, work_dir, chunk_rows=CHUNK_ROWS):
+    """Extract (rs, chrom, pos) rows of one contig into sorted run files
+
+    Parameters
+    ----------
+    input_vcf_path : str
+        path to the tabix-indexed dbSNP VCF
+    contig : str
+        contig to extract
+    work_dir : str
+        directory for the run files
+    chunk_rows : int
+        maximum number of rows held in memory before a run is written
+
+    Returns
+    -------
+    tuple
+        the contig, the number of rows extracted, a list of (bucket, run
+        path) tuples, and the MD5 checksum of the extracted rows
+    """
+
+    runs = []
+    buckets = {}
+    n_rows = 0
+    md5 = hashlib.md5()
+    def write_runs():
+        for bucket, rows in buckets.items():
+            rows.sort()
+            run_path = os.path.join(work_dir, f'{contig}.{len(runs)}')
+            with open(run_path, 'w') as f:
+                f.writelines(f'rs\t{rs}\t{contig}\t{pos}\n' for rs, pos in rows)
+            runs.append((bucket, run_path))
+        buckets.clear()
+    with TabixFile(input_vcf_path) as vcf:
+        for rs_number, pos in rsid_rows(vcf, contig):
+            md5.update(f'{rs_number}\t{pos}\n'.encode())
+            buckets.setdefault(rs_number // RS_BUCKET_WIDTH, []).append(
+                (rs_number, pos)
+            )
+            n_rows += 1
+            if n_rows % chunk_rows == 0:
+                write_runs()
+    write_runs()
+    return contig, n_rows, runs, md5.hexdigest()
+
+
+def contig_checksum(input_vcf_path, contig):
+    """MD5 checksum of the (rs number, pos) rows of one contig, so that
+    changes to other columns such as INFO do not mark the contig as changed
+
+    Returns
+    -------
+    tuple
+        the contig and the checksum
+    """
+
+    md5 = hashlib.md5()
+    with TabixFile(input_vcf_path) as vcf:
+        for rs_number, pos in rsid_rows(vcf, contig):
+            md5.update(f'{rs_number}\t{pos}\n'.encode())
+    return contig, md5.hexdigest()
+
+
+def merge_bucket(bucket_runs, work_dir, base_rsid_path=None, dropped=()):
+    """K-way merge the sorted runs of one rs bucket into a bgzipped piece
+
+    Parameters
+    ----------
+    bucket_runs : tuple
+        a bucket number and a list of run paths
+    work_dir : str
+        directory for the bgzipped piece
+    base_rsid_path : str
+        if given, an existing rsid index whose rows in the bucket are merged
+        with the runs
+    dropped
+        contigs whose rows are left out of the existing rsid index
+
+    Returns
+    -------
+    tuple
+        the bucket number and the path of the bgzipped piece
+    """
+
+    bucket, run_paths = bucket_runs
+    piece_path = os.path.join(work_dir, f'bucket.{bucket}.gz')
+    runs = [open(run_path, 'r') for run_path in run_paths]
+    base = None
+    try:
+        streams = list(runs)
+        if base_rsid_path:
+            base = TabixFile(base_rsid_path, index=f'{base_rsid_path}.csi')
+            streams.append(
+                f'{row}\n'
+                for row in base.fetch(
+                    'rs',
+                    max(bucket * RS_BUCKET_WIDTH - 1, 0),
+                    (bucket + 1) * RS_BUCKET_WIDTH - 1
+                )
+                if row.split('\t', 3)[2] not in dropped
+            )
+        merged = heapq.merge(*streams, key=rs_key)
+        with BGZFile(piece_path, 'wb') as f:
+            for batch in iter(
+                lambda: ''.join(islice(merged, WRITE_BATCH_ROWS)), ''
+            ):
+                f.write(batch.encode())
+    finally:
+        for run in runs:
+            run.close()
+        if base is not None:
+            base.close()
+    for run_path in run_paths:
+        os.remove(run_path)
+    return bucket, piece_path
+
+
+def parallel_reformat_sort(
     input_vcf_path,
     output_rsid_path,
+    processes=1,
     quiet=False,
-    temp_dir=None
+    temp_dir=None,
+    contigs=None,
+    base_rsid_path=None,
+    base_buckets=(),
+    dropped=()
 ):
+    """Reformat a dbSNP VCF and sort it by rsid using a pool of processes
+
+    Contigs are extracted and sorted into runs in parallel, the runs are
+    k-way merged in parallel per range of rs numbers, and the merged pieces
+    are concatenated into the final bgzipped output.
+
+    Parameters
+    ----------
+    input_vcf_path : str
+        path to the tabix-indexed dbSNP VCF
+    output_rsid_path : str
+        path for the bgzipped rsid file
+    processes : int
+        number of worker processes
+    quiet : bool
+        suppress printed status updates
+    temp_dir : str
+        directory for temporary files, by default the output directory
+    contigs
+        contigs to extract, by default all contigs of the VCF
+    base_rsid_path : str
+        if given, an existing rsid index whose rows are merged into the
+        output, except for those on dropped contigs
+    base_buckets
+        rs buckets present in the existing rsid index
+    dropped
+        contigs whose rows are left out of the existing rsid index
+
+    Returns
+    -------
+    dict
+        a manifest with the checksum and row count of each extracted contig
+        and the rs buckets of the output
+    """
+
     if not quiet:
         print(
-            f'Reformatting database {input_vcf_path} and sorting by RSID. '
-            'This will probably take a couple of hours. Reformatted and sorted '
-            f'data will be written to {output_rsid_path}.'
+            f'Reformatting database {input_vcf_path} and sorting by RSID '
+            f'with {processes} processes. Reformatted and sorted data will be '
+            f'written to {output_rsid_path}.'
         )
-    with open(output_rsid_path, 'wb') as f:
-        with subprocess.Popen(
-            ('zcat', input_vcf_path), stdout=subprocess.PIPE
-        ) as zcat:
-            with subprocess.Popen(
-                (
-                    'awk', '-v', r'OFS=\t',
-                    (
-                        '!/##/ && !/#CHROM/ '
-                        '{sub(/rs/, "", $3); print "rs", $3, $1, $2}'
+    work_dir = tempfile.mkdtemp(
+        prefix='pydbsnp-',
+        dir=temp_dir or os.path.dirname(output_rsid_path) or None
+    )
+    metrics = get_metrics()
+    checksums = {}
+    try:
+        if contigs is None:
+            with TabixFile(input_vcf_path) as vcf:
+                contigs = vcf.contigs
+        bucket_to_runs = {bucket: [] for bucket in base_buckets}
+        with Pool(processes=processes) as pool:
+            start_time = time.perf_counter()
+            for done, (contig, n_rows, runs, md5) in enumerate(
+                pool.imap_unordered(
+                    partial(
+                        extract_contig,
+                        input_vcf_path,
+                        work_dir=work_dir
                     ),
+                    contigs
                 ),
-                stdin=zcat.stdout,
-                stdout=subprocess.PIPE
-            ) as awk:
-                with subprocess.Popen(
-                    (
-                        'sort',
-                        '-k2,2',
-                        '-n',
-                        '-T', temp_dir or os.path.dirname(output_rsid_path)
+                start=1
+            ):
+                for bucket, run_path in runs:
+                    bucket_to_runs.setdefault(bucket, []).append(run_path)
+                checksums[contig] = {'md5': md5, 'rows': n_rows}
+                metrics.count('index.rows', n_rows)
+                metrics.count('index.runs', len(runs))
+                if not quiet:
+                    print(
+                        f'Extracted {n_rows} rows from {contig} '
+                        f'({done}/{len(contigs)} contigs).'
+                    )
+            metrics.record('index.extract', time.perf_counter() - start_time)
+            if not quiet:
+                print(
+                    'Extraction finished in '
+                    f'{time.perf_counter() - start_time:.1f} s.'
+                )
+            start_time = time.perf_counter()
+            pieces = {}
+            for done, (bucket, piece_path) in enumerate(
+                pool.imap_unordered(
+                    partial(
+                        merge_bucket,
+                        work_dir=work_dir,
+                        base_rsid_path=base_rsid_path,
+                        dropped=frozenset(dropped)
                     ),
-                    stdin=awk.stdout,
-                    stdout=subprocess.PIPE
-                ) as sort:
-                    subprocess.run(
-                        ('bgzip', '--stdout'),
-                        stdin=sort.stdout,
-                        stdout=f
+                    bucket_to_runs.items()
+                ),
+                start=1
+            ):
+                pieces[bucket] = piece_path
+                if not quiet:
+                    print(
+                        f'Merged rs bucket {bucket} '
+                        f'({done}/{len(bucket_to_runs)} buckets).'
                     )
-                
+            metrics.record('index.merge', time.perf_counter() - start_time)
+            metrics.count('index.buckets', len(pieces))
+            if not quiet:
+                print(
+                    'Merging finished in '
+                    f'{time.perf_counter() - start_time:.1f} s.'
+                )
+        with metrics.timer('index.concatenate'), open(
+            output_rsid_path, 'wb'
+        ) as f:
+            for bucket in sorted(pieces):
+                with open(pieces[bucket], 'rb') as piece:
+                    shutil.copyfileobj(piece, f)
+    finally:
+        shutil.rmtree(work_dir)
+    return {'contigs': checksums, 'buckets': sorted(pieces)}
+
+
+def read_manifest(rsid_path):
+    """Read the manifest written next to an rsid index
+
+    Parameters
+    ----------
+    rsid_path : str
+        path to the rsid index
+
+    Returns
+    -------
+    dict
+        'contigs' maps each contig of the indexed VCF to its checksum and row
+        count, and 'buckets' lists the rs buckets of the index
+    """
+
+    manifest_path = f'{rsid_path}{MANIFEST_SUFFIX}'
+    if not os.path.isfile(manifest_path):
+        raise RuntimeError(
+            f'{manifest_path} not found; the index must be rebuilt with '
+            'pydbsnp-index before it can be updated'
+        )
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_manifest(rsid_path, manifest):
+    manifest_path = f'{rsid_path}{MANIFEST_SUFFIX}'
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
 
 def index(rsid_file_path, quiet=False):
     if not quiet:
         print(f'Indexing {rsid_file_path}.')
-    subprocess.run(
-        (
-            'tabix',
-            '--csi',
-            '--sequence', '1',
-            '--begin', '2',
-            '--end', '2', 
-            rsid_file_path
+    with get_metrics().timer('index.tabix'):
+        tabix_index(
+            rsid_file_path,
+            force=True,
+            seq_col=0,
+            start_col=1,
+            end_col=1,
+            csi=True
         )
-    )
 
 
 def reformat_sort_index(
     input_vcf_path,
     output_rsid_path,
+    output_rsidx_path=None,
+    processes=1,
     quiet=False,
-    temp_dir=None
+    temp_dir=None,
+    output_presence_path=None,
+    output_positions_path=None,
+    output_genes_path=None,
+    output_sqlite_path=None
 ):
-    reformat_sort(
+    manifest = parallel_reformat_sort(
         input_vcf_path,
         output_rsid_path,
+        processes=processes,
         quiet=quiet,
         temp_dir=temp_dir
     )
-    index(output_rsid_path, quiet=False)
-    
+    index(output_rsid_path, quiet=quiet)
+    write_manifest(output_rsid_path, manifest)
+    if output_rsidx_path:
+        with get_metrics().timer('index.rsid_array'):
+            build_rsid_array(output_rsid_path, output_rsidx_path, quiet=quiet)
+    if output_presence_path:
+        with get_metrics().timer('index.presence'):
+            build_presence(
+                input_vcf_path,
+                output_rsid_path,
+                output_presence_path,
+                processes=processes,
+                quiet=quiet
+            )
+    if output_positions_path:
+        with get_metrics().timer('index.positions'):
+            build_positions(
+                input_vcf_path,
+                output_positions_path,
+                processes=processes,
+                quiet=quiet
+            )
+    if output_genes_path:
+        with get_metrics().timer('index.genes'):
+            build_gene_index(
+                input_vcf_path,
+                output_genes_path,
+                processes=processes,
+                quiet=quiet
+            )
+    if output_sqlite_path:
+        with get_metrics().timer('index.sqlite'):
+            build_sqlite_store(
+                input_vcf_path,
+                output_rsid_path,
+                output_sqlite_path,
+                quiet=quiet
+            )
+
+
+def update_index(
+    input_vcf_path,
+    output_vcf_path,
+    output_rsid_path,
+    output_rsidx_path=None,
+    processes=1,
+    quiet=False,
+    temp_dir=None,
+    output_presence_path=None,
+    output_positions_path=None,
+    output_genes_path=None,
+    output_sqlite_path=None
+):
+    """Update an index to a new dbSNP release, re-extracting only the
+    contigs whose rows changed
+
+    The new release is built by build_release, then readers are switched to
+    it at once by replacing the release pointer of the VCF. Lookups keep
+    working on the old release until the switch, and readers that resolved
+    it before the switch can still open its files until the next update.
+    Other releases are then removed. If the update is interrupted, running
+    it again rebuilds the new release, or only finishes the cleanup if the
+    switch was already made.
+
+    Parameters
+    ----------
+    input_vcf_path : str
+        path to the tabix-indexed VCF of the new release, removed when the
+        update is complete
+    output_vcf_path : str
+        configured path of the dbSNP VCF
+    output_rsid_path : str
+        configured path of the rsid index
+    output_rsidx_path : str
+        configured path of the memory-mapped rsid array, if one should be
+        built
+    processes : int
+        number of worker processes
+    quiet : bool
+        suppress printed status updates
+    temp_dir : str
+        directory for temporary files, by default the output directory
+    output_presence_path : str
+        configured path of the presence bitmaps, if they should be built
+    output_positions_path : str
+        configured path of the position arrays, if they should be built
+    output_genes_path : str
+        configured path of the gene index, if it should be built
+    output_sqlite_path : str
+        configured path of the SQLite store, if it should be built
+
+    Returns
+    -------
+    tuple
+        lists of the changed, added and removed contigs
+    """
+
+    pointer = read_release(output_vcf_path)
+    release = release_name(input_vcf_path)
+    if release == pointer.get('release'):
+        # an earlier run switched to this release but did not finish
+        changed, added, removed = [], [], []
+        previous = pointer.get('previous')
+        if not quiet:
+            print(f'Release {release} is already current.')
+    else:
+        previous = pointer.get('release')
+        changed, added, removed = build_release(
+            input_vcf_path,
+            release,
+            output_vcf_path,
+            output_rsid_path,
+            output_rsidx_path=output_rsidx_path,
+            base_release=previous,
+            processes=processes,
+            quiet=quiet,
+            temp_dir=temp_dir,
+            output_presence_path=output_presence_path,
+            output_positions_path=output_positions_path,
+            output_genes_path=output_genes_path,
+            output_sqlite_path=output_sqlite_path
+        )
+        if not quiet:
+            print(f'Switching {output_vcf_path} to release {release}.')
+        write_release(output_vcf_path, release, previous=previous)
+    remove_releases(
+        [
+            path for path in (
+                output_vcf_path, output_rsid_path, output_rsidx_path,
+                output_presence_path, output_positions_path,
+                output_genes_path, output_sqlite_path
+            )
+            if path
+        ],
+        keep=(release, previous)
+    )
+    for suffix in '', '.tbi':
+        if os.path.isfile(f'{input_vcf_path}{suffix}'):
+            os.remove(f'{input_vcf_path}{suffix}')
+    return changed, added, removed
+
+
+def build_release(
+    input_vcf_path,
+    release,
+    output_vcf_path,
+    output_rsid_path,
+    output_rsidx_path=None,
+    base_release=None,
+    processes=1,
+    quiet=False,
+    temp_dir=None,
+    output_presence_path=None,
+    output_positions_path=None,
+    output_genes_path=None,
+    output_sqlite_path=None
+):
+    """Build the files of a new release from its VCF and the current release
+
+    Contigs are compared by the checksums of their (rs number, pos) rows
+    against the manifest of the current release. Rows of unchanged contigs
+    are read back from its rsid index and merged with the re-extracted rows,
+    and its rsid index and rsid array are reused if no contig changed. The
+    presence bitmaps and position arrays of unchanged contigs are copied
+    from the current release, and the bitmap of rs numbers is rebuilt from
+    the new rsid index. The gene index and SQLite store also hold INFO
+    columns, which the checksums do not cover, so they are rebuilt in full.
+
+    Parameters
+    ----------
+    input_vcf_path : str
+        path to the tabix-indexed VCF of the new release
+    release : str
+        name of the new release
+    output_vcf_path, output_rsid_path, output_rsidx_path
+        configured paths of the VCF, rsid index and rsid array
+    base_release : str
+        name of the current release, None for the configured paths
+    processes : int
+        number of worker processes
+    quiet : bool
+        suppress printed status updates
+    temp_dir : str
+        directory for temporary files, by default the output directory
+    output_presence_path, output_positions_path, output_genes_path
+        configured paths of the presence bitmaps, position arrays and gene
+        index
+    output_sqlite_path : str
+        configured path of the SQLite store
+
+    Returns
+    -------
+    tuple
+        lists of the changed, added and removed contigs
+    """
+
+    for path in (
+        output_vcf_path, output_rsid_path, output_rsidx_path,
+        output_presence_path, output_positions_path, output_genes_path,
+        output_sqlite_path
+    ):
+        if path:
+            os.makedirs(
+                os.path.dirname(release_path(path, release)), exist_ok=True
+            )
+    vcf_path = release_path(output_vcf_path, release)
+    for suffix in '', '.tbi':
+        link_file(f'{input_vcf_path}{suffix}', f'{vcf_path}{suffix}')
+    base_rsid_path = release_path(output_rsid_path, base_release)
+    rsid_path = release_path(output_rsid_path, release)
+    manifest = read_manifest(base_rsid_path)
+    with TabixFile(vcf_path) as vcf:
+        contigs = vcf.contigs
+    if not quiet:
+        print(f'Comparing {len(contigs)} contigs of {input_vcf_path}.')
+    with get_metrics().timer('index.checksum'), Pool(processes) as pool:
+        checksums = dict(pool.map(partial(contig_checksum, vcf_path), contigs))
+    old = manifest['contigs']
+    changed = [c for c in contigs if c in old and old[c]['md5'] != checksums[c]]
+    added = [c for c in contigs if c not in old]
+    removed = [c for c in old if c not in checksums]
+    if not quiet:
+        print(
+            f'{len(changed)} changed, {len(added)} added and {len(removed)} '
+            'removed contigs.'
+        )
+    if changed or added or removed:
+        extracted = parallel_reformat_sort(
+            vcf_path,
+            rsid_path,
+            processes=processes,
+            quiet=quiet,
+            temp_dir=temp_dir,
+            contigs=changed + added,
+            base_rsid_path=base_rsid_path,
+            base_buckets=manifest['buckets'],
+            dropped=changed + removed
+        )
+        index(rsid_path, quiet=quiet)
+        manifest = {
+            'contigs': {
+                contig: extracted['contigs'].get(contig, old.get(contig))
+                for contig in contigs
+            },
+            'buckets': extracted['buckets']
+        }
+        if output_rsidx_path:
+            with get_metrics().timer('index.rsid_array'):
+                build_rsid_array(
+                    rsid_path,
+                    release_path(output_rsidx_path, release),
+                    quiet=quiet
+                )
+    else:
+        if not quiet:
+            print(f'{base_rsid_path} is up to date.')
+        for suffix in '', '.csi':
+            link_file(f'{base_rsid_path}{suffix}', f'{rsid_path}{suffix}')
+        if output_rsidx_path and os.path.isfile(
+            release_path(output_rsidx_path, base_release)
+        ):
+            link_file(
+                release_path(output_rsidx_path, base_release),
+                release_path(output_rsidx_path, release)
+            )
+        elif output_rsidx_path:
+            with get_metrics().timer('index.rsid_array'):
+                build_rsid_array(
+                    rsid_path,
+                    release_path(output_rsidx_path, release),
+                    quiet=quiet
+                )
+    write_manifest(rsid_path, manifest)
+    # dbSNP records all have rsids, so the records of an unchanged contig
+    # start at the same positions
+    unchanged = [c for c in contigs if c not in changed and c not in added]
+    if output_presence_path:
+        base_presence_path = release_path(output_presence_path, base_release)
+        presence_path = release_path(output_presence_path, release)
+        if changed or added or removed or not os.path.isfile(
+            base_presence_path
+        ):
+            with get_metrics().timer('index.presence'):
+                build_presence(
+                    vcf_path,
+                    rsid_path,
+                    presence_path,
+                    processes=processes,
+                    quiet=quiet,
+                    base_path=base_presence_path,
+                    reuse=unchanged
+                )
+        else:
+            link_file(base_presence_path, presence_path)
+    if output_positions_path:
+        base_positions_path = release_path(output_positions_path, base_release)
+        positions_path = release_path(output_positions_path, release)
+        if changed or added or removed or not os.path.isfile(
+            base_positions_path
+        ):
+            with get_metrics().timer('index.positions'):
+                build_positions(
+                    vcf_path,
+                    positions_path,
+                    processes=processes,
+                    quiet=quiet,
+                    base_path=base_positions_path,
+                    reuse=unchanged
+                )
+        else:
+            link_file(base_positions_path, positions_path)
+    # the other structures also hold INFO columns, which are not compared,
+    # so they are rebuilt from the new release
+    if output_genes_path:
+        with get_metrics().timer('index.genes'):
+            build_gene_index(
+                vcf_path,
+                release_path(output_genes_path, release),
+                processes=processes,
+                quiet=quiet
+            )
+    if output_sqlite_path:
+        with get_metrics().timer('index.sqlite'):
+            build_sqlite_store(
+                vcf_path,
+                rsid_path,
+                release_path(output_sqlite_path, release),
+                quiet=quiet
+            )
+    return changed, added, removed
+
+
+def update_path(path, requested, release):
+    """Configured path of an optional structure if it should be built by an
+    update: it was requested, or the current release has it, so that an
+    update does not drop it
+
+    Parameters
+    ----------
+    path : str
+        configured path of the structure
+    requested : bool
+        the structure was requested on the command line
+    release : str
+        name of the current release, None for the configured paths
+
+    Returns
+    -------
+    str
+        the configured path, or None
+    """
+
+    if requested or os.path.isfile(release_path(path, release)):
+        return path
+
 
 def parse_arguments():
     parser = ArgumentParser(description='index dbSNP VCF data by rsid')
@@ -106,42 +765,140 @@ def parse_arguments():
     parser.add_argument(
         '--processes',
         type=int,
-        choices=(1, 2),
         default=1,
-        help='set to 2 to index GRCh37 and GRCh38 data in parallel'
+        help='number of processes used to extract and sort each build'
     )
     parser.add_argument(
         '--tmp-dir',
         metavar='<path/to/tmp/dir/>',
         help='directory for temporary files'
     )
+    parser.add_argument(
+        '--no-array',
+        action='store_true',
+        help='do not build the memory-mapped rsid array'
+    )
+    parser.add_argument(
+        '--presence',
+        action='store_true',
+        help=(
+            'build the rsid and position presence bitmaps, about 1/8 byte '
+            'per rs number and per base of each contig'
+        )
+    )
+    parser.add_argument(
+        '--positions',
+        action='store_true',
+        help='build the position arrays for nearest-site lookups'
+    )
+    parser.add_argument(
+        '--genes',
+        action='store_true',
+        help=(
+            'build the gene-to-variant index from GENEINFO used by '
+            'pydbsnp-query --gene'
+        )
+    )
+    parser.add_argument(
+        '--sqlite',
+        action='store_true',
+        help=(
+            'build the SQLite store for the sqlite lookup backend, done by '
+            'default if PYDBSNP_BACKEND is sqlite'
+        )
+    )
+    parser.add_argument(
+        '--update',
+        action='store_true',
+        help=(
+            'update existing indexes to the new releases downloaded with '
+            'pydbsnp-download --update, re-extracting only changed contigs, '
+            'and rebuilding the optional indexes the current release has'
+        )
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='print counters and stage timings when finished'
+    )
     return parser.parse_args()
 
 
 def main():
     args = parse_arguments()
-    
+    if args.profile:
+        enable_metrics()
+    args.sqlite = args.sqlite or BACKEND == 'sqlite'
+
+    if args.update:
+        for build, vcf, rsid, rsidx, presence, positions, genes, store in (
+            (
+                'GRCh37', VCF_GRCH37, RSID_GRCH37, RSIDX_GRCH37,
+                PRESENCE_GRCH37, POSITIONS_GRCH37, GENES_GRCH37, SQLITE_GRCH37
+            ),
+            (
+                'GRCh38', VCF_GRCH38, RSID_GRCH38, RSIDX_GRCH38,
+                PRESENCE_GRCH38, POSITIONS_GRCH38, GENES_GRCH38, SQLITE_GRCH38
+            )
+        ):
+            if os.path.isfile(f'{vcf}{UPDATE_SUFFIX}'):
+                release = current_release(vcf)
+                update_index(
+                    f'{vcf}{UPDATE_SUFFIX}',
+                    vcf,
+                    rsid,
+                    None if args.no_array else rsidx,
+                    processes=args.processes,
+                    quiet=args.quiet,
+                    temp_dir=args.tmp_dir,
+                    output_presence_path=update_path(
+                        presence, args.presence, release
+                    ),
+                    output_positions_path=update_path(
+                        positions, args.positions, release
+                    ),
+                    output_genes_path=update_path(genes, args.genes, release),
+                    output_sqlite_path=update_path(store, args.sqlite, release)
+                )
+                # cached lookups of the replaced release are never served
+                # again, so their space is reclaimed
+                get_cache().purge(build, current_release(vcf))
+            elif os.path.isfile(
+                release_path(vcf, current_release(vcf))
+            ) and not args.quiet:
+                print(f'No new release found at {vcf}{UPDATE_SUFFIX}.')
+        if args.profile:
+            print(get_metrics().summary())
+        return
+    # a full rebuild replaces the files of the current release in place
+    builds = [resolve_paths(build)[1] for build in ('GRCh37', 'GRCh38')]
     if all(
-        os.path.isfile(rsid)
-        for vcf, rsid in ((VCF_GRCH37, RSID_GRCH37), (VCF_GRCH38, RSID_GRCH38))
-        if os.path.isfile(vcf)
+        os.path.isfile(paths['rsid'])
+        for paths in builds
+        if os.path.isfile(paths['vcf'])
     ):
         decision = input(
             'Index files already exist, do you want to overwrite them? (y/N):'
         )
         if decision not in 'yY':
             return
-    with Pool(processes=args.processes) as pool:
-        pool.starmap(
-            partial(
-                reformat_sort_index,
+    for paths in builds:
+        if os.path.isfile(paths['vcf']):
+            reformat_sort_index(
+                paths['vcf'],
+                paths['rsid'],
+                None if args.no_array else paths['rsidx'],
+                processes=args.processes,
                 quiet=args.quiet,
-                temp_dir=args.tmp_dir
-            ),
-            (
-                (vcf, rsid)
-                for vcf, rsid
-                in ((VCF_GRCH37, RSID_GRCH37), (VCF_GRCH38, RSID_GRCH38))
-                if os.path.isfile(vcf)
+                temp_dir=args.tmp_dir,
+                output_presence_path=(
+                    paths['presence'] if args.presence else None
+                ),
+                output_positions_path=(
+                    paths['positions'] if args.positions else None
+                ),
+                output_genes_path=paths['genes'] if args.genes else None,
+                output_sqlite_path=paths['sqlite'] if args.sqlite else None
             )
-        )
+    if args.profile:
+        print(get_metrics().summary())
@@ -0,0 +1,105 @@
+#===============================================================================
+# membership.py
+#===============================================================================
+
+"""Fast checks of whether rsids and positions are in dbSNP"""
+
+
+
+
+# Imports ======================================================================
+
+from pydbsnp.handles import get_pool
+from pydbsnp.query import (
+    coordinates_to_rows, parse_query, rsids_to_coordinates
+)
+
+
+
+
+# Functions ====================================================================
+
+def contains_many(queries, reference_build='GRCh38'):
+    """Check whether many rsids or positions are in dbSNP
+
+    Queries are answered from the memory-mapped presence bitmaps built by
+    pydbsnp-index, or with batched lookups if they have not been built. A
+    position is present if a dbSNP record starts there.
+
+    Parameters
+    ----------
+    queries
+        iterable of rsids and chr:pos strings, which may be mixed, or a NumPy
+        integer array of rs numbers
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    list or numpy.ndarray
+        a bool for each query in input order, as a NumPy array if the input
+        was one
+
+    Examples
+    --------
+    contains_many(['rs231361', 'chr8:118184783', 'rs1000000000'])
+    contains_many(numpy.array([231361, 7903146]))
+    """
+
+    presence = get_pool(reference_build).presence
+    if hasattr(queries, 'dtype'):
+        if presence:
+            return presence.rs_many(queries)
+        import numpy
+        found = rsids_to_coordinates(
+            (int(rs) for rs in queries if rs > 0),
+            reference_build=reference_build
+        )
+        return numpy.array([int(rs) in found for rs in queries], dtype=bool)
+    parsed = [
+        parse_query(query, reference_build=reference_build)
+        for query in queries
+    ]
+    if presence:
+        return [
+            presence.has_rs(q) if isinstance(q, int)
+            else presence.has_position(*q)
+            for q in parsed
+        ]
+    found = rsids_to_coordinates(
+        (q for q in parsed if isinstance(q, int)),
+        reference_build=reference_build
+    )
+    rows = coordinates_to_rows(
+        (q for q in parsed if not isinstance(q, int)),
+        reference_build=reference_build
+    )
+    return [
+        q in found if isinstance(q, int)
+        else any(int(row[1]) == q[1] for row in rows.get(q, ()))
+        for q in parsed
+    ]
+
+
+def contains(query, reference_build='GRCh38'):
+    """Check whether an rsid or position is in dbSNP
+
+    Parameters
+    ----------
+    query : str
+        rsid or chr:pos string
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    bool
+        True if dbSNP has the rsid, or a record starting at the position
+
+    Examples
+    --------
+    contains('rs231361')
+    contains('chr8:118184783', reference_build='GRCh38')
+    """
+
+    return contains_many((query,), reference_build=reference_build)[0]
@@ -0,0 +1,302 @@
+#===============================================================================
+# metrics.py
+#===============================================================================
+
+"""Optional counters and timings for the lookup and index hot paths
+
+Instrumentation is off by default and costs one attribute check per call
+site when off. It is turned on with the PYDBSNP_PROFILE environment variable
+or enable_metrics(), and callers can forward every event to their own
+metrics system with add_metrics_hook().
+"""
+
+
+
+
+# Imports ======================================================================
+
+import threading
+import time
+
+from contextlib import nullcontext
+
+from pydbsnp.env import PROFILE
+
+
+
+
+# Constants ====================================================================
+
+COUNT = 'count'
+TIME = 'time'
+_NULL_TIMER = nullcontext()
+
+
+
+
+# Classes ======================================================================
+
+class Timer():
+    """Context manager recording the time spent in a block"""
+
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics():
+    """Counters and timings of named phases
+
+    Parameters
+    ----------
+    enabled : bool
+        whether events are recorded
+
+    Attributes
+    ----------
+    enabled : bool
+        whether events are recorded
+    counters : dict
+        maps each counter name to its total
+    timings : dict
+        maps each timing name to a [calls, total seconds] list
+    hooks : list
+        callables receiving (name, value, kind) for every event, where kind
+        is COUNT or TIME and value is a count or a duration in seconds
+
+    Examples
+    --------
+    metrics = Metrics(enabled=True)
+    with metrics.timer('vcf.fetch'):
+        rows = list(pool.vcf.fetch('NC_000008.11', 118184782, 118184783))
+    metrics.count('vcf.rows', len(rows))
+    print(metrics.summary())
+    """
+
+    def __init__(self, enabled=PROFILE):
+        self.enabled = enabled
+        self.counters = {}
+        self.timings = {}
+        self.hooks = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'Metrics(enabled={self.enabled})'
+
+    def count(self, name, n=1):
+        """Add to a counter
+
+        Parameters
+        ----------
+        name : str
+            counter name
+        n : int
+            amount to add
+        """
+
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        for hook in self.hooks:
+            hook(name, n, COUNT)
+
+    def record(self, name, seconds):
+        """Add a duration to a timing
+
+        Parameters
+        ----------
+        name : str
+            timing name
+        seconds : float
+            duration in seconds
+        """
+
+        if not self.enabled:
+            return
+        with self._lock:
+            timing = self.timings.setdefault(name, [0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+        for hook in self.hooks:
+            hook(name, seconds, TIME)
+
+    def timer(self, name):
+        """Context manager timing a block, or a no-op if disabled
+
+        Parameters
+        ----------
+        name : str
+            timing name
+        """
+
+        return Timer(self, name) if self.enabled else _NULL_TIMER
+
+    def scan(self, handle, name, *region, multiple_iterators=False):
+        """Fetch rows from a tabix handle, timing the seek and the reads and
+        counting the rows returned and their bytes, newlines included, which
+        are fewer than the decompressed bytes read when a fetch starts or
+        ends inside a block
+
+        Parameters
+        ----------
+        handle : TabixFile
+            tabix handle to fetch from
+        name : str
+            prefix of the metric names, e.g. 'vcf' or 'rsid'
+        *region
+            arguments for fetch
+        multiple_iterators : bool
+            give the iterator its own file position, so that other fetches
+            from the handle can run before it is exhausted
+
+        Returns
+        -------
+        iterator
+            rows of the region
+        """
+
+        if not self.enabled:
+            return handle.fetch(*region, multiple_iterators=multiple_iterators)
+        return self._scan(handle, name, region, multiple_iterators)
+
+    def _scan(self, handle, name, region, multiple_iterators):
+        start_time = time.perf_counter()
+        rows = handle.fetch(*region, multiple_iterators=multiple_iterators)
+        self.record(f'{name}.fetch', time.perf_counter() - start_time)
+        n_rows = row_bytes = 0
+        elapsed = 0.0
+        try:
+            while True:
+                start_time = time.perf_counter()
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start_time
+                n_rows += 1
+                row_bytes += len(row) + 1
+                yield row
+        finally:
+            self.record(f'{name}.read', elapsed)
+            self.count(f'{name}.rows', n_rows)
+            self.count(f'{name}.row_bytes', row_bytes)
+
+    def snapshot(self):
+        """Current counters and timings
+
+        Returns
+        -------
+        dict
+            'counters' maps names to totals, 'timings' maps names to dicts of
+            calls and total seconds
+        """
+
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'timings': {
+                    name: {'calls': calls, 'total_s': total}
+                    for name, (calls, total) in self.timings.items()
+                }
+            }
+
+    def summary(self):
+        """Human-readable table of the counters and timings
+
+        Returns
+        -------
+        str
+            one line per metric, sorted by name
+        """
+
+        snapshot = self.snapshot()
+        lines = [f"{'timing':<32}{'calls':>10}{'total ms':>12}{'mean ms':>12}"]
+        for name, timing in sorted(snapshot['timings'].items()):
+            calls, total = timing['calls'], timing['total_s']
+            lines.append(
+                f'{name:<32}{calls:>10}{1000 * total:>12.3f}'
+                f'{1000 * total / calls:>12.3f}'
+            )
+        lines.append(f"{'counter':<32}{'total':>10}")
+        for name, total in sorted(snapshot['counters'].items()):
+            lines.append(f'{name:<32}{total:>10}')
+        return '\n'.join(lines)
+
+    def reset(self):
+        """Clear the counters and timings"""
+
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+
+
+
+
+# Functions ====================================================================
+
+_METRICS = Metrics(enabled=PROFILE)
+
+
+def get_metrics():
+    """Return the process-wide metrics"""
+
+    return _METRICS
+
+
+def enable_metrics(enabled=True):
+    """Turn the process-wide metrics on or off
+
+    Parameters
+    ----------
+    enabled : bool
+        whether events are recorded
+
+    Returns
+    -------
+    Metrics
+        the process-wide metrics
+    """
+
+    _METRICS.enabled = enabled
+    return _METRICS
+
+
+def add_metrics_hook(hook):
+    """Forward every recorded event to a callable
+
+    Parameters
+    ----------
+    hook
+        callable receiving (name, value, kind), where kind is COUNT or TIME
+        and value is a count or a duration in seconds
+
+    Examples
+    --------
+    def forward(name, value, kind):
+        if kind == TIME:
+            statsd.timing(f'pydbsnp.{name}', value * 1000)
+        else:
+            statsd.incr(f'pydbsnp.{name}', value)
+    add_metrics_hook(forward)
+    enable_metrics()
+    """
+
+    _METRICS.hooks.append(hook)
+
+
+def remove_metrics_hook(hook):
+    """Stop forwarding events to a callable added with add_metrics_hook"""
+
+    _METRICS.hooks.remove(hook)
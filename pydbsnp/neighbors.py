@@ -0,0 +1,251 @@
+#===============================================================================
+# neighbors.py
+#===============================================================================
+
+"""Nearest dbSNP sites to arbitrary positions"""
+
+
+
+
+# Imports ======================================================================
+
+from pydbsnp.backends import get_backend
+from pydbsnp.handles import get_pool
+from pydbsnp.query import chrom_to_hgvs
+from pydbsnp.record import Record
+
+
+
+
+# Constants ====================================================================
+
+# Without position arrays, windows around a position widen by WINDOW_GROWTH
+# until they hold enough sites, up to MAX_WINDOW, beyond any chromosome
+INITIAL_WINDOW = 256
+WINDOW_GROWTH = 4
+MAX_WINDOW = 1 << 29
+
+
+
+
+# Functions ====================================================================
+
+def window_sites(backend, chrom, pos, k=1, max_distance=None):
+    """Find the dbSNP sites nearest to a position by fetching widening
+    windows around it
+
+    Parameters
+    ----------
+    backend : Backend
+        lookup backend of the reference build
+    chrom : str
+        HGVS name of the contig
+    pos : int
+        1-based position
+    k : int
+        number of sites to return
+    max_distance : int
+        if given, sites further than this from pos are left out
+
+    Returns
+    -------
+    list
+        up to k site positions, nearest first, the lower position first at
+        equal distance
+    """
+
+    if chrom not in backend.contigs:
+        return []
+    limit = MAX_WINDOW
+    if max_distance is not None:
+        limit = min(max_distance, MAX_WINDOW)
+    width = min(INITIAL_WINDOW, limit)
+    while True:
+        sites = {
+            int(row.split('\t', 2)[1])
+            for row in backend.by_region(
+                chrom, max(pos - width - 1, 0), pos + width
+            )
+        }
+        # records starting before the window may overlap it
+        sites = [site for site in sites if abs(site - pos) <= width]
+        if len(sites) >= k or width >= limit:
+            return sorted(sites, key=lambda site: (abs(site - pos), site))[:k]
+        width = min(width * WINDOW_GROWTH, limit)
+
+
+def nearest_sites(
+    chrom,
+    pos,
+    k=1,
+    max_distance=None,
+    reference_build='GRCh38'
+):
+    """Positions of the dbSNP sites nearest to a position
+
+    Parameters
+    ----------
+    chrom : str
+        chromosome, e.g. chr8, 8 or NC_000008.11
+    pos : int
+        1-based position
+    k : int
+        number of sites to return
+    max_distance : int
+        if given, sites further than this from pos are left out
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    list
+        up to k site positions, nearest first
+    """
+
+    chrom = chrom_to_hgvs(chrom, reference_build=reference_build)
+    pool = get_pool(reference_build)
+    if pool.positions:
+        return pool.positions.nearest(
+            chrom, pos, k=k, max_distance=max_distance
+        )
+    return window_sites(
+        get_backend(reference_build), chrom, pos, k=k,
+        max_distance=max_distance
+    )
+
+
+def nearest(chrom, pos, k=1, max_distance=None, reference_build='GRCh38'):
+    """Fetch the dbSNP records at the sites nearest to a position
+
+    Sites are found in the memory-mapped position arrays built by
+    pydbsnp-index, or in widening windows if they have not been built.
+    A site is a position at which dbSNP records start, and its distance to
+    pos is counted between the two positions.
+
+    Parameters
+    ----------
+    chrom : str
+        chromosome, e.g. chr8, 8 or NC_000008.11
+    pos : int
+        1-based position
+    k : int
+        number of sites whose records are returned
+    max_distance : int
+        if given, sites further than this from pos are left out
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    list
+        Record objects of the up to k nearest sites, nearest first, empty if
+        no site is within max_distance
+
+    Examples
+    --------
+    nearest('chr8', 118184780)
+    nearest('chr8', 118184780, k=5, max_distance=1000)
+    """
+
+    chrom = chrom_to_hgvs(chrom, reference_build=reference_build)
+    backend = get_backend(reference_build)
+    return [
+        Record.from_row(fields)
+        for site in nearest_sites(
+            chrom,
+            pos,
+            k=k,
+            max_distance=max_distance,
+            reference_build=reference_build
+        )
+        for fields in backend.by_position(chrom, site)
+        if int(fields[1]) == site
+    ]
+
+
+def nearest_many(
+    chroms,
+    positions,
+    k=1,
+    max_distance=None,
+    reference_build='GRCh38'
+):
+    """Positions of the dbSNP sites nearest to many positions
+
+    With the position arrays built by pydbsnp-index and NumPy input, each
+    contig is searched with one vectorized searchsorted call, so millions of
+    positions take seconds. The records at the sites can be fetched with
+    lookup_many on 'chr:pos' strings.
+
+    Parameters
+    ----------
+    chroms
+        a chromosome shared by all positions, or a sequence with one
+        chromosome per position
+    positions
+        sequence of 1-based positions, or a NumPy integer array
+    k : int
+        number of sites to return for each position
+    max_distance : int
+        if given, sites further than this from a position are left out
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    list or numpy.ndarray
+        a list of up to k site positions, nearest first, for each position,
+        or if the input was a NumPy array, an array of shape
+        (len(positions), k) padded with 0 where fewer than k sites were found
+
+    Examples
+    --------
+    nearest_many('chr8', numpy.array([118184780, 118190000]), k=3)
+    nearest_many(['chr1', 'chr8'], [1000000, 118184780])
+    """
+
+    index = get_pool(reference_build).positions
+    backend = None if index else get_backend(reference_build)
+    hgvs = {}
+    def to_hgvs(chrom):
+        if chrom not in hgvs:
+            hgvs[chrom] = chrom_to_hgvs(chrom, reference_build=reference_build)
+        return hgvs[chrom]
+    if isinstance(chroms, str):
+        groups = {to_hgvs(chroms): None}
+    else:
+        groups = {}
+        for i, chrom in enumerate(chroms):
+            groups.setdefault(to_hgvs(chrom), []).append(i)
+    if hasattr(positions, 'dtype'):
+        import numpy
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        result = numpy.zeros((len(positions), k), dtype=numpy.int64)
+        for chrom, indices in groups.items():
+            if indices is None:
+                indices = slice(None)
+            if index:
+                result[indices] = index.nearest_many(
+                    chrom, positions[indices], k=k, max_distance=max_distance
+                )
+                continue
+            for i in numpy.arange(len(positions))[indices]:
+                sites = window_sites(
+                    backend, chrom, int(positions[i]), k=k,
+                    max_distance=max_distance
+                )
+                result[i, :len(sites)] = sites
+        return result
+    result = [None] * len(positions)
+    for chrom, indices in groups.items():
+        for i in range(len(positions)) if indices is None else indices:
+            result[i] = (
+                index.nearest(
+                    chrom, positions[i], k=k, max_distance=max_distance
+                ) if index
+                else window_sites(
+                    backend, chrom, positions[i], k=k,
+                    max_distance=max_distance
+                )
+            )
+    return result
@@ -0,0 +1,347 @@
+#===============================================================================
+# positions.py
+#===============================================================================
+
+"""Memory-mapped sorted arrays of dbSNP record positions
+
+The file starts with a fixed header, followed by one array per contig of the
+distinct positions at which dbSNP records start, as sorted little-endian
+unsigned 32-bit integers. A table of contig names with the offset and length
+of their arrays comes last. The nearest dbSNP sites to any position are found
+by binary search.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import mmap
+import os
+import os.path
+import shutil
+import struct
+import sys
+import tempfile
+
+from array import array
+from bisect import bisect_left
+from functools import partial
+
+
+
+
+# Constants ====================================================================
+
+MAGIC = b'PYDBSNPS'
+HEADER = struct.Struct('<8sQ')
+WRITE_CHUNK_POSITIONS = 1 << 18
+
+
+
+
+# Classes ======================================================================
+
+class PositionIndex():
+    """Read-only memory-mapped view of a position array file
+
+    Parameters
+    ----------
+    path : str
+        path to the position array file
+
+    Attributes
+    ----------
+    path : str
+        path to the position array file
+    contigs : dict
+        maps each contig name to the (offset, length) of its array
+
+    Examples
+    --------
+    with PositionIndex('GCF_000001405.39.positions') as positions:
+        positions.nearest('NC_000008.11', 118184780, k=3)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, contigs_offset = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise RuntimeError(f'{path} is not a position array file')
+        self.contigs = {}
+        for line in self._mmap[contigs_offset:].decode().splitlines():
+            contig, offset, length = line.split('\t')
+            self.contigs[contig] = (int(offset), int(length))
+        self._views = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return f"PositionIndex('{self.path}')"
+
+    def positions(self, chrom):
+        """Sorted positions of the dbSNP records on a contig
+
+        Parameters
+        ----------
+        chrom : str
+            HGVS name of the contig
+
+        Returns
+        -------
+        memoryview
+            unsigned 32-bit positions backed by the mapping, empty if the
+            contig has no records
+        """
+
+        if chrom not in self._views:
+            offset, length = self.contigs.get(chrom, (HEADER.size, 0))
+            self._views[chrom] = (
+                memoryview(self._mmap)[offset:offset + 4 * length].cast('I')
+            )
+        return self._views[chrom]
+
+    def nearest(self, chrom, pos, k=1, max_distance=None):
+        """Positions of the dbSNP sites nearest to a position
+
+        Parameters
+        ----------
+        chrom : str
+            HGVS name of the contig
+        pos : int
+            1-based position
+        k : int
+            number of sites to return
+        max_distance : int
+            if given, sites further than this from pos are left out
+
+        Returns
+        -------
+        list
+            up to k site positions, nearest first, the lower position first
+            at equal distance
+        """
+
+        sites = self.positions(chrom)
+        left = bisect_left(sites, pos) - 1
+        right = left + 1
+        nearest = []
+        while len(nearest) < k:
+            if left < 0 and right >= len(sites):
+                break
+            if right >= len(sites) or (
+                left >= 0 and pos - sites[left] <= sites[right] - pos
+            ):
+                site, left = sites[left], left - 1
+            else:
+                site, right = sites[right], right + 1
+            if max_distance is not None and abs(site - pos) > max_distance:
+                break
+            nearest.append(site)
+        return nearest
+
+    def nearest_many(self, chrom, positions, k=1, max_distance=None):
+        """Positions of the dbSNP sites nearest to many positions on one
+        contig
+
+        Parameters
+        ----------
+        chrom : str
+            HGVS name of the contig
+        positions
+            sequence of 1-based positions, or a NumPy integer array
+        k : int
+            number of sites to return for each position
+        max_distance : int
+            if given, sites further than this from a position are left out
+
+        Returns
+        -------
+        list or numpy.ndarray
+            a list of up to k site positions for each position, or if the
+            input was a NumPy array, an array of shape (len(positions), k)
+            padded with 0 where fewer than k sites were found
+        """
+
+        if not hasattr(positions, 'dtype'):
+            return [
+                self.nearest(chrom, pos, k=k, max_distance=max_distance)
+                for pos in positions
+            ]
+        import numpy
+        offset, length = self.contigs.get(chrom, (HEADER.size, 0))
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        if not length or not k:
+            return numpy.zeros((len(positions), k), dtype=numpy.int64)
+        sites = numpy.frombuffer(
+            self._mmap, dtype='<u4', count=length, offset=offset
+        )
+        # the k nearest sites are among the k on either side of the
+        # insertion point
+        candidates = (
+            numpy.searchsorted(sites, positions)[:, None]
+            + numpy.arange(-k, k)
+        )
+        valid = (candidates >= 0) & (candidates < length)
+        values = sites[numpy.clip(candidates, 0, length - 1)].astype(
+            numpy.int64
+        )
+        distances = numpy.abs(values - positions[:, None])
+        if max_distance is not None:
+            valid &= distances <= max_distance
+        distances = numpy.where(valid, distances, numpy.iinfo(numpy.int64).max)
+        order = numpy.argsort(distances, axis=1, kind='stable')[:, :k]
+        nearest = numpy.take_along_axis(values, order, axis=1)
+        nearest[~numpy.take_along_axis(valid, order, axis=1)] = 0
+        return nearest
+
+    def close(self):
+        for view in self._views.values():
+            view.release()
+        self._views.clear()
+        self._mmap.close()
+
+
+
+
+# Functions ====================================================================
+
+def contig_positions(vcf_path, contig, work_dir):
+    """Write the position array of one contig to a file
+
+    Parameters
+    ----------
+    vcf_path : str
+        path to the tabix-indexed dbSNP VCF
+    contig : str
+        contig to read
+    work_dir : str
+        directory for the array file
+
+    Returns
+    -------
+    tuple
+        the contig, the path of the array file and the number of positions
+    """
+
+    from pysam import TabixFile
+    piece_path = os.path.join(work_dir, contig)
+    length, previous = 0, 0
+    chunk = array('I')
+    with TabixFile(vcf_path) as vcf, open(piece_path, 'wb') as f:
+        for row in vcf.fetch(contig):
+            pos = int(row.split('\t', 2)[1])
+            if pos == previous:
+                continue
+            if pos < previous:
+                raise RuntimeError(f'{vcf_path} is not sorted')
+            chunk.append(pos)
+            previous = pos
+            if len(chunk) >= WRITE_CHUNK_POSITIONS:
+                length += write_positions(f, chunk)
+        length += write_positions(f, chunk)
+    return contig, piece_path, length
+
+
+def build_positions(
+    vcf_path,
+    output_path,
+    processes=1,
+    quiet=False,
+    base_path=None,
+    reuse=()
+):
+    """Build a position array file from a dbSNP VCF
+
+    Contigs are read in parallel, each into an array file that is appended
+    to the output, so memory use does not grow with the size of the VCF. The
+    arrays of reused contigs are copied from the file of the previous release
+    instead. The file is written to a temporary path and moved into place
+    when complete.
+
+    Parameters
+    ----------
+    vcf_path : str
+        path to the tabix-indexed dbSNP VCF
+    output_path : str
+        path for the position array file
+    processes : int
+        number of worker processes
+    quiet : bool
+        suppress printed status updates
+    base_path : str
+        position array file of the previous release
+    reuse
+        contigs whose records start at the same positions as in the previous
+        release
+    """
+
+    from multiprocessing import Pool
+    from pysam import TabixFile
+    from pydbsnp.release import copy_section
+    if not quiet:
+        print(f'Building position arrays {output_path}.')
+    base_contigs = {}
+    if base_path and reuse and os.path.isfile(base_path):
+        with PositionIndex(base_path) as base:
+            base_contigs = {
+                contig: section for contig, section in base.contigs.items()
+                if contig in reuse
+            }
+    temp_path = f'{output_path}.tmp'
+    work_dir = tempfile.mkdtemp(
+        prefix='pydbsnp-', dir=os.path.dirname(output_path) or None
+    )
+    contigs = []
+    try:
+        with TabixFile(vcf_path) as vcf:
+            vcf_contigs = vcf.contigs
+        with open(temp_path, 'wb') as f, Pool(processes=processes) as pool:
+            f.write(HEADER.pack(MAGIC, 0))
+            pieces = pool.imap(
+                partial(contig_positions, vcf_path, work_dir=work_dir),
+                [c for c in vcf_contigs if c not in base_contigs]
+            )
+            for contig in vcf_contigs:
+                offset = f.tell()
+                if contig in base_contigs:
+                    base_offset, length = base_contigs[contig]
+                    copy_section(base_path, f, base_offset, 4 * length)
+                else:
+                    _, piece_path, length = next(pieces)
+                    with open(piece_path, 'rb') as piece:
+                        shutil.copyfileobj(piece, f)
+                    os.remove(piece_path)
+                contigs.append(f'{contig}\t{offset}\t{length}')
+            contigs_offset = f.tell()
+            f.write('\n'.join(contigs).encode())
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, contigs_offset))
+    finally:
+        shutil.rmtree(work_dir)
+    os.replace(temp_path, output_path)
+
+
+def write_positions(f, chunk):
+    """Write positions as little-endian 32-bit integers and empty the chunk
+
+    Returns
+    -------
+    int
+        number of positions written
+    """
+
+    if sys.byteorder != 'little':
+        chunk.byteswap()
+    chunk.tofile(f)
+    length = len(chunk)
+    del chunk[:]
+    return length
@@ -0,0 +1,339 @@
+#===============================================================================
+# presence.py
+#===============================================================================
+
+"""Memory-mapped presence bitmaps for rs numbers and positions
+
+The file starts with a fixed header and a bitmap with one bit per rs number,
+followed by one bitmap per contig with one bit per position at which a dbSNP
+record starts. A table of contig names with the offset and size of their
+bitmaps comes last. Plain bitmaps are exact, and at dbSNP's density they are
+smaller than a Bloom filter with a useful false positive rate.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import gzip
+import mmap
+import os
+import os.path
+import shutil
+import struct
+import tempfile
+
+from functools import partial
+
+
+
+
+# Constants ====================================================================
+
+MAGIC = b'PYDBSNPP'
+HEADER = struct.Struct('<8sQQ')
+WRITE_CHUNK_BYTES = 1 << 20
+
+
+
+
+# Classes ======================================================================
+
+class PresenceIndex():
+    """Read-only memory-mapped view of a presence bitmap file
+
+    Parameters
+    ----------
+    path : str
+        path to the presence bitmap file
+
+    Attributes
+    ----------
+    path : str
+        path to the presence bitmap file
+    contigs : dict
+        maps each contig name to the (offset, size) of its bitmap in bytes
+
+    Examples
+    --------
+    with PresenceIndex('GCF_000001405.39.presence') as presence:
+        presence.has_rs(231361)
+        presence.has_position('NC_000008.11', 118184783)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._rs_size, contigs_offset = HEADER.unpack_from(
+            self._mmap, 0
+        )
+        if magic != MAGIC:
+            self._mmap.close()
+            raise RuntimeError(f'{path} is not a presence bitmap file')
+        self.contigs = {}
+        for line in self._mmap[contigs_offset:].decode().splitlines():
+            contig, offset, size = line.split('\t')
+            self.contigs[contig] = (int(offset), int(size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return f"PresenceIndex('{self.path}')"
+
+    def _test(self, offset, size, value):
+        return (
+            0 <= value < size * 8
+            and self._mmap[offset + (value >> 3)] >> (value & 7) & 1 == 1
+        )
+
+    def _test_many(self, offset, size, values):
+        if hasattr(values, 'dtype'):
+            import numpy
+            bits = numpy.frombuffer(
+                self._mmap, dtype=numpy.uint8, count=size, offset=offset
+            )
+            values = numpy.asarray(values, dtype=numpy.int64)
+            found = (values >= 0) & (values < size * 8)
+            hits = values[found]
+            found[found] = (bits[hits >> 3] >> (hits & 7) & 1).astype(bool)
+            return found
+        buffer, limit = self._mmap, size * 8
+        return [
+            0 <= v < limit and buffer[offset + (v >> 3)] >> (v & 7) & 1 == 1
+            for v in values
+        ]
+
+    def has_rs(self, rs_number):
+        """Check whether an rs number is in dbSNP
+
+        Parameters
+        ----------
+        rs_number : int
+            rs number to check
+
+        Returns
+        -------
+        bool
+            True if the rs number is present
+        """
+
+        return self._test(HEADER.size, self._rs_size, rs_number)
+
+    def has_position(self, chrom, pos):
+        """Check whether a dbSNP record starts at a position
+
+        Parameters
+        ----------
+        chrom : str
+            HGVS name of the contig
+        pos : int
+            1-based position
+
+        Returns
+        -------
+        bool
+            True if a record starts at the position
+        """
+
+        if chrom not in self.contigs:
+            return False
+        return self._test(*self.contigs[chrom], pos)
+
+    def rs_many(self, rs_numbers):
+        """Check many rs numbers at once
+
+        Parameters
+        ----------
+        rs_numbers
+            sequence of rs numbers, or a NumPy integer array
+
+        Returns
+        -------
+        list or numpy.ndarray
+            a bool for each rs number, as a NumPy array if the input was one
+        """
+
+        return self._test_many(HEADER.size, self._rs_size, rs_numbers)
+
+    def positions_many(self, chrom, positions):
+        """Check many positions on one contig at once
+
+        Parameters
+        ----------
+        chrom : str
+            HGVS name of the contig
+        positions
+            sequence of 1-based positions, or a NumPy integer array
+
+        Returns
+        -------
+        list or numpy.ndarray
+            a bool for each position, as a NumPy array if the input was one
+        """
+
+        offset, size = self.contigs.get(chrom, (HEADER.size, 0))
+        return self._test_many(offset, size, positions)
+
+    def close(self):
+        self._mmap.close()
+
+
+
+
+# Functions ====================================================================
+
+def write_bitmap(f, sorted_values):
+    """Write a bitmap with the bits of sorted non-negative integers set
+
+    Parameters
+    ----------
+    f
+        binary file to write to
+    sorted_values
+        iterable of integers in non-decreasing order
+
+    Returns
+    -------
+    int
+        size of the bitmap in bytes
+    """
+
+    chunk = bytearray()
+    size = 0
+    current_index, current_byte = 0, 0
+    for value in sorted_values:
+        index = value >> 3
+        if index != current_index:
+            if index < current_index:
+                raise RuntimeError('values are not sorted')
+            chunk.append(current_byte)
+            chunk.extend(bytes(index - current_index - 1))
+            current_index, current_byte = index, 0
+            if len(chunk) >= WRITE_CHUNK_BYTES:
+                f.write(chunk)
+                size += len(chunk)
+                chunk.clear()
+        current_byte |= 1 << (value & 7)
+    chunk.append(current_byte)
+    f.write(chunk)
+    return size + len(chunk)
+
+
+def contig_bitmap(vcf_path, contig, work_dir):
+    """Write the position bitmap of one contig to a file
+
+    Parameters
+    ----------
+    vcf_path : str
+        path to the tabix-indexed dbSNP VCF
+    contig : str
+        contig to read
+    work_dir : str
+        directory for the bitmap file
+
+    Returns
+    -------
+    tuple
+        the contig, the path of the bitmap file and its size in bytes
+    """
+
+    from pysam import TabixFile
+    piece_path = os.path.join(work_dir, contig)
+    with TabixFile(vcf_path) as vcf, open(piece_path, 'wb') as f:
+        size = write_bitmap(
+            f, (int(row.split('\t', 2)[1]) for row in vcf.fetch(contig))
+        )
+    return contig, piece_path, size
+
+
+def build_presence(
+    vcf_path,
+    rsid_path,
+    output_path,
+    processes=1,
+    quiet=False,
+    base_path=None,
+    reuse=()
+):
+    """Build a presence bitmap file from a dbSNP VCF and its rsid index
+
+    Contigs are read in parallel, each into a bitmap file that is appended
+    to the output, while the rsid index is read sequentially in sorted order,
+    so memory use does not grow with their size. The bitmaps of reused
+    contigs are copied from the file of the previous release instead. The
+    file is written to a temporary path and moved into place when complete.
+
+    Parameters
+    ----------
+    vcf_path : str
+        path to the tabix-indexed dbSNP VCF
+    rsid_path : str
+        path to the rsid index produced by index.parallel_reformat_sort
+    output_path : str
+        path for the presence bitmap file
+    processes : int
+        number of worker processes
+    quiet : bool
+        suppress printed status updates
+    base_path : str
+        presence bitmap file of the previous release
+    reuse
+        contigs whose records start at the same positions as in the previous
+        release
+    """
+
+    from multiprocessing import Pool
+    from pysam import TabixFile
+    from pydbsnp.release import copy_section
+    if not quiet:
+        print(f'Building presence bitmaps {output_path}.')
+    base_contigs = {}
+    if base_path and reuse and os.path.isfile(base_path):
+        with PresenceIndex(base_path) as base:
+            base_contigs = {
+                contig: section for contig, section in base.contigs.items()
+                if contig in reuse
+            }
+    temp_path = f'{output_path}.tmp'
+    work_dir = tempfile.mkdtemp(
+        prefix='pydbsnp-', dir=os.path.dirname(output_path) or None
+    )
+    contigs = []
+    try:
+        with TabixFile(vcf_path) as vcf:
+            vcf_contigs = vcf.contigs
+        with open(temp_path, 'wb') as f, Pool(processes=processes) as pool:
+            pieces = pool.imap(
+                partial(contig_bitmap, vcf_path, work_dir=work_dir),
+                [c for c in vcf_contigs if c not in base_contigs]
+            )
+            f.write(HEADER.pack(MAGIC, 0, 0))
+            with gzip.open(rsid_path, 'rt') as rsid:
+                rs_size = write_bitmap(
+                    f, (int(line.split('\t', 2)[1]) for line in rsid)
+                )
+            for contig in vcf_contigs:
+                offset = f.tell()
+                if contig in base_contigs:
+                    base_offset, size = base_contigs[contig]
+                    copy_section(base_path, f, base_offset, size)
+                else:
+                    _, piece_path, size = next(pieces)
+                    with open(piece_path, 'rb') as piece:
+                        shutil.copyfileobj(piece, f)
+                    os.remove(piece_path)
+                contigs.append(f'{contig}\t{offset}\t{size}')
+            contigs_offset = f.tell()
+            f.write('\n'.join(contigs).encode())
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, rs_size, contigs_offset))
+    finally:
+        shutil.rmtree(work_dir)
+    os.replace(temp_path, output_path)
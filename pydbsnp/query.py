@@ -10,11 +10,17 @@
 # Imports ======================================================================
 
 import re
+import sys
 
 from argparse import ArgumentParser
-from pysam import TabixFile, VariantFile
+from functools import partial
+from itertools import islice, tee
 
-from pydbsnp.env import BUILD_TO_VCF, BUILD_TO_RSID
+from pydbsnp.backends import get_backend
+from pydbsnp.cache import get_cache
+from pydbsnp.handles import CANONICAL_BUILD, get_pool
+from pydbsnp.metrics import enable_metrics, get_metrics
+from pydbsnp.record import Record
 
 
 
@@ -22,9 +28,18 @@ from pydbsnp.env import BUILD_TO_VCF, BUILD_TO_RSID
 # Constants ====================================================================
 
 COORD_REGEX = re.compile('.+:[0-9]+$')
+REGION_REGEX = re.compile('.+:[0-9]+-[0-9]+$')
 RSID_REGEX = re.compile('rs[1-9][0-9]+$')
 HGVS_REGEX = re.compile(r'N._[0-9]{6}\.[0-9]+$')
 
+# Marker returned by lookup_many for queries with no dbSNP record
+NOT_FOUND = None
+
+# Parallel lookups stream queries in batches of LOOKUP_BATCH_SIZE, and give
+# each worker runs of at least MIN_SHARD_SIZE sorted queries
+LOOKUP_BATCH_SIZE = 100_000
+MIN_SHARD_SIZE = 1000
+
 CHROM_TO_HGVS = {
     'GRCh37': {
         'chr1': 'NC_000001.10',
@@ -187,6 +202,16 @@ CHROM_TO_HGVS = {
 }
 CHROM_TO_HGVS['hg19'] = CHROM_TO_HGVS['GRCh37']
 CHROM_TO_HGVS['hg38'] = CHROM_TO_HGVS['GRCh38']
+HGVS_TO_CHROM = {
+    build: {
+        hgvs: chrom
+        for chrom, hgvs in reversed(tuple(chrom_to_hgvs.items()))
+        if isinstance(chrom, str)
+        and chrom.startswith('chr')
+        and chrom != 'chrMT'
+    }
+    for build, chrom_to_hgvs in CHROM_TO_HGVS.items()
+}
 
 
 
@@ -239,41 +264,72 @@ class GeneralizedVariant():
         id=None,
         reference_build='GRCh38'
     ):
+        build = CANONICAL_BUILD[reference_build]
         if chrom and pos and not id:
-            self.chrom = (
-                chrom_to_hgvs(chrom, reference_build=reference_build),
-            )
-            self.pos = (int(pos),)
+            query = f'{chrom}:{pos}'
+            hgvs = chrom_to_hgvs(chrom, reference_build=reference_build)
+            coordinates = [(hgvs, int(pos))]
+            key = (build,) + coordinates[0]
         elif id and not (chrom or pos):
-            rs_number = int(id.replace('rs', ''))
-            self.chrom, self.pos = zip(
-                *(
-                    row.split()[2:]
-                    for row in TabixFile(
-                        BUILD_TO_RSID[reference_build],
-                        index=f'{BUILD_TO_RSID[reference_build]}.csi'
-                    ).fetch(
-                        'rs', rs_number - 1, rs_number
-                    )
-                )
-            )
-            self.pos = tuple(int(p) for p in self.pos)
+            query = id
+            coordinates = None
+            key = (build, int(id.replace('rs', '')))
         else:
-            print('Invalid input parameters')
-        
-        _, _, self.id, self.ref, self.alt, _, _, self.info = zip(
-            *(
-                row.split()
-                for chrom, pos in zip(self.chrom, self.pos)
-                for row in TabixFile(BUILD_TO_VCF[reference_build]).fetch(
-                    chrom, pos - 1, pos
+            raise RuntimeError('Invalid input parameters')
+        cache = get_cache()
+        result = cache.get(key)
+        if result is None:
+            if coordinates is None:
+                coordinates = rsid_to_coordinates(
+                    id,
+                    reference_build=reference_build
                 )
+            rows = coordinates_to_rows(
+                coordinates,
+                reference_build=reference_build
             )
-        )
+            result = (
+                coordinates,
+                [r for c in coordinates for r in rows.get(c, ())]
+            )
+            cache.put(key, result)
+        coordinates, rows = result
+        if not rows:
+            raise ValueError(f'{query} was not found in dbSNP')
+        self.chrom, self.pos = zip(*coordinates)
+        self._set_rows(rows)
 
     def __repr__(self):
         return f"GeneralizedVarant(id='{self.id[-1]}')"
 
+    def _set_rows(self, rows):
+        _, _, self.id, self.ref, self.alt, _, _, self.info = zip(*rows)
+
+    @classmethod
+    def from_rows(cls, chrom, pos, rows):
+        """Construct a variant from VCF rows that have already been fetched
+
+        Parameters
+        ----------
+        chrom
+            iterable of reference sequences including the variant
+        pos
+            iterable of positions of the variant on each reference sequence
+        rows
+            iterable of split rows from the dbSNP VCF
+
+        Returns
+        -------
+        GeneralizedVariant
+            a variant with the same attributes as one constructed directly
+        """
+
+        variant = cls.__new__(cls)
+        variant.chrom = tuple(chrom)
+        variant.pos = tuple(pos)
+        variant._set_rows(rows)
+        return variant
+
 
 class Variant(GeneralizedVariant):
     """Information about a variant. Input parameters should be either `chrom`
@@ -326,15 +382,18 @@ class Variant(GeneralizedVariant):
             id=id,
             reference_build=reference_build
         )
+    
+    def __repr__(self):
+            return f"Varant(id='{self.id}')"
+
+    def _set_rows(self, rows):
+        super()._set_rows(rows)
         self.chrom = self.chrom[-1]
         self.pos = self.pos[-1]
         self.id = self.id[-1]
         self.ref = self.ref[-1]
         self.alt = self.alt[-1]
         self.info = self.info[-1]
-    
-    def __repr__(self):
-            return f"Varant(id='{self.id}')"
 
 
 
@@ -350,13 +409,520 @@ def chrom_to_hgvs(chrom, reference_build='GRCh38'):
         raise RuntimeError('invalid chromosome name')
 
 
+def hgvs_to_chrom(hgvs, reference_build='GRCh38', style='chr'):
+    """Convert an HGVS sequence name to a chromosome name
+
+    Parameters
+    ----------
+    hgvs : str
+        HGVS sequence name, e.g. NC_000008.11
+    reference_build : str
+        reference build for coordinates
+    style : str
+        'chr' for names like chr8, 'bare' for names like 8, or 'hgvs' to
+        keep the HGVS name
+
+    Returns
+    -------
+    str
+        the chromosome name, or the HGVS name if it has no chromosome name
+    """
+
+    if style == 'hgvs' or hgvs not in HGVS_TO_CHROM[reference_build]:
+        return hgvs
+    chrom = HGVS_TO_CHROM[reference_build][hgvs]
+    return chrom if style == 'chr' else chrom[3:]
+
+
+def chrom_style(chrom):
+    """Naming style of a chromosome name, for use with hgvs_to_chrom"""
+
+    if HGVS_REGEX.match(chrom):
+        return 'hgvs'
+    return 'chr' if chrom.startswith('chr') else 'bare'
+
+
+def rsid_to_coordinates(rsid, reference_build='GRCh38'):
+    """Map an rsid to coordinates with the lookup backend
+
+    Parameters
+    ----------
+    rsid : str
+        rsid of the variant
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    list
+        (chrom, pos) tuples, empty if the rsid is not in the index
+    """
+
+    return get_backend(reference_build).by_rsid(int(rsid.replace('rs', '')))
+
+
+def rsids_to_coordinates(rs_numbers, reference_build='GRCh38'):
+    """Map many rs numbers to coordinates with the lookup backend, which for
+    tabix means direct lookups in the rsid array if it has been built or one
+    sorted pass over the rsid index otherwise
+
+    Parameters
+    ----------
+    rs_numbers
+        iterable of rs numbers (integers)
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    dict
+        maps each rs number found in the index to a list of (chrom, pos)
+    """
+
+    return get_backend(reference_build).by_rsids(rs_numbers)
+
+
+def coordinates_to_rows(coordinates, reference_build='GRCh38'):
+    """Fetch the VCF rows at many coordinates with the lookup backend, which
+    for tabix means one sorted pass per chromosome over the dbSNP VCF
+
+    Parameters
+    ----------
+    coordinates
+        iterable of (HGVS chrom, pos) tuples
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    dict
+        maps each (chrom, pos) with at least one overlapping record to a list
+        of split VCF rows, in file order
+    """
+
+    return get_backend(reference_build).by_positions(coordinates)
+
+
+def parse_query(variant, reference_build='GRCh38'):
+    """Parse an rsid or chr:pos query
+
+    Parameters
+    ----------
+    variant : str
+        rsid or chr:pos string
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    int or tuple
+        the rs number of an rsid, or the (HGVS chrom, pos) of a coordinate
+    """
+
+    if COORD_REGEX.match(variant):
+        chrom, pos = variant.rsplit(':', 1)
+        return chrom_to_hgvs(chrom, reference_build=reference_build), int(pos)
+    elif RSID_REGEX.match(variant):
+        return int(variant.replace('rs', ''))
+    raise RuntimeError('Improperly formatted query')
+
+
+def parse_region(variant):
+    """Parse a chr:start-end region query
+
+    Parameters
+    ----------
+    variant : str
+        chr:start-end string, with 1-based inclusive coordinates
+
+    Returns
+    -------
+    tuple
+        (chrom, start, end) in BED coordinates
+    """
+
+    chrom, region = variant.rsplit(':', 1)
+    start, end = (int(x) for x in region.split('-'))
+    return chrom, start - 1, end
+
+
+def lookup_region(variant, reference_build='GRCh38', info_filter=None):
+    """Fetch the dbSNP VCF rows overlapping a chr:start-end region
+
+    Parameters
+    ----------
+    variant : str
+        chr:start-end string
+    reference_build : str
+        reference build for coordinates
+    info_filter : dict
+        if given, only rows whose INFO has these key/value pairs are returned
+
+    Returns
+    -------
+    tuple
+        a (coordinates, rows) tuple as for lookup_rows
+    """
+
+    from pydbsnp.regions import fetch_region_rows
+    rows = [
+        row.split('\t')
+        for row in fetch_region_rows(
+            (parse_region(variant),),
+            reference_build=reference_build,
+            info_filter=info_filter
+        )
+    ]
+    return [(row[0], int(row[1])) for row in rows], rows
+
+
+def iter_queries(lines, reference_build='GRCh38', on_error=None, regions=False):
+    """Yield the well-formed queries among lines of input
+
+    The first whitespace-separated field of each line is the query, so a
+    column of rsids can be read from a wider file. Blank lines and lines
+    starting with '#' are ignored.
+
+    Parameters
+    ----------
+    lines
+        iterable of rsids and chr:pos strings, e.g. an open file
+    reference_build : str
+        reference build for coordinates
+    on_error
+        callable receiving (line number, line, error message) for each
+        malformed query, which is then skipped. If None, a malformed query
+        raises RuntimeError
+    regions : bool
+        accept chr:start-end regions as well
+
+    Yields
+    ------
+    str
+        each well-formed query
+    """
+
+    for line_number, line in enumerate(lines, start=1):
+        fields = line.split(None, 1)
+        if not fields or fields[0].startswith('#'):
+            continue
+        variant = fields[0]
+        try:
+            if not (regions and REGION_REGEX.match(variant)):
+                parse_query(variant, reference_build=reference_build)
+        except RuntimeError as e:
+            if on_error is None:
+                raise RuntimeError(f'{variant}: {e}')
+            on_error(line_number, line.rstrip('\n'), str(e))
+            continue
+        yield variant
+
+
+def shard(sorted_values, workers, min_size=MIN_SHARD_SIZE):
+    """Split sorted values into contiguous runs, one per worker unless that
+    would make the runs shorter than min_size
+    """
+
+    size = max(-(-len(sorted_values) // workers), min_size)
+    return [
+        sorted_values[start:start + size]
+        for start in range(0, len(sorted_values), size)
+    ]
+
+
+def fetch_shard(shard, reference_build='GRCh38'):
+    """Resolve one shard of a parallel lookup in a worker process
+
+    Parameters
+    ----------
+    shard : tuple
+        ('rsid', sorted rs numbers) or ('pos', sorted (chrom, pos) tuples on
+        one contig)
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    dict
+        the result of rsids_to_coordinates or coordinates_to_rows
+    """
+
+    kind, values = shard
+    if kind == 'rsid':
+        return rsids_to_coordinates(values, reference_build=reference_build)
+    return coordinates_to_rows(values, reference_build=reference_build)
+
+
+def resolve_queries(queries, reference_build='GRCh38', pool=None, workers=1):
+    """Look up parsed queries in the dbSNP data, optionally sharded across a
+    pool of worker processes. Positions are sharded by contig and then into
+    contiguous runs, so each worker makes sorted passes with its own handles.
+
+    Parameters
+    ----------
+    queries
+        collection of distinct queries as returned by parse_query, with rs
+        numbers wrapped in 1-tuples
+    reference_build : str
+        reference build for coordinates
+    pool : multiprocessing.Pool
+        worker pool, or None to look up in this process
+    workers : int
+        number of workers in the pool
+
+    Returns
+    -------
+    dict
+        maps each query to a (coordinates, rows) tuple
+    """
+
+    rs_numbers = sorted(q[0] for q in queries if len(q) == 1)
+    fetch = partial(fetch_shard, reference_build=reference_build)
+    # direct rsid lookups are cheaper than shipping them out
+    if pool is None or get_backend(reference_build).direct_rsid_lookups:
+        rsid_coordinates = rsids_to_coordinates(
+            rs_numbers,
+            reference_build=reference_build
+        )
+    else:
+        rsid_coordinates = {}
+        for part in pool.imap_unordered(
+            fetch,
+            (('rsid', s) for s in shard(rs_numbers, workers))
+        ):
+            rsid_coordinates.update(part)
+    query_coordinates = {
+        q: rsid_coordinates.get(q[0], []) if len(q) == 1 else [q]
+        for q in queries
+    }
+    coordinates = {
+        c for coordinates in query_coordinates.values() for c in coordinates
+    }
+    if pool is None:
+        rows = coordinates_to_rows(
+            coordinates,
+            reference_build=reference_build
+        )
+    else:
+        by_chrom = {}
+        for c in coordinates:
+            by_chrom.setdefault(c[0], []).append(c)
+        rows = {}
+        for part in pool.imap_unordered(
+            fetch,
+            (
+                ('pos', s)
+                for chrom in sorted(by_chrom)
+                for s in shard(sorted(by_chrom[chrom]), workers)
+            )
+        ):
+            rows.update(part)
+    return {
+        q: (coordinates, [r for c in coordinates for r in rows.get(c, ())])
+        for q, coordinates in query_coordinates.items()
+    }
+
+
+def iter_lookup_rows(
+    ids_or_coords,
+    reference_build='GRCh38',
+    workers=1,
+    batch_size=LOOKUP_BATCH_SIZE
+):
+    """Stream the dbSNP VCF rows for many variants, looked up in batches
+
+    Parameters
+    ----------
+    ids_or_coords
+        iterable of rsids and chr:pos strings, which may be mixed
+    reference_build : str
+        reference build for coordinates
+    workers : int
+        number of worker processes, each with its own tabix handles
+    batch_size : int
+        number of queries looked up together, which bounds memory use. None
+        looks up all queries in one batch
+
+    Yields
+    ------
+    tuple
+        a (coordinates, rows) tuple for each query in input order, as for
+        lookup_rows
+
+    Examples
+    --------
+    with open('rsids.txt') as f:
+        for coordinates, rows in iter_lookup_rows(
+            (line.strip() for line in f), workers=8
+        ):
+            for row in rows:
+                print('\t'.join(row))
+    """
+
+    build = CANONICAL_BUILD[reference_build]
+    cache = get_cache()
+    metrics = get_metrics()
+    ids_or_coords = iter(ids_or_coords)
+    if workers > 1:
+        from multiprocessing import Pool
+        pool = Pool(processes=workers)
+    else:
+        pool = None
+    try:
+        while True:
+            queries = [
+                parse_query(variant, reference_build=reference_build)
+                for variant in islice(ids_or_coords, batch_size)
+            ]
+            if not queries:
+                break
+            keys = [
+                (build, q) if isinstance(q, int) else (build,) + q
+                for q in queries
+            ]
+            results = {}
+            for key in keys:
+                if key not in results:
+                    results[key] = cache.get(key)
+            uncached = [
+                key[1:] for key, result in results.items() if result is None
+            ]
+            metrics.count('query.lookups', len(keys))
+            metrics.count('query.uncached', len(uncached))
+            for q, result in resolve_queries(
+                uncached,
+                reference_build=reference_build,
+                pool=pool,
+                workers=workers
+            ).items():
+                cache.put((build,) + q, result)
+                results[(build,) + q] = result
+            for key in keys:
+                yield results[key]
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def lookup_rows(ids_or_coords, reference_build='GRCh38', workers=1):
+    """Fetch the dbSNP VCF rows for many variants at once
+
+    Parameters
+    ----------
+    ids_or_coords
+        iterable of rsids and chr:pos strings, which may be mixed
+    reference_build : str
+        reference build for coordinates
+    workers : int
+        number of worker processes, each with its own tabix handles
+
+    Returns
+    -------
+    list
+        a (coordinates, rows) tuple for each query in input order, where
+        coordinates is a list of (chrom, pos) tuples and rows is a list of
+        split VCF rows, both empty if the query was not found
+    """
+
+    return list(
+        iter_lookup_rows(
+            ids_or_coords,
+            reference_build=reference_build,
+            workers=workers,
+            batch_size=None
+        )
+    )
+
+
+def lookup_many(ids_or_coords, reference_build='GRCh38', workers=1):
+    """Look up many variants at once
+
+    Parameters
+    ----------
+    ids_or_coords
+        iterable of rsids and chr:pos strings, which may be mixed
+    reference_build : str
+        reference build for coordinates
+    workers : int
+        number of worker processes, each with its own tabix handles
+
+    Returns
+    -------
+    list
+        a GeneralizedVariant for each query in input order, or NOT_FOUND if
+        dbSNP has no record for it
+
+    Examples
+    --------
+    lookup_many(['rs231361', 'chr8:118184783', 'rs7903146'])
+    lookup_many(rsids, workers=8)
+    """
+
+    results = []
+    for coordinates, rows in lookup_rows(
+        ids_or_coords,
+        reference_build=reference_build,
+        workers=workers
+    ):
+        if rows:
+            chrom, pos = zip(*coordinates)
+            results.append(GeneralizedVariant.from_rows(chrom, pos, rows))
+        else:
+            results.append(NOT_FOUND)
+    return results
+
+
+def lookup_records(ids_or_coords, reference_build='GRCh38', workers=1):
+    """Look up many variants at once as compact records
+
+    Parameters
+    ----------
+    ids_or_coords
+        iterable of rsids and chr:pos strings, which may be mixed
+    reference_build : str
+        reference build for coordinates
+    workers : int
+        number of worker processes, each with its own tabix handles
+
+    Returns
+    -------
+    list
+        a tuple of Record objects for each query in input order, empty if
+        dbSNP has no record for it
+
+    Examples
+    --------
+    for records in lookup_records(['rs231361', 'chr8:118184783']):
+        for record in records:
+            print(record.id, record.variant_class, record.freq)
+    """
+
+    return [
+        tuple(Record.from_row(row) for row in rows)
+        for _, rows in lookup_rows(
+            ids_or_coords,
+            reference_build=reference_build,
+            workers=workers
+        )
+    ]
+
+
 def parse_arguments():
     parser = ArgumentParser(description='query dbSNP VCF data')
     parser.add_argument(
         'variants',
-        nargs='+',
-        metavar='<rsid or chr:pos>',
-        help='variant for which to query database'
+        nargs='*',
+        metavar='<rsid, chr:pos or chr:start-end>',
+        help='variant or region for which to query database'
+    )
+    parser.add_argument(
+        '-i',
+        '--input',
+        metavar='<file|->',
+        help=(
+            'read rsid, chr:pos and chr:start-end queries from a file (or - '
+            'for stdin), one per line, streaming them in batches'
+        )
     )
     parser.add_argument(
         '-r',
@@ -365,32 +931,312 @@ def parse_arguments():
         default='GRCh38',
         help='reference build for coordinates'
     )
-    return parser.parse_args()
+    parser.add_argument(
+        '--annotate',
+        metavar='<input.vcf.gz|tsv>',
+        help=(
+            'stream a coordinate-sorted VCF or TSV file (or - for stdin) and '
+            'annotate it with dbSNP records'
+        )
+    )
+    parser.add_argument(
+        '-g',
+        '--gene',
+        metavar='<symbol|gene ID>',
+        action='append',
+        default=[],
+        help=(
+            'report the records annotated to a gene in GENEINFO, using the '
+            'gene index built by pydbsnp-index --genes (may be repeated)'
+        )
+    )
+    parser.add_argument(
+        '--info-filter',
+        metavar='<KEY=VALUE>',
+        action='append',
+        default=[],
+        help=(
+            'only report records in chr:start-end regions whose INFO has '
+            'this key/value pair, e.g. VC=SNV (may be repeated)'
+        )
+    )
+    parser.add_argument(
+        '-f',
+        '--output-format',
+        choices=('vcf', 'tsv', 'json'),
+        default='vcf',
+        help=(
+            'vcf for dbSNP VCF rows, tsv for dbSNP VCF rows prefixed with '
+            'the query, or json for one JSON line per query (default: vcf)'
+        )
+    )
+    parser.add_argument(
+        '--no-header',
+        action='store_true',
+        help='do not print the VCF or TSV header'
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=LOOKUP_BATCH_SIZE,
+        help=(
+            'number of queries looked up together with --input, tsv or json '
+            f'output, which bounds memory use (default: {LOOKUP_BATCH_SIZE})'
+        )
+    )
+    parser.add_argument(
+        '--server',
+        action='store_true',
+        help=(
+            'forward the queries given as arguments to a running '
+            'pydbsnp-serve, which must read the same dbSNP files, and look '
+            'them up locally otherwise'
+        )
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help=(
+            'number of worker processes for rsid and chr:pos queries '
+            '(overrides --server)'
+        )
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help=(
+            'print counters and phase timings to stderr when finished '
+            '(overrides --server)'
+        )
+    )
+    args = parser.parse_args()
+    if not (args.variants or args.annotate or args.input or args.gene):
+        parser.error(
+            'at least one variant, --input, --gene or --annotate is required'
+        )
+    if args.variants and args.input:
+        parser.error('variants cannot be given together with --input')
+    return args
 
 
 def main():
     args = parse_arguments()
-    print(VariantFile(BUILD_TO_VCF[args.reference_build]).header)
-    vcf_file = TabixFile(BUILD_TO_VCF[args.reference_build])
-    rsid_file = TabixFile(
-        BUILD_TO_RSID[args.reference_build],
-        index=f'{BUILD_TO_RSID[args.reference_build]}.csi'
+    if args.profile:
+        metrics = enable_metrics()
+        try:
+            run_queries(args)
+        finally:
+            print(metrics.summary(), file=sys.stderr)
+            from pydbsnp.bgzf import get_block_cache
+            if get_block_cache().max_bytes:
+                print(
+                    'block cache: ' + ', '.join(
+                        f'{key}={value:.3g}' if isinstance(value, float)
+                        else f'{key}={value}'
+                        for key, value in get_block_cache().stats().items()
+                    ),
+                    file=sys.stderr
+                )
+    else:
+        run_queries(args)
+
+
+def run_queries(args):
+    if args.annotate:
+        from pydbsnp.annotation import annotate
+        for line in annotate(
+            args.annotate,
+            reference_build=args.reference_build
+        ):
+            print(line)
+        return
+    if args.gene:
+        write_genes(args)
+        return
+    n_skipped = 0
+    def skip(line_number, line, message):
+        nonlocal n_skipped
+        n_skipped += 1
+        print(
+            f'skipped {"line" if args.input else "query"} {line_number}: '
+            f'{line} ({message})',
+            file=sys.stderr
+        )
+    try:
+        if args.input:
+            from contextlib import nullcontext
+            from pydbsnp.annotation import open_input
+            # stdin is left open for the caller
+            with (
+                nullcontext(sys.stdin) if args.input == '-'
+                else open_input(args.input)
+            ) as f:
+                write_lookups(
+                    args,
+                    iter_queries(
+                        f,
+                        reference_build=args.reference_build,
+                        on_error=skip,
+                        regions=True
+                    )
+                )
+        else:
+            write_queries(
+                args,
+                list(
+                    iter_queries(
+                        args.variants,
+                        reference_build=args.reference_build,
+                        on_error=skip,
+                        regions=True
+                    )
+                )
+            )
+    finally:
+        if n_skipped:
+            print(f'skipped {n_skipped} malformed queries', file=sys.stderr)
+
+
+def write_header(args):
+    if args.no_header or args.output_format == 'json':
+        return
+    if args.output_format == 'tsv':
+        from pydbsnp.serve import TSV_HEADER
+        sys.stdout.write(TSV_HEADER)
+    else:
+        from pysam import VariantFile
+        print(
+            VariantFile(get_pool(args.reference_build).paths['vcf']).header
+        )
+
+
+def write_genes(args):
+    """Write the records annotated to the genes of a --gene query, once
+    each in coordinate order for VCF output, or per gene for TSV and JSON
+    """
+
+    from pydbsnp.genes import fetch_gene_rows
+    from pydbsnp.serve import format_results
+    index = get_pool(args.reference_build).genes
+    if index is None:
+        raise RuntimeError(
+            f'no gene index for {args.reference_build}; build it with '
+            'pydbsnp-index --genes'
+        )
+    for gene in args.gene:
+        if not index.gene_ids(gene):
+            print(f'gene {gene} not found in the gene index', file=sys.stderr)
+    write_header(args)
+    if args.output_format == 'vcf':
+        for row in fetch_gene_rows(
+            args.gene,
+            reference_build=args.reference_build
+        ):
+            print(row)
+        return
+    sys.stdout.writelines(
+        format_results(
+            args.gene,
+            (
+                (
+                    (),
+                    [
+                        tuple(row.split('\t'))
+                        for row in fetch_gene_rows(
+                            gene,
+                            reference_build=args.reference_build
+                        )
+                    ]
+                )
+                for gene in args.gene
+            ),
+            output_format=args.output_format
+        )
+    )
+
+
+def write_lookups(args, variants):
+    """Look up a stream of rsid and chr:pos queries in batches, and fetch
+    the rows of chr:start-end regions one at a time, writing the results in
+    input order
+    """
+
+    from pydbsnp.serve import format_results
+    variants, queries, lookups = tee(variants, 3)
+    results = iter_lookup_rows(
+        (v for v in lookups if not REGION_REGEX.match(v)),
+        reference_build=args.reference_build,
+        workers=args.jobs,
+        batch_size=args.batch_size
     )
-    def rsid_to_coordinates(rsid):
-        rs_number = int(rsid.replace('rs', ''))
-        for row in rsid_file.fetch('rs', rs_number - 1, rs_number):
-            chrom, pos = row.split()[2:]
-            yield chrom, int(pos)
-    for variant in args.variants:
+    info_filter = dict(f.split('=', 1) for f in args.info_filter)
+    write_header(args)
+    sys.stdout.writelines(
+        format_results(
+            variants,
+            (
+                lookup_region(
+                    variant,
+                    reference_build=args.reference_build,
+                    info_filter=info_filter
+                )
+                if REGION_REGEX.match(variant) else next(results)
+                for variant in queries
+            ),
+            output_format=args.output_format
+        )
+    )
+
+
+def write_queries(args, variants):
+    has_regions = any(REGION_REGEX.match(v) for v in variants)
+    if args.server and not (args.profile or args.jobs > 1 or has_regions):
+        from pydbsnp.serve import query_server
+        # a request the server rejects fails before any output, so reading
+        # the first line decides whether to fall back to local lookups
+        try:
+            lines = query_server(
+                variants,
+                reference_build=args.reference_build,
+                output_format=args.output_format,
+                header=not args.no_header and args.output_format != 'json'
+            )
+            first = next(lines, None)
+        except (OSError, RuntimeError) as e:
+            print(
+                f'pydbsnp-serve not used ({e}), looking up queries locally',
+                file=sys.stderr
+            )
+            lines = None
+        if lines is not None:
+            if first is not None:
+                print(first)
+            for line in lines:
+                print(line)
+            return
+    if args.output_format != 'vcf' or (args.jobs > 1 and not has_regions):
+        write_lookups(args, variants)
+        return
+    write_header(args)
+    backend = get_backend(args.reference_build)
+    for variant in variants:
         if COORD_REGEX.match(variant):
             chrom, pos = variant.split(':')
             chrom = chrom_to_hgvs(chrom, reference_build=args.reference_build)
             pos = int(pos)
-            for row in vcf_file.fetch(chrom, pos - 1, pos):
+            for row in backend.by_region(chrom, pos - 1, pos):
                 print(row)
         elif RSID_REGEX.match(variant):
-            for chrom, pos in rsid_to_coordinates(variant):
-                for row in vcf_file.fetch(chrom, pos - 1, pos):
+            for chrom, pos in backend.by_rsid(int(variant.replace('rs', ''))):
+                for row in backend.by_region(chrom, pos - 1, pos):
                     print(row)
         else:
-            raise RuntimeError('Improperly formatted query')
+            from pydbsnp.regions import fetch_region_rows
+            for row in fetch_region_rows(
+                (parse_region(variant),),
+                reference_build=args.reference_build,
+                info_filter=dict(f.split('=', 1) for f in args.info_filter)
+            ):
+                print(row)
@@ -0,0 +1,206 @@
+#===============================================================================
+# record.py
+#===============================================================================
+
+"""Compact dbSNP records with lazily parsed INFO fields"""
+
+
+
+
+# Imports ======================================================================
+
+import sys
+
+from array import array
+
+
+
+
+# Constants ====================================================================
+
+MISSING_FREQUENCY = float('nan')
+
+
+
+
+# Classes ======================================================================
+
+class Record():
+    """A single dbSNP VCF record. Only the raw INFO string is stored, and INFO
+    keys are parsed when they are requested.
+
+    Parameters
+    ----------
+    chrom : str
+        chromosome identifier, interned so records share one string
+    pos : int
+        position of the variant
+    id : str
+        rsid of the variant
+    ref : str
+        reference allele
+    alt : str
+        comma-separated alternate alleles
+    info : str
+        info column from the dbSNP vcf
+
+    Examples
+    --------
+    record = Record.from_row(row.split())
+    record.get('VC')
+    record.freq['GnomAD']
+    """
+
+    __slots__ = ('chrom', 'pos', 'id', 'ref', 'alt', 'info')
+
+    def __init__(self, chrom, pos, id, ref, alt, info):
+        self.chrom = sys.intern(chrom)
+        self.pos = int(pos)
+        self.id = id
+        self.ref = ref
+        self.alt = alt
+        self.info = info
+
+    def __repr__(self):
+        return f"Record(id='{self.id}')"
+
+    def __eq__(self, other):
+        if not isinstance(other, Record):
+            return NotImplemented
+        return all(
+            getattr(self, slot) == getattr(other, slot)
+            for slot in self.__slots__
+        )
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, slot) for slot in self.__slots__))
+
+    @classmethod
+    def from_row(cls, row):
+        """Construct a record from a split dbSNP VCF row"""
+
+        chrom, pos, id, ref, alt, _, _, info = row[:8]
+        return cls(chrom, pos, id, ref, alt, info)
+
+    def get(self, key, default=None):
+        """Value of one INFO key, parsed on demand
+
+        Parameters
+        ----------
+        key : str
+            INFO key such as 'VC' or 'GENEINFO'
+        default
+            value returned if the key is absent
+
+        Returns
+        -------
+        str
+            the raw value, True for a flag, or `default`
+        """
+
+        return info_value(self.info, key, default=default)
+
+    @property
+    def alts(self):
+        return tuple(self.alt.split(','))
+
+    @property
+    def rs(self):
+        return int(self.id.replace('rs', ''))
+
+    @property
+    def variant_class(self):
+        return self.get('VC')
+
+    @property
+    def geneinfo(self):
+        return parse_geneinfo(self.get('GENEINFO'))
+
+    @property
+    def freq(self):
+        return parse_freq(self.get('FREQ'))
+
+
+
+
+# Functions ====================================================================
+
+def info_value(info, key, default=None):
+    """Extract the value of one key from an INFO string without splitting the
+    whole string
+
+    Parameters
+    ----------
+    info : str
+        INFO column of a VCF record
+    key : str
+        INFO key
+    default
+        value returned if the key is absent
+
+    Returns
+    -------
+    str
+        the raw value, True for a flag, or `default`
+    """
+
+    text = f';{info};'
+    start = text.find(f';{key}=')
+    if start == -1:
+        return True if f';{key};' in text else default
+    start += len(key) + 2
+    return text[start:text.find(';', start)]
+
+
+def parse_freq(value):
+    """Parse a dbSNP FREQ value such as '1000Genomes:0.9,0.1|GnomAD:0.8,0.2'
+
+    Parameters
+    ----------
+    value : str
+        raw FREQ value, or None
+
+    Returns
+    -------
+    dict
+        maps each population study to an array of allele frequencies in
+        REF, ALT order, with NaN for missing values
+    """
+
+    if not value:
+        return {}
+    freq = {}
+    for study in value.split('|'):
+        name, _, frequencies = study.partition(':')
+        freq[name] = array(
+            'd',
+            (
+                MISSING_FREQUENCY if f == '.' else float(f)
+                for f in frequencies.split(',')
+            )
+        )
+    return freq
+
+
+def parse_geneinfo(value):
+    """Parse a dbSNP GENEINFO value such as 'CDKAL1:54901|SOX4:6659'
+
+    Parameters
+    ----------
+    value : str
+        raw GENEINFO value, or None
+
+    Returns
+    -------
+    list
+        (gene symbol, gene ID) tuples
+    """
+
+    if not value:
+        return []
+    return [
+        (symbol, int(gene_id))
+        for symbol, _, gene_id in (
+            gene.partition(':') for gene in value.split('|')
+        )
+    ]
@@ -0,0 +1,179 @@
+#===============================================================================
+# regions.py
+#===============================================================================
+
+"""Stream dbSNP records under sets of genomic intervals"""
+
+
+
+
+# Imports ======================================================================
+
+import sys
+
+from pydbsnp.annotation import open_input
+from pydbsnp.backends import get_backend
+from pydbsnp.query import chrom_to_hgvs
+from pydbsnp.record import Record, info_value
+
+
+
+
+# Constants ====================================================================
+
+BED_HEADER_PREFIXES = ('#', 'track', 'browser')
+
+
+
+
+# Functions ====================================================================
+
+def read_bed(bed_path):
+    """Read intervals from a plain or gzipped BED file
+
+    Parameters
+    ----------
+    bed_path : str
+        path to a BED file, or '-' for standard input
+
+    Yields
+    ------
+    tuple
+        (chrom, start, end) in BED coordinates
+    """
+
+    f = open_input(bed_path)
+    try:
+        for line in f:
+            if not line.strip() or line.startswith(BED_HEADER_PREFIXES):
+                continue
+            chrom, start, end = line.split()[:3]
+            yield chrom, int(start), int(end)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def merge_intervals(intervals, reference_build='GRCh38'):
+    """Merge overlapping and adjacent intervals
+
+    Parameters
+    ----------
+    intervals
+        iterable of (chrom, start, end) in BED coordinates
+    reference_build : str
+        reference build for coordinates
+
+    Returns
+    -------
+    list
+        merged (HGVS chrom, start, end) intervals, sorted by chromosome and
+        start
+    """
+
+    by_chrom = {}
+    for chrom, start, end in intervals:
+        by_chrom.setdefault(
+            chrom_to_hgvs(chrom, reference_build=reference_build), []
+        ).append((int(start), int(end)))
+    merged = []
+    for chrom in sorted(by_chrom):
+        current_start, current_end = None, None
+        for start, end in sorted(by_chrom[chrom]):
+            if current_end is not None and start <= current_end:
+                current_end = max(current_end, end)
+            else:
+                if current_end is not None:
+                    merged.append((chrom, current_start, current_end))
+                current_start, current_end = start, end
+        merged.append((chrom, current_start, current_end))
+    return merged
+
+
+def fetch_region_rows(
+    bed_path_or_intervals,
+    reference_build='GRCh38',
+    info_filter=None
+):
+    """Stream the raw dbSNP VCF rows overlapping a set of intervals
+
+    Parameters
+    ----------
+    bed_path_or_intervals
+        path to a BED file, or an iterable of (chrom, start, end) in BED
+        coordinates
+    reference_build : str
+        reference build for coordinates
+    info_filter : dict
+        if given, only rows whose INFO has these key/value pairs are yielded
+
+    Yields
+    ------
+    str
+        VCF rows, each at most once, in coordinate order
+    """
+
+    if isinstance(bed_path_or_intervals, str):
+        bed_path_or_intervals = read_bed(bed_path_or_intervals)
+    backend = get_backend(reference_build)
+    contigs = set(backend.contigs)
+    info_filter = tuple((info_filter or {}).items())
+    previous_chrom, previous_end = None, 0
+    for chrom, start, end in merge_intervals(
+        bed_path_or_intervals,
+        reference_build=reference_build
+    ):
+        if chrom not in contigs:
+            continue
+        if chrom != previous_chrom:
+            previous_chrom, previous_end = chrom, 0
+        for row in backend.by_region(chrom, start, end):
+            fields = row.split('\t', 8)
+            # a long record overlapping the previous interval was yielded
+            # already
+            if int(fields[1]) - 1 < previous_end:
+                continue
+            if all(
+                info_value(fields[7], key) == value
+                for key, value in info_filter
+            ):
+                yield row
+        previous_end = end
+
+
+def fetch_regions(
+    bed_path_or_intervals,
+    reference_build='GRCh38',
+    info_filter=None
+):
+    """Stream the dbSNP records overlapping a set of intervals. Overlapping
+    and adjacent intervals are merged before fetching.
+
+    Parameters
+    ----------
+    bed_path_or_intervals
+        path to a BED file, or an iterable of (chrom, start, end) in BED
+        coordinates
+    reference_build : str
+        reference build for coordinates
+    info_filter : dict
+        if given, only records whose INFO has these key/value pairs are
+        yielded, e.g. {'VC': 'SNV'}
+
+    Yields
+    ------
+    Record
+        dbSNP records in coordinate order
+
+    Examples
+    --------
+    for record in fetch_regions('peaks.bed', info_filter={'VC': 'SNV'}):
+        print(record.id)
+    """
+
+    for row in fetch_region_rows(
+        bed_path_or_intervals,
+        reference_build=reference_build,
+        info_filter=info_filter
+    ):
+        yield Record.from_row(row.split())
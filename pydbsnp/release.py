@@ -0,0 +1,232 @@
+#===============================================================================
+# release.py
+#===============================================================================
+
+"""Versioned releases of the dbSNP data files
+
+pydbsnp-index --update writes the files of a new release under a
+`pydbsnp-releases/<release>/` directory next to each configured path, then
+switches to it by replacing a single pointer file, `<VCF path>.release`.
+Readers resolve the pointer once and open every file of the release it names,
+so they never mix files of two releases. Without a pointer file, the
+configured paths themselves are used.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import json
+import os
+import os.path
+import shutil
+import time
+
+from pydbsnp.env import (
+    BUILD_TO_VCF, BUILD_TO_RSID, BUILD_TO_RSIDX, BUILD_TO_PRESENCE,
+    BUILD_TO_POSITIONS, BUILD_TO_GENES, BUILD_TO_SQLITE
+)
+
+
+
+
+# Constants ====================================================================
+
+RELEASE_SUFFIX = '.release'
+RELEASE_DIR = 'pydbsnp-releases'
+
+# The manifest of per-contig checksums is kept next to the rsid index
+MANIFEST_SUFFIX = '.manifest.json'
+
+# Files kept next to a data file, which belong to the same release
+COMPANION_SUFFIXES = ('', '.tbi', '.csi', MANIFEST_SUFFIX)
+COPY_CHUNK_BYTES = 1 << 20
+
+BUILD_TO_PATHS = {
+    'vcf': BUILD_TO_VCF,
+    'rsid': BUILD_TO_RSID,
+    'rsidx': BUILD_TO_RSIDX,
+    'presence': BUILD_TO_PRESENCE,
+    'positions': BUILD_TO_POSITIONS,
+    'genes': BUILD_TO_GENES,
+    'sqlite': BUILD_TO_SQLITE
+}
+
+
+
+
+# Functions ====================================================================
+
+def release_path(path, release=None):
+    """Path of a data file in a release
+
+    Parameters
+    ----------
+    path : str
+        configured path of the data file
+    release : str
+        release name, or None for the configured path itself
+
+    Returns
+    -------
+    str
+        path of the file in the release
+    """
+
+    if release is None:
+        return path
+    return os.path.join(
+        os.path.dirname(path), RELEASE_DIR, release, os.path.basename(path)
+    )
+
+
+def read_release(vcf_path):
+    """Read the release pointer of a VCF
+
+    Parameters
+    ----------
+    vcf_path : str
+        configured path of the dbSNP VCF
+
+    Returns
+    -------
+    dict
+        'release' names the current release and 'previous' the one it
+        replaced, empty if there is no pointer file
+    """
+
+    try:
+        with open(f'{vcf_path}{RELEASE_SUFFIX}') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def current_release(vcf_path):
+    """Name of the current release of a VCF, or None for the configured
+    paths"""
+
+    return read_release(vcf_path).get('release')
+
+
+def write_release(vcf_path, release, previous=None):
+    """Switch readers to a release by replacing the pointer file of a VCF
+
+    Parameters
+    ----------
+    vcf_path : str
+        configured path of the dbSNP VCF
+    release : str
+        name of the new current release
+    previous : str
+        name of the release it replaces, None for the configured paths
+    """
+
+    pointer_path = f'{vcf_path}{RELEASE_SUFFIX}'
+    with open(f'{pointer_path}.tmp', 'w') as f:
+        json.dump({'release': release, 'previous': previous}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f'{pointer_path}.tmp', pointer_path)
+
+
+def resolve_paths(reference_build):
+    """Paths of the data files of the current release of a build, read from
+    one pointer so that they all belong to the same release
+
+    Parameters
+    ----------
+    reference_build : str
+        canonical reference build, 'GRCh37' or 'GRCh38'
+
+    Returns
+    -------
+    tuple
+        the release name, or None, and a dict mapping 'vcf', 'rsid',
+        'rsidx', 'presence', 'positions', 'genes' and 'sqlite' to paths
+    """
+
+    release = current_release(BUILD_TO_VCF[reference_build])
+    return release, {
+        name: release_path(paths[reference_build], release)
+        for name, paths in BUILD_TO_PATHS.items()
+    }
+
+
+def release_name(vcf_path):
+    """Name of the release in a downloaded VCF, from its modification time,
+    so that an interrupted update resumes with the same name"""
+
+    return time.strftime(
+        '%Y%m%dT%H%M%S', time.gmtime(os.stat(vcf_path).st_mtime)
+    )
+
+
+def link_file(source, destination):
+    """Link a file into a release, replacing any file left there, and copying
+    it where hard links are not supported"""
+
+    if os.path.isfile(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def copy_section(source_path, f, offset, size):
+    """Copy a section of a file of the previous release to the end of a file
+    being built for the new one, a chunk at a time
+
+    Parameters
+    ----------
+    source_path : str
+        path to the file of the previous release
+    f
+        binary file being written
+    offset : int
+        offset of the section in bytes
+    size : int
+        size of the section in bytes
+    """
+
+    with open(source_path, 'rb') as source:
+        source.seek(offset)
+        while size > 0:
+            chunk = source.read(min(size, COPY_CHUNK_BYTES))
+            if not chunk:
+                raise RuntimeError(f'{source_path} is truncated')
+            f.write(chunk)
+            size -= len(chunk)
+
+
+def remove_releases(paths, keep):
+    """Remove the files of every release of some data files except those
+    kept, leaving the files of other data in the same directories
+
+    Parameters
+    ----------
+    paths
+        configured paths of the data files
+    keep
+        names of the releases to keep, None standing for the configured paths
+    """
+
+    for path in paths:
+        release_dir = os.path.join(os.path.dirname(path), RELEASE_DIR)
+        releases = (
+            os.listdir(release_dir) if os.path.isdir(release_dir) else []
+        )
+        for release in (None, *releases):
+            if release in keep:
+                continue
+            for suffix in COMPANION_SUFFIXES:
+                if os.path.isfile(f'{release_path(path, release)}{suffix}'):
+                    os.remove(f'{release_path(path, release)}{suffix}')
+            # the directory may still hold files of the other build
+            if release is not None:
+                try:
+                    os.rmdir(os.path.join(release_dir, release))
+                except OSError:
+                    pass
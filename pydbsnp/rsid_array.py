@@ -0,0 +1,203 @@
+#===============================================================================
+# rsid_array.py
+#===============================================================================
+
+"""Dense memory-mapped rsid to coordinate array
+
+The file starts with a fixed header, followed by one fixed-width record of
+(chrom code, pos) per rs number, so the record for an rsid is found by
+pointer arithmetic. Chrom code 0 marks an absent rsid. Rsids that map to
+several locations have chrom code MULTI and a pos giving the index of a
+(0, count) entry in the overflow table, which is followed by `count`
+(chrom code, pos) entries. The table of contig names comes last.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import gzip
+import mmap
+import os
+import struct
+
+from itertools import groupby
+from operator import itemgetter
+
+
+
+
+# Constants ====================================================================
+
+MAGIC = b'PYDBSNPA'
+HEADER = struct.Struct('<8sQQQ')
+RECORD = struct.Struct('<HI')
+MULTI = 0xFFFF
+EMPTY_RECORD = RECORD.pack(0, 0)
+
+
+
+
+# Classes ======================================================================
+
+class RsidArray():
+    """Read-only memory-mapped view of an rsid array file. The mapping is
+    shared through the OS page cache, including between forked processes.
+
+    Parameters
+    ----------
+    path : str
+        path to the rsid array file
+
+    Attributes
+    ----------
+    path : str
+        path to the rsid array file
+    n_records : int
+        number of records, one greater than the largest rs number
+    contigs : tuple
+        contig names indexed by chrom code
+
+    Examples
+    --------
+    with RsidArray('GCF_000001405.39.rsidx') as array:
+        array.lookup(231361)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic, self.n_records, self._overflow_offset, contigs_offset
+        ) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise RuntimeError(f'{path} is not an rsid array file')
+        self.contigs = (None,) + tuple(
+            self._mmap[contigs_offset:].decode().split('\n')
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return f"RsidArray('{self.path}')"
+
+    def lookup(self, rs_number):
+        """Coordinates of an rs number
+
+        Parameters
+        ----------
+        rs_number : int
+            rs number to look up
+
+        Returns
+        -------
+        list
+            (chrom, pos) tuples, empty if the rs number is absent
+        """
+
+        if not 0 <= rs_number < self.n_records:
+            return []
+        code, pos = RECORD.unpack_from(
+            self._mmap, HEADER.size + rs_number * RECORD.size
+        )
+        if code == 0:
+            return []
+        if code == MULTI:
+            offset = self._overflow_offset + pos * RECORD.size
+            _, count = RECORD.unpack_from(self._mmap, offset)
+            offset += RECORD.size
+            return [
+                (self.contigs[c], p)
+                for c, p in RECORD.iter_unpack(
+                    self._mmap[offset:offset + count * RECORD.size]
+                )
+            ]
+        return [(self.contigs[code], pos)]
+
+    def close(self):
+        self._mmap.close()
+
+
+
+
+# Functions ====================================================================
+
+def write_rsid_array(rows, output_path):
+    """Write an rsid array file
+
+    The file is written to a temporary path and moved into place when
+    complete, so an existing array stays readable until it is replaced.
+
+    Parameters
+    ----------
+    rows
+        iterable of (rs number, chrom, pos) tuples sorted by rs number
+    output_path : str
+        path for the rsid array file
+    """
+
+    contig_codes = {}
+    def contig_code(chrom):
+        return contig_codes.setdefault(chrom, len(contig_codes) + 1)
+    overflow = []
+    n_records = 0
+    temp_path = f'{output_path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 0, 0, 0))
+        for rs_number, group in groupby(rows, key=itemgetter(0)):
+            rs_number = int(rs_number)
+            if rs_number < n_records:
+                raise RuntimeError('rows are not sorted by rs number')
+            group = [
+                (contig_code(chrom), int(pos)) for _, chrom, pos in group
+            ]
+            if len(group) == 1:
+                record = RECORD.pack(*group[0])
+            else:
+                record = RECORD.pack(MULTI, len(overflow))
+                overflow.append((0, len(group)))
+                overflow.extend(group)
+            f.write(EMPTY_RECORD * (rs_number - n_records))
+            f.write(record)
+            n_records = rs_number + 1
+        if len(contig_codes) >= MULTI:
+            raise RuntimeError('too many contigs for an rsid array')
+        overflow_offset = f.tell()
+        f.write(b''.join(RECORD.pack(*entry) for entry in overflow))
+        contigs_offset = f.tell()
+        f.write(
+            '\n'.join(sorted(contig_codes, key=contig_codes.get)).encode()
+        )
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, n_records, overflow_offset, contigs_offset))
+    os.replace(temp_path, output_path)
+
+
+def build_rsid_array(rsid_path, output_path, quiet=False):
+    """Build an rsid array file from a bgzipped rsid index
+
+    Parameters
+    ----------
+    rsid_path : str
+        path to the rsid index produced by index.parallel_reformat_sort
+    output_path : str
+        path for the rsid array file
+    quiet : bool
+        suppress printed status updates
+    """
+
+    if not quiet:
+        print(f'Building rsid array {output_path} from {rsid_path}.')
+    with gzip.open(rsid_path, 'rt') as f:
+        write_rsid_array(
+            (row.split()[1:] for row in f),
+            output_path
+        )
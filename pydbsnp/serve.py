@@ -0,0 +1,345 @@
+#===============================================================================
+# serve.py
+#===============================================================================
+
+"""Persistent query server with warm handles, and a thin client for it
+
+The protocol is line based. A client sends one JSON line such as
+{"variants": ["rs231361", "chr8:118184783"], "reference_build": "GRCh38",
+"format": "vcf", "header": false, "paths": {"vcf": ..., ...}} and the server
+streams back VCF rows or JSON lines, then closes the connection. The paths are
+the data files the client would read itself, and the server refuses a request
+whose paths differ from its own, so that forwarding never changes the
+results. If a request fails, the last line is '#ERROR' followed by a tab and
+the error message.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import json
+import os
+import os.path
+import socket
+
+from argparse import ArgumentParser
+from functools import partial
+
+from pydbsnp.backends import get_backend
+from pydbsnp.cache import get_cache
+from pydbsnp.env import BUILD_TO_VCF, SOCKET
+from pydbsnp.handles import CANONICAL_BUILD, get_pool
+from pydbsnp.query import lookup_rows
+from pydbsnp.release import current_release
+
+
+
+
+# Constants ====================================================================
+
+BATCH_SIZE = 10_000
+FIELDS = ('chrom', 'pos', 'id', 'ref', 'alt', 'qual', 'filter', 'info')
+OUTPUT_FORMATS = ('vcf', 'tsv', 'json')
+TSV_HEADER = '\t'.join(('#QUERY', 'CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL',
+                        'FILTER', 'INFO')) + '\n'
+ERROR_PREFIX = '#ERROR\t'
+# A request is one JSON line, so the stream limit bounds the batch size,
+# tens of millions of rsids here against about 5000 with the 64 KiB default
+MAX_REQUEST_BYTES = 1 << 30
+
+
+
+
+# Classes ======================================================================
+
+class QueryServer():
+    """Long-lived query server that keeps handles and indices open
+
+    Lookups run on a single worker thread, since the shared handles must not
+    be used from two threads at once, while the event loop keeps serving
+    connections. Each request first checks the release pointer of its build,
+    and if pydbsnp-index --update has switched releases, the handles are
+    reopened on the new release and cached lookups of the old one dropped.
+
+    Parameters
+    ----------
+    socket_path : str
+        path of the Unix socket to listen on
+    port : int
+        if given, listen on this localhost TCP port instead
+
+    Examples
+    --------
+    QueryServer('/tmp/pydbsnp.sock').run()
+    """
+
+    def __init__(self, socket_path=SOCKET, port=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.socket_path = socket_path
+        self.port = port
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._headers = {}
+
+    def warm(self):
+        """Open handles and parse headers for every build with data"""
+
+        for build in 'GRCh37', 'GRCh38':
+            self.load(build)
+
+    def load(self, build):
+        """Open the handles and parse the header of one build with data"""
+
+        from pysam import VariantFile
+        self._headers.pop(build, None)
+        vcf_path = get_pool(build).paths['vcf']
+        if not os.path.isfile(vcf_path):
+            return
+        get_backend(build).open()
+        header = VariantFile(vcf_path).header
+        self._headers[build] = f'{header}\n'
+
+    def refresh(self, build):
+        """Reopen the handles of a build if its release has been switched
+        since they were opened"""
+
+        pool = get_pool(build)
+        if current_release(BUILD_TO_VCF[build]) != pool.release:
+            pool.close()
+            self.load(build)
+            get_cache().purge(build, pool.release)
+
+    async def handle(self, reader, writer):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        try:
+            request = json.loads(await reader.readline())
+            build = CANONICAL_BUILD[request.get('reference_build', 'GRCh38')]
+            await loop.run_in_executor(
+                self._executor, partial(self.refresh, build)
+            )
+            if build not in self._headers:
+                raise RuntimeError(f'no dbSNP data for {build}')
+            if request.get('paths') != absolute_paths(build):
+                raise RuntimeError(
+                    'the server reads different dbSNP files or a different '
+                    'release'
+                )
+            output_format = request.get('format', 'vcf')
+            if output_format not in OUTPUT_FORMATS:
+                raise RuntimeError(f'invalid output format: {output_format}')
+            variants = request.get('variants', [])
+            if request.get('header'):
+                writer.write(
+                    (
+                        TSV_HEADER if output_format == 'tsv'
+                        else self._headers[build]
+                    ).encode()
+                )
+            for start in range(0, len(variants), BATCH_SIZE):
+                batch = variants[start:start + BATCH_SIZE]
+                results = await loop.run_in_executor(
+                    self._executor,
+                    partial(lookup_rows, batch, reference_build=build)
+                )
+                writer.write(
+                    ''.join(format_results(batch, results, output_format))
+                    .encode()
+                )
+                await writer.drain()
+            # release the write lock on the on-disk cache between requests
+            await loop.run_in_executor(self._executor, get_cache().commit)
+        except Exception as e:
+            writer.write(f'{ERROR_PREFIX}{e}\n'.encode())
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    async def serve(self):
+        # asyncio is only needed by the server, not by query_server clients
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.warm
+        )
+        if self.port:
+            server = await asyncio.start_server(
+                self.handle,
+                host='127.0.0.1',
+                port=self.port,
+                limit=MAX_REQUEST_BYTES
+            )
+        else:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            server = await asyncio.start_unix_server(
+                self.handle, path=self.socket_path, limit=MAX_REQUEST_BYTES
+            )
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        import asyncio
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._executor.shutdown()
+            if not self.port and os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+
+
+# Functions ====================================================================
+
+def format_results(variants, results, output_format='vcf'):
+    """Format lookup results as VCF rows, TSV rows or JSON lines
+
+    Parameters
+    ----------
+    variants
+        the queried rsids and chr:pos strings
+    results
+        results of lookup_rows for the queries
+    output_format : str
+        'vcf' for one line per dbSNP row, 'tsv' for one line per dbSNP row
+        prefixed with the query, and a line of '.' for queries that were not
+        found, or 'json' for one line per query
+
+    Yields
+    ------
+    str
+        newline-terminated output lines
+    """
+
+    for variant, (_, rows) in zip(variants, results):
+        if output_format == 'vcf':
+            for row in rows:
+                yield '\t'.join(row) + '\n'
+        elif output_format == 'tsv':
+            for row in rows:
+                yield '\t'.join((variant, *row)) + '\n'
+            if not rows:
+                yield '\t'.join((variant,) + ('.',) * len(FIELDS)) + '\n'
+        else:
+            records = [dict(zip(FIELDS, row)) for row in rows]
+            for record in records:
+                record['pos'] = int(record['pos'])
+            yield json.dumps(
+                {'query': variant, 'found': bool(rows), 'records': records}
+            ) + '\n'
+
+
+def absolute_paths(reference_build):
+    """Absolute paths of the data files of the current release of a build,
+    which identify the data a client or server reads"""
+
+    return {
+        name: os.path.abspath(path)
+        for name, path in get_pool(reference_build).paths.items()
+    }
+
+
+def connect(socket_path=SOCKET, port=None):
+    if port:
+        return socket.create_connection(('127.0.0.1', port))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def read_lines(sock):
+    with sock, sock.makefile('r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith(ERROR_PREFIX):
+                raise RuntimeError(line[len(ERROR_PREFIX):])
+            yield line
+
+
+def query_server(
+    variants,
+    reference_build='GRCh38',
+    output_format='vcf',
+    header=False,
+    socket_path=SOCKET,
+    port=None
+):
+    """Send a batch of queries to a running server
+
+    Parameters
+    ----------
+    variants
+        iterable of rsids and chr:pos strings
+    reference_build : str
+        reference build for coordinates
+    output_format : str
+        'vcf', 'tsv' or 'json'
+    header : bool
+        if True, the dbSNP VCF header is sent before the results
+    socket_path : str
+        path of the server's Unix socket
+    port : int
+        if given, connect to this localhost TCP port instead
+
+    Returns
+    -------
+    generator
+        output lines without trailing newlines
+
+    Raises
+    ------
+    OSError
+        if no server is listening
+    RuntimeError
+        when the first line is read, if the server rejects the request,
+        e.g. because it reads different data files
+    """
+
+    sock = connect(socket_path=socket_path, port=port)
+    sock.sendall(
+        (
+            json.dumps(
+                {
+                    'variants': list(variants),
+                    'reference_build': reference_build,
+                    'format': output_format,
+                    'header': header,
+                    'paths': absolute_paths(
+                        CANONICAL_BUILD[reference_build]
+                    )
+                }
+            )
+            + '\n'
+        ).encode()
+    )
+    return read_lines(sock)
+
+
+def parse_arguments():
+    parser = ArgumentParser(
+        description='serve dbSNP queries from a long-lived process'
+    )
+    parser.add_argument(
+        '--socket',
+        metavar='<path/to/socket>',
+        default=SOCKET,
+        help=f'Unix socket to listen on (default: {SOCKET})'
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        help='listen on this localhost TCP port instead of a Unix socket'
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    QueryServer(socket_path=args.socket, port=args.port).run()
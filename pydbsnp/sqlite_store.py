@@ -0,0 +1,295 @@
+#===============================================================================
+# sqlite_store.py
+#===============================================================================
+
+"""SQLite store of dbSNP records keyed by position and by rs number
+
+Records are kept in WITHOUT ROWID tables, which SQLite stores as B-trees
+clustered on their primary keys, so the records at a position and the
+coordinates of an rs number are each read from a handful of neighbouring
+pages. Records whose REF is longer than SHORT_SPAN are also listed in a table
+binned like a tabix index, so that records overlapping a position from far
+upstream are found without scanning.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import gzip
+import os
+import threading
+
+from pathlib import Path
+
+
+
+
+# Constants ====================================================================
+
+SHORT_SPAN = 64
+BIN_LEVELS = ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1))
+MAX_BINS = 100
+MAX_POSITION = 1 << 29
+MMAP_SIZE = 1 << 40
+SCHEMA = """
+CREATE TABLE contigs (contig INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE records (
+    contig INTEGER, pos INTEGER, seq INTEGER, stop INTEGER, row TEXT,
+    PRIMARY KEY (contig, pos, seq)
+) WITHOUT ROWID;
+CREATE TABLE long_records (
+    contig INTEGER, bin INTEGER, pos INTEGER, seq INTEGER, stop INTEGER,
+    PRIMARY KEY (contig, bin, pos, seq)
+) WITHOUT ROWID;
+CREATE TABLE rsids (
+    rs INTEGER, contig INTEGER, pos INTEGER,
+    PRIMARY KEY (rs, contig, pos)
+) WITHOUT ROWID;
+"""
+
+
+
+
+# Classes ======================================================================
+
+class SqliteStore():
+    """Read-only view of an SQLite store. Queries are serialized with a lock,
+    so one store can be shared by threads.
+
+    Parameters
+    ----------
+    path : str
+        path to the SQLite store
+
+    Attributes
+    ----------
+    path : str
+        path to the SQLite store
+    contigs : list
+        names of the contigs with records
+
+    Examples
+    --------
+    with SqliteStore('GCF_000001405.39.records.sqlite') as store:
+        store.by_rsid(231361)
+        store.by_region('NC_000008.11', 118184782, 118184783)
+    """
+
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        # reads are served from the OS page cache through a memory mapping
+        self._db = sqlite3.connect(
+            f'{Path(os.path.abspath(path)).as_uri()}?mode=ro',
+            uri=True,
+            check_same_thread=False
+        )
+        self._db.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        self._lock = threading.Lock()
+        self._codes = dict(
+            self._db.execute('SELECT name, contig FROM contigs ORDER BY 2')
+        )
+        self._names = {code: name for name, code in self._codes.items()}
+        self.contigs = list(self._codes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return f"SqliteStore('{self.path}')"
+
+    def by_rsid(self, rs_number):
+        """Coordinates of an rs number
+
+        Parameters
+        ----------
+        rs_number : int
+            rs number to look up
+
+        Returns
+        -------
+        list
+            (chrom, pos) tuples, empty if the rs number is not in the store
+        """
+
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT contig, pos FROM rsids WHERE rs = ?', (rs_number,)
+            ).fetchall()
+        return sorted((self._names[code], pos) for code, pos in rows)
+
+    def by_region(self, chrom, start=None, end=None):
+        """Rows of the records overlapping a region
+
+        Parameters
+        ----------
+        chrom : str
+            HGVS name of the contig
+        start : int
+            0-based start, by default the start of the contig
+        end : int
+            0-based exclusive end, by default the end of the contig
+
+        Returns
+        -------
+        list
+            VCF rows as strings, in file order
+        """
+
+        code = self._codes.get(chrom)
+        if code is None:
+            return []
+        if start is None and end is None:
+            with self._lock:
+                return [
+                    row for row, in self._db.execute(
+                        'SELECT row FROM records WHERE contig = ? '
+                        'ORDER BY pos, seq',
+                        (code,)
+                    )
+                ]
+        start = max(start or 0, 0)
+        end = MAX_POSITION if end is None else end
+        # records starting at most SHORT_SPAN - 1 bases upstream are found by
+        # their key, longer ones through their bins. CROSS JOIN keeps SQLite
+        # from scanning records upstream of the region to drive the join.
+        first = start + 2 - SHORT_SPAN
+        bins = reg2bins(start, end)
+        bin_filter = (
+            f'AND l.bin IN ({", ".join(map(str, bins))}) '
+            if len(bins) <= MAX_BINS else ''
+        )
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT r.row FROM long_records l CROSS JOIN records r '
+                'ON r.contig = l.contig AND r.pos = l.pos AND r.seq = l.seq '
+                f'WHERE l.contig = ? {bin_filter}AND l.pos < ? AND l.stop > ? '
+                'ORDER BY l.pos, l.seq',
+                (code, first, start)
+            ).fetchall()
+            rows.extend(
+                self._db.execute(
+                    'SELECT row FROM records WHERE contig = ? '
+                    'AND pos BETWEEN ? AND ? AND stop > ? ORDER BY pos, seq',
+                    (code, first, end, start)
+                )
+            )
+        return [row for row, in rows]
+
+    def close(self):
+        self._db.close()
+
+
+
+
+# Functions ====================================================================
+
+def reg2bin(start, end):
+    """Smallest tabix bin holding the 0-based region [start, end)"""
+
+    end -= 1
+    for shift, offset in BIN_LEVELS:
+        if start >> shift == end >> shift:
+            return offset + (start >> shift)
+    return 0
+
+
+def reg2bins(start, end):
+    """Tabix bins that may hold records overlapping [start, end)"""
+
+    end -= 1
+    return [0] + [
+        bin
+        for shift, offset in reversed(BIN_LEVELS)
+        for bin in range(offset + (start >> shift), offset + (end >> shift) + 1)
+    ]
+
+
+def build_sqlite_store(vcf_path, rsid_path, output_path, quiet=False):
+    """Build an SQLite store from a dbSNP VCF and its rsid index
+
+    Both inputs are read sequentially in key order, so rows are appended to
+    the B-trees and memory use does not grow with their size. The store is
+    written to a temporary path and moved into place when complete.
+
+    Parameters
+    ----------
+    vcf_path : str
+        path to the tabix-indexed dbSNP VCF
+    rsid_path : str
+        path to the rsid index produced by index.parallel_reformat_sort
+    output_path : str
+        path for the SQLite store
+    quiet : bool
+        suppress printed status updates
+    """
+
+    import sqlite3
+    from pysam import TabixFile
+    if not quiet:
+        print(f'Building SQLite store {output_path}.')
+    temp_path = f'{output_path}.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    db = sqlite3.connect(temp_path)
+    try:
+        db.executescript(
+            'PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;' + SCHEMA
+        )
+        with TabixFile(vcf_path) as vcf:
+            codes = {contig: code for code, contig in enumerate(vcf.contigs)}
+            db.executemany(
+                'INSERT INTO contigs VALUES (?, ?)',
+                ((code, contig) for contig, code in codes.items())
+            )
+            for contig, code in codes.items():
+                long_records = []
+                db.executemany(
+                    'INSERT INTO records VALUES (?, ?, ?, ?, ?)',
+                    record_rows(vcf.fetch(contig), code, long_records)
+                )
+                db.executemany(
+                    'INSERT INTO long_records VALUES (?, ?, ?, ?, ?)',
+                    long_records
+                )
+        with gzip.open(rsid_path, 'rt') as rsid:
+            db.executemany(
+                'INSERT OR IGNORE INTO rsids VALUES (?, ?, ?)',
+                (
+                    (int(rs), codes[chrom], int(pos))
+                    for _, rs, chrom, pos in (line.split() for line in rsid)
+                    if chrom in codes
+                )
+            )
+        db.commit()
+    finally:
+        db.close()
+    os.replace(temp_path, output_path)
+
+
+def record_rows(rows, code, long_records):
+    """Key the VCF rows of one contig for the records table, appending the
+    keys of records longer than SHORT_SPAN to long_records
+
+    Yields
+    ------
+    tuple
+        (contig code, pos, sequence number at pos, stop, row)
+    """
+
+    previous, seq = None, 0
+    for row in rows:
+        _, pos, _, ref, _ = row.split('\t', 4)
+        pos = int(pos)
+        seq = seq + 1 if pos == previous else 0
+        previous = pos
+        stop = pos + len(ref) - 1
+        if len(ref) > SHORT_SPAN:
+            long_records.append((code, reg2bin(pos - 1, stop), pos, seq, stop))
+        yield code, pos, seq, stop, row
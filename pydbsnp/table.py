@@ -0,0 +1,196 @@
+#===============================================================================
+# table.py
+#===============================================================================
+
+"""Load the columnar export of the dbSNP table
+
+The export is a directory with one Parquet file per contig, named after the
+contig's HGVS sequence name, and a record of the dbSNP release it was exported
+from. Reading it requires pyarrow.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import json
+import os.path
+import warnings
+
+from pydbsnp.env import BUILD_TO_TABLE, BUILD_TO_VCF
+from pydbsnp.query import CHROM_TO_HGVS, chrom_to_hgvs
+from pydbsnp.release import current_release
+
+
+
+
+# Constants ====================================================================
+
+HGVS_TO_CODE = {
+    build: {
+        hgvs: chrom
+        for chrom, hgvs in chrom_to_hgvs.items()
+        if isinstance(chrom, int)
+    }
+    for build, chrom_to_hgvs in CHROM_TO_HGVS.items()
+}
+SUFFIX = '.parquet'
+RELEASE_FILE = 'pydbsnp-release.json'
+
+
+
+
+# Functions ====================================================================
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError(
+            'pyarrow is required for the columnar table, install it with '
+            "pip install 'pydbsnp[table]'"
+        )
+    return pyarrow
+
+
+def chrom_code(hgvs, reference_build='GRCh38'):
+    """Numeric code of a chromosome: 1-22, 23 for X, 24 for Y, 25 for MT and
+    0 for any other contig
+    """
+
+    return HGVS_TO_CODE[reference_build].get(hgvs, 0)
+
+
+def read_export_release(path):
+    """Read the record of the dbSNP release an export was built from
+
+    Parameters
+    ----------
+    path : str
+        export directory
+
+    Returns
+    -------
+    dict
+        'release' names the release of the VCF, None for the configured
+        paths, and 'vcf' is the path it was read from. Empty if the export
+        has no record.
+    """
+
+    try:
+        with open(os.path.join(path, RELEASE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_export_release(path, vcf_path, release=None):
+    record_path = os.path.join(path, RELEASE_FILE)
+    with open(f'{record_path}.tmp', 'w') as f:
+        json.dump({'release': release, 'vcf': os.path.abspath(vcf_path)}, f)
+    os.replace(f'{record_path}.tmp', record_path)
+
+
+def check_export_release(path, reference_build='GRCh38'):
+    """Warn if an export was not built from the current dbSNP release
+
+    pydbsnp-index --update does not rebuild the export, so it goes stale
+    until pydbsnp-export is run again.
+    """
+
+    current = current_release(BUILD_TO_VCF[reference_build])
+    record = read_export_release(path)
+    if not record and current is None:
+        return
+    if not record:
+        warnings.warn(
+            f'{path} does not record the dbSNP release it was exported from, '
+            f'the current release is {current}; rerun pydbsnp-export'
+        )
+    elif record['release'] != current:
+        warnings.warn(
+            f"{path} was exported from dbSNP release {record['release']}, "
+            f'the current release is {current}; rerun pydbsnp-export'
+        )
+
+
+def table_contigs(reference_build='GRCh38', path=None):
+    """HGVS names of the contigs in an export, in chromosome order
+
+    Parameters
+    ----------
+    reference_build : str
+        reference build for coordinates
+    path : str
+        export directory, by default the one configured for the build
+
+    Returns
+    -------
+    list
+        contig names
+    """
+
+    path = path or BUILD_TO_TABLE[reference_build]
+    contigs = [
+        name[:-len(SUFFIX)]
+        for name in os.listdir(path)
+        if name.endswith(SUFFIX)
+    ]
+    return sorted(
+        contigs,
+        key=lambda hgvs: (chrom_code(hgvs, reference_build) or 26, hgvs)
+    )
+
+
+def load(columns=None, chroms=None, reference_build='GRCh38', path=None):
+    """Load columns of the dbSNP table. Files are memory-mapped and only the
+    requested columns of the requested chromosomes are read.
+
+    Parameters
+    ----------
+    columns
+        column names to load, by default all columns
+    chroms
+        chromosomes to load, in any naming style (chr8, 8, NC_000008.11), by
+        default all contigs
+    reference_build : str
+        reference build for coordinates
+    path : str
+        export directory, by default the one configured for the build
+
+    Returns
+    -------
+    pyarrow.Table
+        the requested columns, concatenated in chromosome order. A warning is
+        issued if the export is not of the current dbSNP release.
+
+    Examples
+    --------
+    table = load(columns=['rs', 'pos'], chroms=['chr8'])
+    df = table.to_pandas()
+    """
+
+    pyarrow = import_pyarrow()
+    path = path or BUILD_TO_TABLE[reference_build]
+    check_export_release(path, reference_build=reference_build)
+    if chroms is None:
+        contigs = table_contigs(reference_build=reference_build, path=path)
+    else:
+        contigs = [
+            chrom_to_hgvs(chrom, reference_build=reference_build)
+            for chrom in chroms
+        ]
+    tables = [
+        pyarrow.parquet.read_table(
+            os.path.join(path, f'{hgvs}{SUFFIX}'),
+            columns=None if columns is None else list(columns),
+            memory_map=True
+        )
+        for hgvs in contigs
+        if os.path.isfile(os.path.join(path, f'{hgvs}{SUFFIX}'))
+    ]
+    if not tables:
+        raise RuntimeError(f'no exported table data found in {path}')
+    return pyarrow.concat_tables(tables)
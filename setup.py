@@ -19,11 +19,16 @@ setuptools.setup(
         "Operating System :: OS Independent"
     ],
     install_requires=['pysam'],
+    extras_require={'numpy': ['numpy'], 'table': ['pyarrow']},
     entry_points={
         'console_scripts': [
             'pydbsnp-download=pydbsnp.download:main',
             'pydbsnp-index=pydbsnp.index:main',
-            'pydbsnp-query=pydbsnp.query:main'
+            'pydbsnp-export=pydbsnp.export:main',
+            'pydbsnp-query=pydbsnp.query:main',
+            'pydbsnp-serve=pydbsnp.serve:main',
+            'pydbsnp-convert=pydbsnp.convert:main',
+            'pydbsnp-benchmark=pydbsnp.benchmark:main'
         ]
     }
 )
@@ -0,0 +1,147 @@
+#===============================================================================
+# conftest.py
+#===============================================================================
+
+"""Synthetic dbSNP data shared by the tests
+
+pydbsnp.env reads its environment variables when it is imported, so they are
+set here, pointing at a temporary directory, before any test imports pydbsnp.
+The GRCh38 VCF and its indexes are built once per session.
+"""
+
+
+
+
+# Imports ======================================================================
+
+import atexit
+import os
+import random
+import shutil
+import tempfile
+
+import pytest
+
+
+
+
+# Constants ====================================================================
+
+DATA_DIR = tempfile.mkdtemp(prefix='pydbsnp-tests-')
+atexit.register(shutil.rmtree, DATA_DIR, ignore_errors=True)
+
+CONTIGS = (
+    ('NC_000001.11', 248956422),
+    ('NC_000002.12', 242193529),
+    ('NC_000008.11', 145138636)
+)
+HGVS_TO_CHROM = {'NC_000001.11': 'chr1', 'NC_000002.12': 'chr2',
+                 'NC_000008.11': 'chr8'}
+ROWS_PER_CONTIG = 500
+PATHS = {
+    'VCF': 'GCF_000001405.39.gz',
+    'RSID': 'GCF_000001405.39.rsid.gz',
+    'RSIDX': 'GCF_000001405.39.rsidx',
+    'PRESENCE': 'GCF_000001405.39.presence',
+    'POSITIONS': 'GCF_000001405.39.positions',
+    'GENES': 'GCF_000001405.39.genes.sqlite',
+    'SQLITE': 'GCF_000001405.39.records.sqlite'
+}
+
+for name, basename in PATHS.items():
+    os.environ[f'PYDBSNP_{name}_GRCH38'] = os.path.join(DATA_DIR, basename)
+    os.environ[f'PYDBSNP_{name}_GRCH37'] = os.path.join(DATA_DIR, 'missing')
+os.environ['PYDBSNP_SOCKET'] = os.path.join(DATA_DIR, 'missing.sock')
+os.environ['PYDBSNP_CACHE_SIZE'] = '0'
+os.environ['PYDBSNP_BLOCK_CACHE_MB'] = '0'
+os.environ.pop('PYDBSNP_CACHE_DB', None)
+os.environ.pop('PYDBSNP_BACKEND', None)
+
+
+
+
+# Functions ====================================================================
+
+def vcf_rows(seed=0, rows_per_contig=ROWS_PER_CONTIG):
+    """Sorted VCF rows of a synthetic release, with repeated positions,
+    multi-allelic sites, long deletions and rsids in random order
+
+    Parameters
+    ----------
+    seed : int
+        seed of the random rows
+    rows_per_contig : int
+        number of rows on each contig
+
+    Returns
+    -------
+    list
+        rows as lists of the eight VCF columns
+    """
+
+    rng = random.Random(seed)
+    rs_numbers = rng.sample(range(1, 10 * rows_per_contig * len(CONTIGS)),
+                            rows_per_contig * len(CONTIGS))
+    rows = []
+    for contig, _ in CONTIGS:
+        positions = sorted(
+            rng.randrange(10_000, 2_000_000) for _ in range(rows_per_contig)
+        )
+        for pos in positions:
+            rs = rs_numbers.pop()
+            ref = rng.choice('ACGT') * rng.choice((1, 1, 1, 2, 80))
+            alt = ','.join(rng.sample('ACGT', rng.choice((1, 1, 2))))
+            gene = rng.randrange(5)
+            info = (
+                f'RS={rs};dbSNPBuildID=150;SSR=0;'
+                f'GENEINFO=GENE{gene}:{100 + gene};VC=SNV;'
+                f'FREQ=1000Genomes:0.9,0.1|GnomAD:0.8,0.2'
+            )
+            rows.append([contig, str(pos), f'rs{rs}', ref, alt, '.', '.', info])
+    return rows
+
+
+def write_vcf(path, rows):
+    """Write rows to a bgzipped, tabix-indexed VCF at path, which must end
+    with '.gz'"""
+
+    from pysam import tabix_index
+    with open(path[:-3], 'w') as f:
+        f.write('##fileformat=VCFv4.0\n')
+        f.write('##INFO=<ID=RS,Number=1,Type=Integer,Description="rs">\n')
+        for contig, length in CONTIGS:
+            f.write(f'##contig=<ID={contig},length={length}>\n')
+        f.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        f.writelines('\t'.join(row) + '\n' for row in rows)
+    tabix_index(path[:-3], preset='vcf', force=True)
+
+
+@pytest.fixture(scope='session')
+def dbsnp():
+    """Build the synthetic GRCh38 release and all of its indexes
+
+    Returns
+    -------
+    dict
+        'rows' holds the VCF rows, and each other key the configured path of
+        a data file, as in PATHS
+    """
+
+    from pydbsnp.index import reformat_sort_index
+    paths = {
+        name.lower(): os.environ[f'PYDBSNP_{name}_GRCH38'] for name in PATHS
+    }
+    rows = vcf_rows()
+    write_vcf(paths['vcf'], rows)
+    reformat_sort_index(
+        paths['vcf'],
+        paths['rsid'],
+        paths['rsidx'],
+        processes=2,
+        quiet=True,
+        output_presence_path=paths['presence'],
+        output_positions_path=paths['positions'],
+        output_genes_path=paths['genes'],
+        output_sqlite_path=paths['sqlite']
+    )
+    return {'rows': rows, **paths}
@@ -0,0 +1,77 @@
+#===============================================================================
+# test_alleles.py
+#===============================================================================
+
+"""Allele matching must find a dbSNP record however a variant is padded or
+placed in a repeat"""
+
+
+
+
+# Imports ======================================================================
+
+import pytest
+
+from pydbsnp.alleles import alleles_match, lookup_alleles
+
+from conftest import HGVS_TO_CHROM
+
+
+
+
+# Tests ========================================================================
+
+@pytest.mark.parametrize('variant', [
+    (100, 'CA', 'C'),
+    (100, 'CAAAAG', 'CAAAG'),
+    (102, 'AA', 'A'),
+    (104, 'AG', 'G')
+])
+def test_deletion_in_repeat(variant):
+    row = ['NC_000001.11', '100', 'rs10', 'CAAAA', 'CAAA', '.', '.', '.']
+    assert alleles_match(row, *variant)
+
+
+@pytest.mark.parametrize('variant', [
+    (100, 'CA', 'CAA'),
+    (105, 'G', 'AG'),
+    (104, 'A', 'AA,T')
+])
+def test_insertion_in_repeat(variant):
+    row = ['NC_000001.11', '100', 'rs10', 'CAAAA', 'CAAAAA', '.', '.', '.']
+    assert alleles_match(row, *variant)
+
+
+@pytest.mark.parametrize('variant', [
+    (102, 'AA', 'T'),
+    (102, 'AG', 'A'),
+    (105, 'GA', 'G'),
+    (106, 'AA', 'A'),
+    (103, 'AT', 'T')
+])
+def test_different_variants(variant):
+    row = ['NC_000001.11', '100', 'rs10', 'CAAAA', 'CAAA', '.', '.', '.']
+    assert not alleles_match(row, *variant)
+
+
+def test_lookup_alleles(dbsnp):
+    shifted = next(
+        row for row in dbsnp['rows']
+        if len(row[3]) == 80 and row[3][0] in row[4].split(',')
+    )
+    snv = next(
+        row for row in dbsnp['rows']
+        if len(row[3]) == 1 and len(row[4]) == 1
+    )
+    variants = [
+        # the deletion of the dbSNP record, right-aligned in the repeat
+        (HGVS_TO_CHROM[shifted[0]], int(shifted[1]) + 1,
+         f'{shifted[3][1:]}C', 'C'),
+        # the SNV is only the second ALT of a padded multi-allelic variant
+        (HGVS_TO_CHROM[snv[0]], int(snv[1]) - 1, f'N{snv[3]}',
+         f'T{snv[3]},N{snv[4]}')
+    ]
+    assert [
+        [record.id for record in records]
+        for records in lookup_alleles(variants)
+    ] == [[shifted[2]], [snv[2]]]
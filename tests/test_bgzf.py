@@ -0,0 +1,93 @@
+#===============================================================================
+# test_bgzf.py
+#===============================================================================
+
+"""CachedTabixFile must return the same rows as pysam's TabixFile"""
+
+
+
+
+# Imports ======================================================================
+
+import os.path
+import random
+
+import pytest
+
+from pysam import TabixFile
+
+from pydbsnp.bgzf import BlockCache, CachedTabixFile
+
+from conftest import DATA_DIR, vcf_rows, write_vcf
+
+
+
+
+# Fixtures =====================================================================
+
+@pytest.fixture(scope='module')
+def large_vcf():
+    """A VCF spanning many BGZF blocks on each contig"""
+
+    path = os.path.join(DATA_DIR, 'large.vcf.gz')
+    write_vcf(path, vcf_rows(seed=1, rows_per_contig=20_000))
+    return path
+
+
+@pytest.fixture(params=[0, 256 << 10, 64 << 20], ids=['off', 'small', 'large'])
+def cache(request):
+    return BlockCache(max_bytes=request.param)
+
+
+
+
+# Tests ========================================================================
+
+def test_contigs_and_whole_contigs(large_vcf, cache):
+    with TabixFile(large_vcf) as expected, CachedTabixFile(
+        large_vcf, cache=cache
+    ) as cached:
+        assert cached.contigs == list(expected.contigs)
+        for contig in expected.contigs:
+            assert list(cached.fetch(contig)) == list(expected.fetch(contig))
+
+
+def test_vcf_regions(large_vcf, cache):
+    rng = random.Random(0)
+    with TabixFile(large_vcf) as expected, CachedTabixFile(
+        large_vcf, cache=cache
+    ) as cached:
+        for _ in range(200):
+            contig = rng.choice(expected.contigs)
+            start = rng.randrange(0, 2_100_000)
+            end = start + rng.choice((1, 2, 100, 10_000, 200_000))
+            assert list(cached.fetch(contig, start, end)) == list(
+                expected.fetch(contig, start, end)
+            ), (contig, start, end)
+
+
+def test_csi_rsid_index(dbsnp, cache):
+    rng = random.Random(0)
+    index = f'{dbsnp["rsid"]}.csi'
+    with TabixFile(dbsnp['rsid'], index=index) as expected, CachedTabixFile(
+        dbsnp['rsid'], cache=cache
+    ) as cached:
+        assert list(cached.fetch('rs')) == list(expected.fetch('rs'))
+        for _ in range(50):
+            start = rng.randrange(0, 16_000)
+            end = start + rng.choice((1, 10, 1000))
+            assert list(cached.fetch('rs', start, end)) == list(
+                expected.fetch('rs', start, end)
+            ), (start, end)
+
+
+def test_interleaved_iterators(large_vcf, cache):
+    with TabixFile(large_vcf) as expected, CachedTabixFile(
+        large_vcf, cache=cache
+    ) as cached:
+        contig = expected.contigs[0]
+        interleaved = []
+        for row in cached.fetch(contig, 0, 100_000):
+            interleaved.append(row)
+            next(cached.fetch(contig, 1_500_000, 1_500_100), None)
+        assert interleaved == list(expected.fetch(contig, 0, 100_000))
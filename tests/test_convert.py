@@ -0,0 +1,37 @@
+#===============================================================================
+# test_convert.py
+#===============================================================================
+
+"""pydbsnp-convert must pass headers through and map each data line"""
+
+
+
+
+# Imports ======================================================================
+
+import pytest
+
+from pydbsnp.convert import MAPPED, UNMAPPED, convert_lines
+
+
+
+
+# Tests ========================================================================
+
+@pytest.mark.parametrize('comments', [[], ['# sumstats']])
+def test_tsv_column_header(dbsnp, comments):
+    row = dbsnp['rows'][0]
+    data = [f'chr1\t{row[1]}\t0.5', 'chr1\t5\t0.1']
+    lines = comments + ['CHR\tPOS\tBETA'] + data
+    assert list(
+        convert_lines(lines, from_build='GRCh38', to_build='GRCh38')
+    ) == [(MAPPED, line) for line in comments] + [
+        (UNMAPPED, 'CHR\tPOS\tBETA'), (MAPPED, data[0]), (UNMAPPED, data[1])
+    ]
+    assert list(
+        convert_lines(
+            lines, from_build='GRCh38', to_build='GRCh38', header=True
+        )
+    ) == [(MAPPED, line) for line in comments + ['CHR\tPOS\tBETA']] + [
+        (MAPPED, data[0]), (UNMAPPED, data[1])
+    ]
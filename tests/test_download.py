@@ -0,0 +1,48 @@
+#===============================================================================
+# test_download.py
+#===============================================================================
+
+"""The checksum of a download in ranges must not depend on arrival order"""
+
+
+
+
+# Imports ======================================================================
+
+import hashlib
+import os.path
+import random
+
+import pytest
+
+from pydbsnp.download import PrefixMD5
+
+from conftest import DATA_DIR
+
+
+
+
+# Tests ========================================================================
+
+@pytest.mark.parametrize('max_buffered', [0, 10_000, 1 << 20])
+def test_prefix_md5_out_of_order(max_buffered):
+    rng = random.Random(max_buffered)
+    data = rng.randbytes(200_000)
+    path = os.path.join(DATA_DIR, 'download')
+    with open(path, 'wb') as f:
+        f.write(data)
+    pieces = [
+        (start, data[start:start + 3000]) for start in range(0, len(data), 3000)
+    ]
+    rng.shuffle(pieces)
+    md5 = PrefixMD5(path, max_buffered=max_buffered)
+    frontier = 0
+    done = set()
+    for start, piece in pieces:
+        md5.feed(start, piece)
+        done.add(start)
+        while frontier in done:
+            frontier += 3000
+        md5.catch_up(min(frontier, len(data)))
+    assert md5.hashed == len(data)
+    assert md5.hexdigest() == hashlib.md5(data).hexdigest()
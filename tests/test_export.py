@@ -0,0 +1,43 @@
+#===============================================================================
+# test_export.py
+#===============================================================================
+
+"""The columnar export must hold the rows of the VCF and warn when it is not
+of the current release"""
+
+
+
+
+# Imports ======================================================================
+
+import warnings
+
+import pytest
+
+from pydbsnp.export import export
+from pydbsnp.table import load, read_export_release, write_export_release
+
+from conftest import CONTIGS
+
+
+
+
+# Tests ========================================================================
+
+def test_export(dbsnp, tmp_path):
+    pytest.importorskip('pyarrow')
+    (tmp_path / 'NC_000012.12.parquet').write_bytes(b'')
+    export(dbsnp['vcf'], str(tmp_path), quiet=True)
+    assert read_export_release(str(tmp_path))['release'] is None
+    assert sorted(p.name for p in tmp_path.glob('*.parquet')) == sorted(
+        f'{contig}.parquet' for contig, _ in CONTIGS
+    )
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        table = load(columns=['rs', 'pos'], path=str(tmp_path))
+    assert list(zip(table['rs'].to_pylist(), table['pos'].to_pylist())) == [
+        (int(row[2][2:]), int(row[1])) for row in dbsnp['rows']
+    ]
+    write_export_release(str(tmp_path), dbsnp['vcf'], release='20200101T0000')
+    with pytest.warns(UserWarning, match='rerun pydbsnp-export'):
+        load(columns=['rs'], path=str(tmp_path))
@@ -0,0 +1,61 @@
+#===============================================================================
+# test_handles.py
+#===============================================================================
+
+"""Shared handles must keep open iterators independent of other lookups"""
+
+
+
+
+# Imports ======================================================================
+
+import pytest
+
+from pydbsnp.annotation import join_sorted
+from pydbsnp.bgzf import configure_block_cache
+from pydbsnp.handles import close_all
+from pydbsnp.query import Variant
+from pydbsnp.regions import fetch_regions
+
+
+
+
+# Fixtures =====================================================================
+
+@pytest.fixture(params=[0, 64 << 20], ids=['pysam', 'block-cache'])
+def block_cache(request, dbsnp):
+    close_all()
+    configure_block_cache(max_bytes=request.param)
+    yield request.param
+    close_all()
+    configure_block_cache(max_bytes=0)
+
+
+
+
+# Tests ========================================================================
+
+def test_region_iterator_with_interleaved_lookups(dbsnp, block_cache):
+    chr1 = [row for row in dbsnp['rows'] if row[0] == 'NC_000001.11']
+    records = []
+    for record in fetch_regions([('chr1', 0, 300_000_000)]):
+        Variant(id=chr1[-1][2])
+        records.append(record.id)
+    assert records == [row[2] for row in chr1]
+
+
+def test_join_sorted_with_interleaved_lookups(dbsnp, block_cache):
+    chr1 = [row for row in dbsnp['rows'] if row[0] == 'NC_000001.11']
+    items = [('chr1', int(row[1]), row[2]) for row in chr1]
+    joined = []
+    for rsid, rows in join_sorted(items):
+        Variant(id=chr1[0][2])
+        joined.append((rsid, [row[2] for row in rows]))
+    expected = [
+        (
+            rsid,
+            [row[2] for row in chr1 if int(row[1]) == pos]
+        )
+        for _, pos, rsid in items
+    ]
+    assert joined == expected
@@ -0,0 +1,151 @@
+#===============================================================================
+# test_index.py
+#===============================================================================
+
+"""Index builds must hold exactly the rows of the VCF they are built from"""
+
+
+
+
+# Imports ======================================================================
+
+import gzip
+import os.path
+import random
+
+from pydbsnp.index import (
+    merge_bucket, reformat_sort_index, rs_key, update_index
+)
+from pydbsnp.positions import PositionIndex
+from pydbsnp.presence import PresenceIndex
+from pydbsnp.release import RELEASE_DIR
+
+from conftest import CONTIGS, vcf_rows, write_vcf
+
+
+
+
+# Functions ====================================================================
+
+def read_rsid_rows(rsid_path):
+    with gzip.open(rsid_path, 'rt') as f:
+        return f.read().splitlines(keepends=True)
+
+
+
+
+# Tests ========================================================================
+
+def test_presence(dbsnp):
+    with PresenceIndex(dbsnp['presence']) as presence:
+        assert all(
+            presence.has_rs(int(row[2][2:])) for row in dbsnp['rows']
+        )
+        assert all(
+            presence.has_position(row[0], int(row[1]))
+            for row in dbsnp['rows']
+        )
+        rs_numbers = {int(row[2][2:]) for row in dbsnp['rows']}
+        assert presence.rs_many(range(max(rs_numbers) + 8)) == [
+            rs in rs_numbers for rs in range(max(rs_numbers) + 8)
+        ]
+
+
+def test_positions(dbsnp):
+    with PositionIndex(dbsnp['positions']) as positions:
+        for contig, _ in CONTIGS:
+            assert list(positions.positions(contig)) == sorted(
+                {int(row[1]) for row in dbsnp['rows'] if row[0] == contig}
+            )
+
+
+def test_merge_bucket(dbsnp, tmp_path):
+    rng = random.Random(0)
+    base = read_rsid_rows(dbsnp['rsid'])
+    runs, expected = [], [
+        row for row in base if row.split('\t')[2] != 'NC_000002.12'
+    ]
+    for i in range(3):
+        run = sorted(
+            (
+                f'rs\t{rng.randrange(1, 20_000)}\tNC_000002.12\t'
+                f'{rng.randrange(10_000, 2_000_000)}\n'
+                for _ in range(200)
+            ),
+            key=rs_key
+        )
+        run_path = tmp_path / f'run.{i}'
+        run_path.write_text(''.join(run))
+        runs.append(str(run_path))
+        expected.extend(run)
+    bucket, piece_path = merge_bucket(
+        (0, runs),
+        str(tmp_path),
+        base_rsid_path=dbsnp['rsid'],
+        dropped=('NC_000002.12',)
+    )
+    assert bucket == 0
+    assert read_rsid_rows(piece_path) == sorted(expected, key=rs_key)
+    assert not any(os.path.exists(run_path) for run_path in runs)
+
+
+def test_update_index(tmp_path):
+    rng = random.Random(0)
+    old_rows = vcf_rows(seed=5, rows_per_contig=300)
+    new_rows = []
+    for row in old_rows:
+        if row[0] == 'NC_000001.11' and rng.random() < 0.1:
+            continue
+        if row[0] == 'NC_000002.12':
+            row = row[:7] + [row[7].replace('VC=SNV', 'VC=MNV')]
+        new_rows.append(row)
+    new_rows.insert(
+        sum(row[0] == 'NC_000001.11' for row in new_rows),
+        ['NC_000001.11', '2500000', 'rs99999', 'A', 'C', '.', '.', 'RS=99999']
+    )
+    paths = {
+        name: str(tmp_path / 'current' / f'dbsnp.{name}')
+        for name in ('vcf.gz', 'rsid.gz', 'rsidx', 'presence', 'positions')
+    }
+    (tmp_path / 'current').mkdir()
+    write_vcf(paths['vcf.gz'], old_rows)
+    reformat_sort_index(
+        paths['vcf.gz'],
+        paths['rsid.gz'],
+        paths['rsidx'],
+        quiet=True,
+        output_presence_path=paths['presence'],
+        output_positions_path=paths['positions']
+    )
+    new_path = str(tmp_path / 'new.vcf.gz')
+    write_vcf(new_path, new_rows)
+    full_path = str(tmp_path / 'full.vcf.gz')
+    write_vcf(full_path, new_rows)
+    reformat_sort_index(
+        full_path,
+        str(tmp_path / 'full.rsid.gz'),
+        str(tmp_path / 'full.rsidx'),
+        quiet=True,
+        output_presence_path=str(tmp_path / 'full.presence'),
+        output_positions_path=str(tmp_path / 'full.positions')
+    )
+    assert update_index(
+        new_path,
+        paths['vcf.gz'],
+        paths['rsid.gz'],
+        paths['rsidx'],
+        processes=2,
+        quiet=True,
+        output_presence_path=paths['presence'],
+        output_positions_path=paths['positions']
+    ) == (['NC_000001.11'], [], [])
+    release, = os.listdir(tmp_path / 'current' / RELEASE_DIR)
+    release_dir = tmp_path / 'current' / RELEASE_DIR / release
+    assert read_rsid_rows(release_dir / 'dbsnp.rsid.gz') == read_rsid_rows(
+        tmp_path / 'full.rsid.gz'
+    )
+    for name in 'rsidx', 'presence', 'positions':
+        assert (release_dir / f'dbsnp.{name}').read_bytes() == (
+            tmp_path / f'full.{name}'
+        ).read_bytes()
+    assert not os.path.exists(new_path)
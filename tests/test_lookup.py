@@ -0,0 +1,116 @@
+#===============================================================================
+# test_lookup.py
+#===============================================================================
+
+"""Batched lookups must agree with the rows of the VCF and with single
+lookups, whichever backend and index answer them"""
+
+
+
+
+# Imports ======================================================================
+
+import random
+
+import pytest
+
+from pydbsnp.backends import get_backend
+from pydbsnp.handles import close_all, get_pool
+from pydbsnp.query import Variant, iter_lookup_rows, lookup_rows
+
+from conftest import CONTIGS, HGVS_TO_CHROM
+
+
+
+
+# Fixtures =====================================================================
+
+@pytest.fixture
+def queries(dbsnp):
+    """Random rsid and chr:pos queries, with repeats and misses"""
+
+    rng = random.Random(0)
+    rows = rng.sample(dbsnp['rows'], 300)
+    queries = [row[2] for row in rows[:150]] + [
+        f'{HGVS_TO_CHROM[row[0]]}:{row[1]}' for row in rows[150:]
+    ]
+    queries += rng.sample(queries, 50)
+    queries += ['rs99999999', 'chr1:5', 'chr8:2100000']
+    rng.shuffle(queries)
+    return queries
+
+
+@pytest.fixture(params=['rsid-array', 'rsid-index', 'sqlite'])
+def backend(request, dbsnp, monkeypatch):
+    close_all()
+    if request.param == 'rsid-index':
+        monkeypatch.setattr(
+            type(get_pool()), 'rsid_array', property(lambda self: None)
+        )
+    monkeypatch.setattr(
+        'pydbsnp.query.get_backend',
+        lambda reference_build='GRCh38': get_backend(
+            reference_build,
+            name='sqlite' if request.param == 'sqlite' else 'tabix'
+        )
+    )
+    yield request.param
+    close_all()
+
+
+
+
+# Functions ====================================================================
+
+def expected_rows(rows, query):
+    """(coordinates, rows) of a query, read from the rows of the VCF: the
+    records overlapping the position, or each position of the rsid, as with
+    a tabix fetch"""
+
+    if query.startswith('rs'):
+        coordinates = [(row[0], int(row[1])) for row in rows if row[2] == query]
+    else:
+        chrom, pos = query.split(':')
+        hgvs = {v: k for k, v in HGVS_TO_CHROM.items()}[chrom]
+        coordinates = [(hgvs, int(pos))]
+    return coordinates, [
+        row for chrom, pos in coordinates for row in rows
+        if row[0] == chrom and int(row[1]) <= pos < int(row[1]) + len(row[3])
+    ]
+
+
+
+
+# Tests ========================================================================
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_lookup_rows(dbsnp, queries, backend, workers):
+    assert lookup_rows(queries, workers=workers) == [
+        expected_rows(dbsnp['rows'], query) for query in queries
+    ]
+
+
+def test_iter_lookup_rows_in_batches(dbsnp, queries, backend):
+    assert list(iter_lookup_rows(queries, batch_size=7)) == lookup_rows(
+        queries
+    )
+
+
+def test_lookup_rows_match_single_lookups(dbsnp, queries, backend):
+    for query, (coordinates, rows) in zip(queries, lookup_rows(queries)):
+        if query.startswith('rs'):
+            kwargs = {'id': query}
+        else:
+            chrom, pos = query.split(':')
+            kwargs = {'chrom': chrom, 'pos': int(pos)}
+        if not rows:
+            with pytest.raises(ValueError):
+                Variant(**kwargs)
+            continue
+        variant = Variant(**kwargs)
+        assert (variant.chrom, variant.pos) == coordinates[-1]
+        assert (variant.id, variant.ref, variant.alt) == tuple(rows[-1][2:5])
+
+
+def test_contigs_of_every_backend(dbsnp, backend):
+    assert sorted(get_backend().contigs) == sorted(c for c, _ in CONTIGS)
@@ -0,0 +1,30 @@
+#===============================================================================
+# test_package.py
+#===============================================================================
+
+"""Lazy exports of the package must not be hidden by its submodules"""
+
+
+
+
+# Imports ======================================================================
+
+import importlib
+import os
+import types
+
+import pydbsnp
+
+
+
+
+# Tests ========================================================================
+
+def test_exports_after_importing_submodules():
+    for filename in os.listdir(os.path.dirname(pydbsnp.__file__)):
+        if filename.endswith('.py') and filename != '__init__.py':
+            importlib.import_module(f'pydbsnp.{filename[:-3]}')
+    for name, module in pydbsnp._EXPORTS.items():
+        value = getattr(pydbsnp, name)
+        assert not isinstance(value, types.ModuleType), name
+        assert value is getattr(importlib.import_module(module), name)
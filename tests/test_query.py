@@ -0,0 +1,70 @@
+#===============================================================================
+# test_query.py
+#===============================================================================
+
+"""pydbsnp-query must answer every kind of query in every output format"""
+
+
+
+
+# Imports ======================================================================
+
+import json
+
+from argparse import Namespace
+
+import pytest
+
+from pydbsnp.query import iter_queries, write_lookups
+
+
+
+
+# Functions ====================================================================
+
+def query_args(output_format):
+    return Namespace(
+        reference_build='GRCh38',
+        output_format=output_format,
+        no_header=True,
+        info_filter=[],
+        jobs=1,
+        batch_size=2
+    )
+
+
+
+
+# Tests ========================================================================
+
+@pytest.mark.parametrize('output_format', ['vcf', 'tsv', 'json'])
+def test_regions_mixed_with_lookups(dbsnp, output_format, capsys):
+    chr1 = [row for row in dbsnp['rows'] if row[0] == 'NC_000001.11']
+    start, end = int(chr1[0][1]), int(chr1[2][1])
+    in_region = [
+        row for row in chr1
+        if int(row[1]) <= end and int(row[1]) + len(row[3]) > start
+    ]
+    queries = [chr1[5][2], f'chr1:{start}-{end}', chr1[3][2], chr1[4][2]]
+    write_lookups(
+        query_args(output_format), iter_queries(queries, regions=True)
+    )
+    output = capsys.readouterr().out.splitlines()
+    expected = [[chr1[5]], in_region, [chr1[3]], [chr1[4]]]
+    if output_format == 'vcf':
+        assert output == [
+            '\t'.join(row) for rows in expected for row in rows
+        ]
+    elif output_format == 'tsv':
+        assert output == [
+            '\t'.join((query, *row))
+            for query, rows in zip(queries, expected) for row in rows
+        ]
+    else:
+        assert [
+            (record['query'], [r['id'] for r in record['records']])
+            for record in map(json.loads, output)
+        ] == [
+            (query, [row[2] for row in rows])
+            for query, rows in zip(queries, expected)
+        ]
@@ -0,0 +1,66 @@
+#===============================================================================
+# test_serve.py
+#===============================================================================
+
+"""The query server must only answer clients that read the same data"""
+
+
+
+
+# Imports ======================================================================
+
+import json
+import os.path
+import threading
+import time
+
+import pytest
+
+from pydbsnp.serve import QueryServer, connect, query_server, read_lines
+
+from conftest import DATA_DIR
+
+
+
+
+# Fixtures =====================================================================
+
+@pytest.fixture(scope='module')
+def server(dbsnp):
+    socket_path = os.path.join(DATA_DIR, 'test.sock')
+    threading.Thread(
+        target=QueryServer(socket_path).run, daemon=True
+    ).start()
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.05)
+    return socket_path
+
+
+
+
+# Tests ========================================================================
+
+def test_server_answers_client_with_same_data(dbsnp, server):
+    row = dbsnp['rows'][0]
+    assert list(query_server([row[2]], socket_path=server)) == [
+        '\t'.join(row)
+    ]
+
+
+def test_server_refuses_client_with_other_data(dbsnp, server):
+    sock = connect(socket_path=server)
+    sock.sendall(
+        (
+            json.dumps(
+                {
+                    'variants': [dbsnp['rows'][0][2]],
+                    'paths': {'vcf': os.path.join(DATA_DIR, 'other.gz')}
+                }
+            )
+            + '\n'
+        ).encode()
+    )
+    with pytest.raises(RuntimeError, match='different dbSNP files'):
+        list(read_lines(sock))